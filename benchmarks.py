@@ -0,0 +1,325 @@
+# benchmarks.py
+"""
+Бенчмарки разбора, рендера, ответов чата, публикации и холодного старта на синтетических данных.
+
+    python benchmarks.py                          # 1k / 10k / 100k строк
+    python benchmarks.py --sizes 1000 10000 --only parse render
+    python benchmarks.py --out bench.json --compare benchmarks/baseline.json
+
+Результаты пишутся в JSON (по умолчанию benchmarks/<дата>.json). С --compare
+выводится отношение к прошлому прогону, замедление больше --threshold помечается.
+Сеть не нужна: листы берутся из генератора sheetController, Telegram — FakeBot.
+"""
+import os
+
+# Офлайн окружение до импорта модулей бота
+os.environ.setdefault("STATE_BACKEND", "memory")
+os.environ.setdefault("SHEET_SOURCE", "synthetic:10")
+os.environ.setdefault("IMAGE_PREFLIGHT", "0")
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable
+
+import generalController
+import reportingController
+import telegramController
+from jobController import JobProgress
+from locationsController import LOCATIONS
+from sheetController import generate_faq, generate_general, generate_stock
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000)
+FAQ_SIZES = {1_000: 50, 10_000: 200, 100_000: 1_000}  # вопросов на каждом размере
+MIN_ROUNDS = 3
+MAX_ROUNDS = 20
+TARGET_SECONDS = 2.0  # примерно столько длится один сценарий на одном размере
+RESULTS_DIR = Path("benchmarks")
+
+
+class FakeBot:
+    """Bot без сети: отвечает сразу и считает вызовы."""
+
+    def __init__(self):
+        self.next_id = 0
+        self.calls: dict[str, int] = {}
+
+    def _msg(self, method: str):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        self.next_id += 1
+        return _Message(self.next_id)
+
+    async def send_message(self, *args, **kwargs):
+        return self._msg("send_message")
+
+    async def send_photo(self, *args, **kwargs):
+        return self._msg("send_photo")
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        return [self._msg("send_media_group") for _ in media]
+
+    async def delete_message(self, *args, **kwargs):
+        self.calls["delete_message"] = self.calls.get("delete_message", 0) + 1
+        return True
+
+
+class _Message:
+    __slots__ = ("message_id", "photo")
+
+    def __init__(self, message_id: int):
+        self.message_id = message_id
+        self.photo = None
+
+
+def measure(fn: Callable[[], object], setup: Callable[[], None] | None = None) -> dict:
+    """Несколько прогонов fn до TARGET_SECONDS; setup вызывается перед каждым и не замеряется."""
+    times: list[float] = []
+    started = time.perf_counter()
+    while len(times) < MIN_ROUNDS or (time.perf_counter() - started < TARGET_SECONDS and len(times) < MAX_ROUNDS):
+        if setup:
+            setup()
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return {
+        "rounds": len(times),
+        "min":    round(min(times), 6),
+        "median": round(statistics.median(times), 6),
+        "mean":   round(statistics.fmean(times), 6),
+        "max":    round(max(times), 6),
+    }
+
+
+def clear_stage_caches() -> None:
+    for fn in (reportingController.parse_report, reportingController.render_city_block, reportingController.chunk_city_block):
+        fn.cache_clear()
+
+
+# === Сценарии: каждый получает размер и возвращает замер ===
+
+def bench_parse(rows: int) -> dict:
+    raw = generate_stock(rows)
+    df = reportingController.csv_bytes_to_df(raw)
+    return measure(lambda: reportingController.parse_stock_data_from_csv(df))
+
+
+def bench_csv_to_df(rows: int) -> dict:
+    raw = generate_stock(rows)
+    return measure(lambda: reportingController.csv_bytes_to_df(raw))
+
+
+def bench_render(rows: int) -> dict:
+    """MarkdownV2 рендер блоков городов и split_text_safe (без кэша этапов)."""
+    model = reportingController.parse_report(generate_stock(rows))
+    return measure(lambda: reportingController.render_report(model), setup=clear_stage_caches)
+
+
+def bench_split(rows: int) -> dict:
+    model = reportingController.parse_report(generate_stock(rows))
+    text = "\n\n".join(reportingController.render_city_block(cfg["ru"], model["cities"][slug])["text"]
+                       for slug, cfg in LOCATIONS.items())
+    return measure(lambda: reportingController.split_text_safe(text, reportingController.MESSAGE_LIMIT))
+
+
+def bench_item_caption(rows: int) -> dict:
+    items = generalController.parse_general(generate_general(rows))
+    return measure(lambda: [generalController.build_item_caption(r) for r in items])
+
+
+def bench_find_answer(rows: int) -> dict:
+    """find_answer по базе из FAQ_SIZES[rows] вопросов; нужен nltk и pymorphy2."""
+    import chatController  # тяжёлые зависимости, только для этого сценария
+
+    chatController.question_vectors = chatController.load_qa_from_sheet(generate_faq(FAQ_SIZES.get(rows, 100)))
+    queries = ["Есть ли наличии смартфон?", "Сколько стоит чехол для часы", "когда будет ноутбук", "привет"]
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):  # find_answer печатает ответы
+            for q in queries:
+                chatController.find_answer(q)
+
+    return measure(run)
+
+
+def bench_update_reports(rows: int) -> dict:
+    """Весь путь публикации: разбор, рендер, план и отправка в FakeBot (лимиты Telegram отключены)."""
+    raw = generate_stock(rows)
+    bots: list[FakeBot] = []
+
+    def setup():
+        clear_stage_caches()
+        reportingController.save_report_data({})
+        bots.append(FakeBot())
+
+    def run():
+        asyncio.run(reportingController.update_reports(None, bots[-1], progress=JobProgress(), raw=raw))
+
+    result = measure(run, setup)
+    result["calls"] = bots[-1].calls
+    return result
+
+
+CHATTER = ("привет", "есть в наличии?", "сколько стоит", "а доставка есть", "спасибо")
+
+
+def bench_routing(rows: int) -> dict:
+    """
+    rows сообщений участников группы, не адресованных боту: стоимость прохода
+    апдейта через middleware и фильтры диспетчера main.py (ответов нет, сеть не нужна).
+    """
+    from aiogram import Bot, types
+
+    import main
+    from fakeTelegram import FAKE_TOKEN, generate_updates
+
+    bot = Bot(token=FAKE_TOKEN)
+    dp = main.create_dispatcher()
+    updates = [types.Update.model_validate(u, context={"bot": bot})
+               for u in generate_updates(max(1, rows // 5), per_user=5, texts=CHATTER)]
+
+    async def flood():
+        for update in updates:
+            await dp.feed_update(bot, update)
+
+    result = measure(lambda: asyncio.run(flood()))
+    result["per_update_us"] = round(result["median"] / len(updates) * 1e6, 2)
+    return result
+
+
+STARTUP_SCRIPT = """
+import asyncio, json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from fakeTelegram import FakeTelegram, generate_updates
+
+async def first_update():
+    async with FakeTelegram() as tg:
+        bot = tg.bot()
+        dp = main.create_dispatcher()
+        await dp.feed_raw_update(bot, generate_updates(1, texts=("get_chat_id",))[0])
+        await bot.session.close()
+
+asyncio.run(first_update())
+print(json.dumps({"import": imported - started, "first_update": time.perf_counter() - started,
+                  "heavy": [m for m in ("pandas", "nltk", "pymorphy2") if m in sys.modules]}))
+"""
+
+
+def bench_startup(rows: int) -> dict:
+    """Холодный старт в новом процессе: от запуска интерпретатора до обработанного первого апдейта."""
+    runs: list[dict] = []
+
+    def run():
+        out = subprocess.check_output([sys.executable, "-c", STARTUP_SCRIPT], text=True, stderr=subprocess.DEVNULL)
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+
+    result = measure(run)
+    result["import_main"] = round(statistics.median(r["import"] for r in runs), 4)
+    result["first_update"] = round(statistics.median(r["first_update"] for r in runs), 4)
+    result["heavy_loaded"] = runs[-1]["heavy"]
+    return result
+
+
+SCENARIOS: dict[str, Callable[[int], dict]] = {
+    "csv_to_df":      bench_csv_to_df,
+    "parse":          bench_parse,
+    "render":         bench_render,
+    "split":          bench_split,
+    "item_caption":   bench_item_caption,
+    "find_answer":    bench_find_answer,
+    "update_reports": bench_update_reports,
+    "routing":        bench_routing,
+    "startup":        bench_startup,
+}
+SIZELESS = {"startup"}  # не зависят от размера таблицы, выполняются один раз
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def run(sizes: list[int], only: list[str] | None = None) -> dict:
+    # Лимиты Telegram замеряются отдельно (fakeTelegram); здесь — только собственная работа бота
+    telegramController.LIMITER = telegramController.RateLimiter(rate=1e9, burst=10**9)
+    results: dict[str, dict] = {}
+    for name, scenario in SCENARIOS.items():
+        if only and name not in only:
+            continue
+        results[name] = {}
+        for size in ([0] if name in SIZELESS else sizes):
+            try:
+                res = scenario(size)
+            except ImportError as e:
+                res = {"skipped": f"нет зависимости: {e.name}"}
+            results[name][str(size)] = res
+            if "skipped" in res:
+                print(f"{name:15} {size:>7}: пропущен ({res['skipped']})")
+                break
+            print(f"{name:15} {size:>7}: median {res['median'] * 1000:10.2f} мс  min {res['min'] * 1000:10.2f} мс  ({res['rounds']} прогонов)")
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": sizes,
+        },
+        "results": results,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> int:
+    """Печатает отношение медиан к прошлому прогону. Возвращает число регрессий."""
+    regressions = 0
+    for name, by_size in current["results"].items():
+        for size, res in by_size.items():
+            old = baseline.get("results", {}).get(name, {}).get(size)
+            if not old or "median" not in old or "median" not in res:
+                continue
+            ratio = res["median"] / old["median"] if old["median"] else float("inf")
+            mark = ""
+            if ratio > 1 + threshold:
+                mark = "  <-- медленнее"
+                regressions += 1
+            print(f"{name:15} {size:>7}: {ratio:5.2f}x{mark}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--only", nargs="+", choices=list(SCENARIOS))
+    parser.add_argument("--out", type=Path)
+    parser.add_argument("--compare", type=Path, help="JSON прошлого прогона")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление, доля (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    result = run(args.sizes, args.only)
+    out = args.out or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты: {out}")
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+        return 1 if compare(result, baseline, args.threshold) else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,25 +1,38 @@
 # ChatController.py
 
 import asyncio
-import nltk, math, io, urllib.request, csv, random
+import math, io, csv, random
 from collections import Counter
-from nltk.corpus import wordnet
-import pymorphy2
+from functools import cache
 
 from reportingController import get_report
+from sheetController import fetch_tab_sync
 
-# Если корпуса ещё не скачаны
-nltk.download('punkt', quiet=True)
-nltk.download('wordnet', quiet=True)
-nltk.download('omw-1.4', quiet=True)
 
-# Морфологический разбор
-morph = pymorphy2.MorphAnalyzer()
+@cache
+def nlp():
+    """
+    nltk, WordNet и словари pymorphy2 грузятся несколько секунд, поэтому не при импорте,
+    а при первом вопросе или фоновым прогревом (warm_up). Возвращает (nltk, wordnet, morph).
+    """
+    import nltk
+    import pymorphy2
+
+    # Если корпуса ещё не скачаны
+    nltk.download('punkt', quiet=True)
+    nltk.download('wordnet', quiet=True)
+    nltk.download('omw-1.4', quiet=True)
+    from nltk.corpus import wordnet
+
+    # Морфологический разбор
+    return nltk, wordnet, pymorphy2.MorphAnalyzer()
 
 def lemmatize(tokens):
+    morph = nlp()[2]
     return [morph.parse(t)[0].normal_form for t in tokens]
 
 def expand_with_synonyms(lemmas):
+    _, wordnet, morph = nlp()
     s = set(lemmas)
     for w in lemmas:
         for syn in wordnet.synsets(w):
@@ -29,7 +42,7 @@ def expand_with_synonyms(lemmas):
     return s
 
 def text_to_vector(text):
-    tokens  = nltk.word_tokenize(text.lower())
+    tokens  = nlp()[0].word_tokenize(text.lower())
     lemmas  = lemmatize(tokens)
     expanded = expand_with_synonyms(lemmas)
     return Counter(expanded), set(lemmas)
@@ -41,12 +54,9 @@ def cosine_similarity(v1, v2):
           * math.sqrt(sum(v**2 for v in v2.values()))
     return num / den if den else 0.0
 
-def load_qa_from_sheet():
-    SHEET_ID = "1NRGPRwpMyXTe9LhS4adwfPo7nyx68GqweYdAdqo3LpM"
-    GID      = "384502621"
-    url      = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=csv&gid={GID}"
-    resp     = urllib.request.urlopen(url)
-    reader   = csv.DictReader(io.TextIOWrapper(resp, encoding='utf-8'))
+def load_qa_from_sheet(raw=None):
+    raw      = raw if raw is not None else fetch_tab_sync("faq")
+    reader   = csv.DictReader(io.StringIO(raw.decode('utf-8-sig')))
     qa       = []
     for row in reader:
         questions = [q.strip() for q in row['Варианты вопросов'].split(';') if q.strip()]
@@ -66,12 +76,27 @@ def build_question_vectors():
     return load_qa_from_sheet()
 
 
+def get_question_vectors():
+    """База вопросов строится при первом обращении (загрузка листа и лемматизация)."""
+    global question_vectors
+    if question_vectors is None:
+        question_vectors = build_question_vectors()
+    return question_vectors
+
+
+def warm_up():
+    """Фоновый прогрев: модели и база вопросов до первого сообщения в чате."""
+    nlp()
+    get_question_vectors()
+
+
 # Глобальный стейт
-question_vectors = build_question_vectors()
+question_vectors = None
 chat_listener_active = False
 THRESHOLD = 0.6
 
 def find_answer(user_text, user_id=None, send_func=None):
+    question_vectors = get_question_vectors()
     v_user, lemmas = text_to_vector(user_text)
 
     candidates = []
@@ -96,13 +121,18 @@ def find_answer(user_text, user_id=None, send_func=None):
             mode, city = parts[0], parts[1]
         else:
             mode, city = parts[0] + " " + parts[1], parts[2]
-        report = get_report(city, mode)
-        print(report)
-
         if user_id and send_func:
-            asyncio.create_task(send_func(user_id, f"<b>Отчет {mode} в {city}:</b>\n\n{report}"))
+            # Снимок таблицы может понадобиться скачать — не блокируем цикл событий
+            async def send_report():
+                report = await get_report(city, mode)
+                print(report)
+                await send_func(user_id, f"<b>Отчет {mode} в {city}:</b>\n\n{report}")
+
+            asyncio.create_task(send_report())
             return None, True  # Отчет отправлен
         else:
+            report = asyncio.run(get_report(city, mode))  # вызов вне цикла событий (проверка из консоли)
+            print(report)
             return f"<b>Отчет {mode} в {city}:</b>\n\n{report}", False
 
     return answer, False
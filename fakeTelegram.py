@@ -0,0 +1,514 @@
+# fakeTelegram.py
+"""
+Локальная замена Bot API для нагрузочных проверок без токена и реального чата.
+
+    python fakeTelegram.py serve [--port 8081]        # сервер; бот: TELEGRAM_API_URL=http://127.0.0.1:8081
+    python fakeTelegram.py replay --users 2000 --per-user 3 --latency 0.05 --rate-limit-every 50
+    python fakeTelegram.py check                      # публикация отчёта в фейковый чат с проверками
+    python fakeTelegram.py replay --strict 0.1        # ошибка, если event loop блокировался дольше 0.1 с
+
+replay поднимает сервер в процессе, создаёт диспетчер main.py и одновременно
+отдаёт ему апдейты от тысяч участников группы, затем печатает пропускную
+способность обработчиков и p50/p99 задержки (от поступления апдейта до конца обработки).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import time
+from itertools import count
+
+from aiohttp import web
+
+from markupController import visible_len
+
+FAKE_TOKEN = "123456:FAKE-TOKEN"
+FAKE_BOT_ID = 123456
+GROUP_CHAT_ID = -1001234567890
+INT_PARAMS = {"chat_id", "message_id", "message_thread_id", "offset", "timeout", "limit",
+              "from_chat_id", "reply_to_message_id"}
+
+# Что пишут участники группы в replay; большинство сообщений не попадает ни в один обработчик
+GROUP_TEXTS = ("привет", "есть в наличии?", "сколько стоит", "get_chat_id", "Просмотреть акции", "/jobs")
+
+
+def _chat(chat_id) -> dict:
+    if not isinstance(chat_id, int):
+        chat_id = GROUP_CHAT_ID  # @username канала
+    if chat_id < 0:
+        return {"id": chat_id, "type": "supergroup", "title": "Fake group", "is_forum": True}
+    return {"id": chat_id, "type": "private", "first_name": f"user{chat_id}"}
+
+
+def _parse_value(key: str, value):
+    if not isinstance(value, str):
+        return value  # загружаемый файл
+    if key in INT_PARAMS and value.lstrip("-").isdigit():
+        return int(value)
+    if value[:1] in "[{":
+        try:
+            return json.loads(value)
+        except ValueError:
+            pass
+    return value
+
+
+class FakeTelegram:
+    """
+    Bot API на aiohttp: sendMessage, sendPhoto, sendMediaGroup, editMessageText/Caption/ReplyMarkup,
+    deleteMessage, pinChatMessage, getUpdates и пр. Сообщения хранятся по чатам для проверок.
+
+    latency, jitter   — задержка ответа, с (latency + случайная доля до jitter)
+    rate_limit_every  — каждый N-й вызов отправки отвечает 429 с retry_after
+    group_limit       — сообщений в минуту в одну группу, сверх — 429 (как у Telegram, 20)
+    """
+
+    SEND_METHODS = {"sendmessage", "sendphoto", "sendmediagroup", "senddocument", "copymessage"}
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit_every: int = 0,
+        retry_after: int = 1,
+        group_limit: int = 0,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = max(1, retry_after)  # retry_after 0 aiogram не считает ограничением
+        self.group_limit = group_limit
+        self.random = random.Random(seed)
+        self.runner: web.AppRunner | None = None
+        self.base_url = ""
+        self.reset()
+
+    def reset(self) -> None:
+        self.chats: dict[int, dict[int, dict]] = {}   # chat_id → {message_id: message}
+        self.deleted: dict[int, set[int]] = {}
+        self.pinned: dict[int, int] = {}
+        self.calls: list[dict] = []                   # {"method", "params", "status"}
+        self.updates: list[dict] = []
+        self._update_ids = count(1)
+        self._message_ids = count(1)
+        self._file_ids = count(1)
+        self._send_count = 0
+        self._group_sent: dict[int, list[float]] = {}
+        self._new_updates = asyncio.Event()
+
+    # --- сервер ---------------------------------------------------------------
+
+    def build_app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self.runner = web.AppRunner(self.build_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def stop(self) -> None:
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def __aenter__(self) -> "FakeTelegram":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    def bot(self, token: str = FAKE_TOKEN):
+        """aiogram Bot, который ходит в этот сервер."""
+        from aiogram import Bot
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+
+        return Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(self.base_url)))
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = {k: _parse_value(k, v) for k, v in (await request.post()).items()}
+        if method.lower() != "getupdates" and (self.latency or self.jitter):
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        if (error := self.rate_limited(method.lower(), params)) is not None:
+            self.calls.append({"method": method, "params": params, "status": 429})
+            return web.json_response(error, status=429)
+        handler = getattr(self, f"api_{method.lower()}", None)
+        try:
+            result = await handler(params) if handler else True
+        except FakeApiError as e:
+            self.calls.append({"method": method, "params": params, "status": e.code})
+            return web.json_response({"ok": False, "error_code": e.code, "description": e.description}, status=e.code)
+        self.calls.append({"method": method, "params": params, "status": 200})
+        return web.json_response({"ok": True, "result": result})
+
+    def rate_limited(self, method: str, params: dict) -> dict | None:
+        if method not in self.SEND_METHODS:
+            return None
+        self._send_count += 1
+        retry_after = None
+        if self.rate_limit_every and self._send_count % self.rate_limit_every == 0:
+            retry_after = self.retry_after
+        chat_id = params.get("chat_id")
+        if self.group_limit and isinstance(chat_id, int) and chat_id < 0:
+            now = time.monotonic()
+            sent = [t for t in self._group_sent.get(chat_id, []) if now - t < 60]
+            if len(sent) >= self.group_limit:
+                retry_after = max(retry_after or 0, int(60 - (now - sent[0])) + 1)
+            else:
+                sent.append(now)
+            self._group_sent[chat_id] = sent
+        if retry_after is None:
+            return None
+        return {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after}}
+
+    # --- методы Bot API ---------------------------------------------------------
+
+    def _store(self, params: dict, **fields) -> dict:
+        chat_id = params["chat_id"]
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": _chat(chat_id),
+            "from": {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "FakeBot"},
+            **fields,
+        }
+        if params.get("message_thread_id"):
+            message["message_thread_id"] = params["message_thread_id"]
+            message["is_topic_message"] = True
+        if (params.get("reply_markup") or {}).get("inline_keyboard"):
+            message["reply_markup"] = params["reply_markup"]  # обычную клавиатуру Telegram в ответе не возвращает
+        self.chats.setdefault(message["chat"]["id"], {})[message["message_id"]] = message
+        return message
+
+    def _photo(self) -> list[dict]:
+        n = next(self._file_ids)
+        return [{"file_id": f"photo-{n}", "file_unique_id": f"u{n}", "width": 1280, "height": 960}]
+
+    def _existing(self, params: dict, action: str) -> dict:
+        message = self.chats.get(_chat(params.get("chat_id"))["id"], {}).get(params.get("message_id"))
+        if message is None:
+            raise FakeApiError(400, f"Bad Request: message to {action} not found")
+        return message
+
+    @staticmethod
+    def _check_caption(params: dict):
+        caption = params.get("caption") or ""
+        if caption and visible_len(caption, params.get("parse_mode")) > 1024:
+            raise FakeApiError(400, "Bad Request: message caption is too long")
+
+    async def api_getme(self, params: dict):
+        return {"id": FAKE_BOT_ID, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+    async def api_sendmessage(self, params: dict):
+        text = params.get("text") or ""
+        if not text.strip():
+            raise FakeApiError(400, "Bad Request: message text is empty")
+        # Лимиты Telegram считаются по видимому тексту после разбора разметки
+        if visible_len(text, params.get("parse_mode")) > 4096:
+            raise FakeApiError(400, "Bad Request: message is too long")
+        return self._store(params, text=text)
+
+    async def api_sendphoto(self, params: dict):
+        self._check_caption(params)
+        fields = {"photo": self._photo()}
+        if params.get("caption"):
+            fields["caption"] = params["caption"]
+        return self._store(params, **fields)
+
+    async def api_senddocument(self, params: dict):
+        n = next(self._file_ids)
+        return self._store(params, document={"file_id": f"doc-{n}", "file_unique_id": f"d{n}"}, caption=params.get("caption"))
+
+    async def api_sendmediagroup(self, params: dict):
+        media = params.get("media") or []
+        if not 2 <= len(media) <= 10:
+            raise FakeApiError(400, "Bad Request: wrong number of media in the group")
+        group_id = str(next(self._file_ids))
+        messages = []
+        for item in media:
+            self._check_caption(item)
+            fields = {"photo": self._photo(), "media_group_id": group_id}
+            if item.get("caption"):
+                fields["caption"] = item["caption"]
+            messages.append(self._store(params, **fields))
+        return messages
+
+    async def api_editmessagetext(self, params: dict):
+        message = self._existing(params, "edit")
+        if visible_len(params.get("text") or "", params.get("parse_mode")) > 4096:
+            raise FakeApiError(400, "Bad Request: message is too long")
+        if message.get("text") == params.get("text") and message.get("reply_markup") == params.get("reply_markup"):
+            raise FakeApiError(400, "Bad Request: message is not modified")
+        message["text"] = params.get("text")
+        message["reply_markup"] = params.get("reply_markup")
+        message["edit_date"] = int(time.time())
+        return message
+
+    async def api_editmessagecaption(self, params: dict):
+        message = self._existing(params, "edit")
+        self._check_caption(params)
+        if message.get("caption") == params.get("caption"):
+            raise FakeApiError(400, "Bad Request: message is not modified")
+        message["caption"] = params.get("caption")
+        message["edit_date"] = int(time.time())
+        return message
+
+    async def api_editmessagereplymarkup(self, params: dict):
+        message = self._existing(params, "edit")
+        if message.get("reply_markup") == params.get("reply_markup"):
+            raise FakeApiError(400, "Bad Request: message is not modified")
+        message["reply_markup"] = params.get("reply_markup")
+        return message
+
+    async def api_deletemessage(self, params: dict):
+        message = self._existing(params, "delete")
+        chat_id = message["chat"]["id"]
+        del self.chats[chat_id][message["message_id"]]
+        self.deleted.setdefault(chat_id, set()).add(message["message_id"])
+        return True
+
+    async def api_pinchatmessage(self, params: dict):
+        message = self._existing(params, "pin")
+        self.pinned[message["chat"]["id"]] = message["message_id"]
+        return True
+
+    async def api_unpinchatmessage(self, params: dict):
+        self.pinned.pop(_chat(params.get("chat_id"))["id"], None)
+        return True
+
+    async def api_getupdates(self, params: dict):
+        offset = params.get("offset") or 0
+        if offset:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and params.get("timeout"):
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), params["timeout"])
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[: params.get("limit") or 100]
+
+    # --- апдейты и проверки -----------------------------------------------------
+
+    def push_update(self, update: dict) -> dict:
+        """Кладёт апдейт в очередь getUpdates (update_id проставляется, если не задан)."""
+        update.setdefault("update_id", next(self._update_ids))
+        self.updates.append(update)
+        self._new_updates.set()
+        return update
+
+    def messages(self, chat_id: int, thread_id: int | None = None) -> list[dict]:
+        """Сообщения чата, которые сейчас существуют, в порядке отправки."""
+        msgs = sorted(self.chats.get(chat_id, {}).values(), key=lambda m: m["message_id"])
+        if thread_id is not None:
+            msgs = [m for m in msgs if m.get("message_thread_id") == thread_id]
+        return msgs
+
+    def call_count(self, method: str, status: int | None = 200) -> int:
+        return sum(1 for c in self.calls if c["method"].lower() == method.lower() and (status is None or c["status"] == status))
+
+    def assert_sent(self, chat_id: int, count: int | None = None, contains: str | None = None, thread_id: int | None = None) -> list[dict]:
+        msgs = self.messages(chat_id, thread_id)
+        if count is not None:
+            assert len(msgs) == count, f"в чате {chat_id} сообщений {len(msgs)}, ожидалось {count}"
+        if contains is not None:
+            assert any(contains in (m.get("text") or m.get("caption") or "") for m in msgs), \
+                f"в чате {chat_id} нет сообщения с «{contains}»"
+        return msgs
+
+    def assert_deleted(self, chat_id: int, message_ids) -> None:
+        missing = set(message_ids) - self.deleted.get(chat_id, set())
+        assert not missing, f"в чате {chat_id} не удалены сообщения {sorted(missing)}"
+
+    def assert_calls(self, method: str, count: int) -> None:
+        actual = self.call_count(method)
+        assert actual == count, f"{method}: вызовов {actual}, ожидалось {count}"
+
+
+class FakeApiError(Exception):
+    def __init__(self, code: int, description: str):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+
+
+# === Воспроизведение нагрузки ===
+
+def generate_updates(users: int, per_user: int = 1, chat_id: int = GROUP_CHAT_ID, thread_id: int | None = None,
+                     texts=GROUP_TEXTS, seed: int = 0) -> list[dict]:
+    """Сообщения users участников группы, по per_user от каждого, вперемешку (update_id по возрастанию)."""
+    rnd = random.Random(seed)
+    updates = []
+    ids = count(1)
+    for user_id in range(1, users + 1):
+        for _ in range(per_user):
+            n = next(ids)
+            message = {
+                "message_id": 10_000_000 + n,
+                "date": int(time.time()),
+                "chat": _chat(chat_id),
+                "from": {"id": 10_000 + user_id, "is_bot": False, "first_name": f"user{user_id}"},
+                "text": rnd.choice(texts),
+            }
+            if thread_id:
+                message["message_thread_id"] = thread_id
+                message["is_topic_message"] = True
+            if message["text"].startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(message["text"])}]
+            updates.append({"message": message})
+    rnd.shuffle(updates)
+    for update_id, update in enumerate(updates, 1):
+        update["update_id"] = update_id
+    return updates
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+async def replay(dp, bot, updates: list[dict], concurrency: int = 8) -> dict:
+    """
+    Все апдейты поступают одновременно и разбираются concurrency обработчиками,
+    как в webhook режиме. Задержка считается от начала воспроизведения (включая очередь).
+    """
+    sem = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+    started = time.perf_counter()
+
+    async def one(update: dict):
+        nonlocal errors
+        async with sem:
+            try:
+                await dp.feed_raw_update(bot, update)
+            except Exception:
+                errors += 1
+                logging.debug("Ошибка обработки апдейта", exc_info=True)
+        latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(u) for u in updates))
+    elapsed = time.perf_counter() - started
+    return {
+        "updates": len(updates),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(updates) / elapsed, 1) if elapsed else 0.0,
+        "p50": round(percentile(latencies, 50), 4),
+        "p99": round(percentile(latencies, 99), 4),
+        "max": round(max(latencies, default=0.0), 4),
+        "errors": errors,
+    }
+
+
+async def run_replay(args) -> dict:
+    # Без внешних зависимостей: состояние в памяти, таблица синтетическая
+    os.environ.setdefault("STATE_BACKEND", "memory")
+    os.environ.setdefault("SHEET_SOURCE", "synthetic:10")
+    import main  # импортируется после настройки окружения
+    from metricsController import METRICS, instrument_bot
+    from profilerController import PROFILER
+
+    server = FakeTelegram(latency=args.latency, jitter=args.jitter, rate_limit_every=args.rate_limit_every)
+    await server.start()
+    bot = server.bot()
+    instrument_bot(bot)
+    try:
+        dp = main.create_dispatcher()
+        updates = generate_updates(args.users, args.per_user, seed=args.seed)
+        if args.strict:
+            # Любая блокировка event loop дольше порога — ошибка со стеком виновника
+            async with PROFILER.watchdog.strict(args.strict):
+                result = await replay(dp, bot, updates, args.concurrency)
+        else:
+            result = await replay(dp, bot, updates, args.concurrency)
+    finally:
+        await bot.session.close()
+        await server.stop()
+    result["api_calls"] = {}
+    for call in server.calls:
+        key = call["method"] if call["status"] == 200 else f"{call['method']} {call['status']}"
+        result["api_calls"][key] = result["api_calls"].get(key, 0) + 1
+    result["metrics"] = METRICS.snapshot()
+    return result
+
+
+async def check_publish(rows: int = 200) -> None:
+    """Отчёт публикуется в фейковый чат, затем заново: старые сообщения должны быть удалены."""
+    os.environ.setdefault("STATE_BACKEND", "memory")
+    os.environ.setdefault("SHEET_SOURCE", "synthetic:10")
+    os.environ.setdefault("IMAGE_PREFLIGHT", "0")
+    import reportingController
+    import telegramController
+    from sheetController import generate_stock
+
+    telegramController.LIMITER = telegramController.RateLimiter(rate=1e9, burst=10**9)
+    reportingController.CHAT_ID = GROUP_CHAT_ID
+    raw = generate_stock(rows)
+    async with FakeTelegram(rate_limit_every=40) as tg:
+        bot = tg.bot()
+        try:
+            await reportingController.update_reports(None, bot, raw=raw)
+            ids = [mid for ids in reportingController.load_report_data().values() for mid in ids]
+            tg.assert_sent(GROUP_CHAT_ID, count=len(ids))
+            await reportingController.update_reports(None, bot, raw=raw)
+            tg.assert_deleted(GROUP_CHAT_ID, ids)
+            tg.assert_sent(GROUP_CHAT_ID, count=len(ids))
+        finally:
+            await bot.session.close()
+    print(f"OK: {len(ids)} сообщений, 429: {sum(c['status'] == 429 for c in tg.calls)}")
+
+
+async def serve(args):
+    server = FakeTelegram(latency=args.latency, jitter=args.jitter, rate_limit_every=args.rate_limit_every)
+    url = await server.start(port=args.port)
+    print(f"Fake Bot API: {url} (TELEGRAM_API_URL={url}, токен любой вида 123:ABC)")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["serve", "replay", "check"])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--per-user", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--strict", type=float, default=0, help="с, replay падает при блокировке event loop дольше")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("aiogram.event").setLevel(logging.CRITICAL)  # ошибки обработчиков (429) считаются в отчёте
+    if args.mode == "serve":
+        asyncio.run(serve(args))
+        sys.exit(0)
+    if args.mode == "check":
+        asyncio.run(check_publish())
+        sys.exit(0)
+    report = asyncio.run(run_replay(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
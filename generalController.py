@@ -1,39 +1,32 @@
 # generalController.py
-import csv, io, asyncio, urllib.request, re
-from aiogram import Bot, types
+import csv, io
+from aiogram import Bot
 
-# --- константы и util --------------------------------------------------------
-
-GID_GENERAL = "1339673984"
-URL_GENERAL = (
-    "https://docs.google.com/spreadsheets/"
-    "d/1NRGPRwpMyXTe9LhS4adwfPo7nyx68GqweYdAdqo3LpM/"
-    f"export?format=csv&gid={GID_GENERAL}"
-)
+from jobController import JobProgress
+from markupController import esc, esc_attr, split_message
+from mediaController import media_ops
+from pipelineController import describe_plan, execute_plan, prepare_plan_media
+from sheetController import GIDS, fetch_tab_sync, sheet_url
 
-HTML_ESC = re.compile(r"[&<>]")
+# --- константы и util --------------------------------------------------------
 
-def esc(text: str) -> str:
-    return HTML_ESC.sub(lambda m: {"&":"&amp;","<":"&lt;",">":"&gt;"}[m.group()], text)
+GID_GENERAL = GIDS["general"]
+URL_GENERAL = sheet_url(GID_GENERAL)
 
 def split_safe(text: str, limit: int) -> list[str]:
-    """Делит текст по строкам, не превышая limit."""
-    lines, parts, cur = text.splitlines(keepends=True), [], ""
-    for ln in lines:
-        if len(cur) + len(ln) > limit:
-            parts.append(cur.rstrip())
-            cur = ln
-        else:
-            cur += ln
-    if cur.strip():
-        parts.append(cur.rstrip())
-    return parts
+    """Делит HTML текст на части по видимой длине, не ломая теги (см. split_message)."""
+    return split_message(text, limit, "HTML")
 
 # --- загрузка ----------------------------------------------------------------
 
+def fetch_general_bytes() -> bytes:
+    return fetch_tab_sync("general")
+
+def parse_general(raw: bytes) -> list[dict[str, str]]:
+    return list(csv.DictReader(io.StringIO(raw.decode("utf-8-sig"))))
+
 def fetch_general() -> list[dict[str, str]]:
-    resp = urllib.request.urlopen(URL_GENERAL)
-    return list(csv.DictReader(io.TextIOWrapper(resp, "utf-8")))
+    return parse_general(fetch_general_bytes())
 
 def build_item_caption(row: dict[str, str]) -> str | None:
     row = {k.strip(): v.strip() for k, v in row.items()}
@@ -46,29 +39,32 @@ def build_item_caption(row: dict[str, str]) -> str | None:
     price_order     = esc(row.get("Под заказ", ""))
     link_order      = row.get("Под заказ ссылка", "")
 
-    txt = f"<a href='{link}'>{name}</a> {desc}" if link else f"{name} {desc}"
+    txt = f"<a href='{esc_attr(link)}'>{name}</a> {desc}" if link else f"{name} {desc}"
     if reviews:
-        txt += f" <a href='{reviews}'>Отзывы</a>"
+        txt += f" <a href='{esc_attr(reviews)}'>Отзывы</a>"
     if price_order:
-        txt += f" <a href='{link_order}'>Под заказ {price_order}</a>" if link_order else f" Под заказ {price_order}"
+        txt += f" <a href='{esc_attr(link_order)}'>Под заказ {price_order}</a>" if link_order else f" Под заказ {price_order}"
     elif link_order:
-        txt += f" <a href='{link_order}'>Под заказ</a>"
+        txt += f" <a href='{esc_attr(link_order)}'>Под заказ</a>"
     return txt
 
 # --- публикация --------------------------------------------------------------
 
-async def send_general(bot: Bot, chat_id: int, thread_id: int | None = None) -> None:
-    rows = fetch_general()
+def build_general_plan(rows: list[dict[str, str]], chat_id: int, thread_id: int | None = None) -> list[dict]:
+    """План отправки поста в общую (формат плана — pipelineController)."""
+    plan: list[dict] = []
     if not rows:
-        return
+        return plan
+
+    def text_op(text: str):
+        plan.append({"method": "send_message", "chat_id": chat_id, "thread_id": thread_id,
+                     "text": text, "parse_mode": "HTML"})
 
     beg_txt = rows[0].get("В начале", "").strip()
     end_txt = rows[0].get("В конце", "").strip()
 
     if beg_txt:
-        await bot.send_message(chat_id, f"<b>{esc(beg_txt)}</b>",
-                               parse_mode="HTML", message_thread_id=thread_id)
-        await asyncio.sleep(0.3)
+        text_op(f"<b>{esc(beg_txt)}</b>")
 
     # собираем все строки и фото
     texts, photos = [], []
@@ -83,23 +79,38 @@ async def send_general(bot: Bot, chat_id: int, thread_id: int | None = None) ->
 
     full_text = "\n\n".join(texts)
 
-    if photos:                                    # отправляем медиа-группой
-        cap, *rest = split_safe(full_text, 1024)  # 1024 для caption
-        media = [types.InputMediaPhoto(media=photos[0], caption=cap, parse_mode="HTML")]
-        media += [types.InputMediaPhoto(media=u) for u in photos[1:10]]  # max 10
-        await bot.send_media_group(chat_id, media, message_thread_id=thread_id)
-
-        remaining = "\n".join(rest)
-        for chunk in split_safe(remaining, 4000):  # 4000 пост-лимит
-            await bot.send_message(chat_id, chunk, parse_mode="HTML",
-                                   message_thread_id=thread_id)
-            await asyncio.sleep(0.3)
+    if photos:                                    # отправляем медиа-группами по 10
+        # 1024 для caption, 4000 пост-лимит
+        cap, *chunks = split_message(full_text, 4000, "HTML", first_limit=1024) or [""]
+        plan.extend(media_ops(photos, cap, "HTML", chat_id, thread_id))
     else:                                         # без фото — просто текстами
-        for chunk in split_safe(full_text, 4000):
-            await bot.send_message(chat_id, chunk, parse_mode="HTML",
-                                   message_thread_id=thread_id)
-            await asyncio.sleep(0.3)
+        chunks = split_safe(full_text, 4000)
+    for chunk in chunks:
+        text_op(chunk)
 
     if end_txt:
-        await bot.send_message(chat_id, f"<b>{esc(end_txt)}</b>",
-                               parse_mode="HTML", message_thread_id=thread_id)
+        text_op(f"<b>{esc(end_txt)}</b>")
+    return plan
+
+async def send_general(
+    bot: Bot,
+    chat_id: int,
+    thread_id: int | None = None,
+    progress: JobProgress | None = None,
+    dry_run: bool = False,
+    rows: list[dict[str, str]] | None = None,
+) -> dict | None:
+    """dry_run — ничего не отправляем, возвращаем план (describe_plan); rows — готовые строки вместо загрузки."""
+    progress = progress or JobProgress()
+    if rows is None:
+        with progress.timed("загрузка"):
+            rows = fetch_general()
+    plan = build_general_plan(rows, chat_id, thread_id)
+    if dry_run:
+        return describe_plan(plan)
+
+    with progress.timed("проверка фото"):
+        plan = await prepare_plan_media(plan, progress)
+    with progress.timed("отправка"):
+        await execute_plan(bot, plan, progress=progress)
+    return None
@@ -0,0 +1,352 @@
+# jobController.py
+import asyncio
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from aiogram import Bot, types
+
+from metricsController import METRICS
+
+# === Single-flight: одновременные запросы одной публикации объединяются ===
+#
+# Пока публикация идёт, повторный запрос не запускает вторую копию,
+# а ставит одну следующую публикацию в очередь. Все запросы, пришедшие
+# во время работы, ждут именно её — она возьмёт свежие данные таблицы.
+
+STARTED = "started"  # запрос запустил публикацию
+QUEUED  = "queued"   # поставлен следующий запуск после текущего
+MERGED  = "merged"   # присоединён к уже поставленному следующему запуску
+
+
+class SingleFlight:
+    def __init__(self):
+        self._running: dict[str, asyncio.Task] = {}
+        self._pending: dict[str, asyncio.Future] = {}
+        self._pending_factory: dict[str, Callable[[], Awaitable[Any]]] = {}
+
+    def is_running(self, key: str) -> bool:
+        task = self._running.get(key)
+        return task is not None and not task.done()
+
+    def submit(self, key: str, factory: Callable[[], Awaitable[Any]]) -> tuple[asyncio.Future, str]:
+        """
+        Запрашивает выполнение factory() под ключом key.
+        Возвращает future с результатом «своего» запуска и статус: STARTED, QUEUED или MERGED.
+        Для следующего запуска используется factory последнего запроса.
+        """
+        pending = self._pending.get(key)
+        if pending is not None:
+            self._pending_factory[key] = factory
+            return pending, MERGED
+
+        if not self.is_running(key):
+            task = asyncio.create_task(self._run(key, factory))
+            self._running[key] = task
+            return task, STARTED
+
+        pending = asyncio.get_running_loop().create_future()
+        self._pending[key] = pending
+        self._pending_factory[key] = factory
+        self._running[key].add_done_callback(lambda _: self._start_pending(key))
+        return pending, QUEUED
+
+    def _start_pending(self, key: str):
+        pending = self._pending.pop(key, None)
+        factory = self._pending_factory.pop(key, None)
+        if pending is None or factory is None:
+            return
+        task = asyncio.create_task(self._run(key, factory))
+        self._running[key] = task
+
+        def relay(t: asyncio.Task):
+            if pending.done():
+                return
+            if t.cancelled():
+                pending.cancel()
+            elif t.exception() is not None:
+                pending.set_exception(t.exception())
+            else:
+                pending.set_result(t.result())
+
+        task.add_done_callback(relay)
+
+    async def _run(self, key: str, factory: Callable[[], Awaitable[Any]]):
+        try:
+            return await factory()
+        except Exception:
+            logging.exception(f"Ошибка публикации '{key}'")
+            raise
+        finally:
+            if self._running.get(key) is asyncio.current_task():
+                self._running.pop(key, None)
+
+
+FLIGHTS = SingleFlight()
+
+
+# === Фоновые задачи публикаций с прогрессом в чате администратора ===
+
+class JobProgress:
+    """Прогресс и замеры времени задачи. Публикация обновляет его по ходу работы."""
+
+    def __init__(self):
+        self.done = 0            # обработано городов/блоков
+        self.total = 0           # всего городов/блоков
+        self.messages = 0        # отправлено сообщений
+        self.stage = ""          # текущий этап
+        self.timings: dict[str, float] = {}
+        self.warnings: list[str] = []  # например пропущенные битые фото
+
+    def set(self, done: int | None = None, total: int | None = None):
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+
+    def add_messages(self, count: int = 1):
+        self.messages += count
+
+    @contextmanager
+    def timed(self, stage: str):
+        """Замеряет этап; повторные замеры одного этапа суммируются."""
+        self.stage = stage
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+            METRICS.observe("bot_job_stage_seconds", elapsed, stage=stage)
+
+    def render(self) -> str:
+        text = f"{self.done}/{self.total} городов, {self.messages} сообщений" if self.total else f"{self.messages} сообщений"
+        return f"{text} ({self.stage})" if self.stage else text
+
+
+PENDING   = "pending"
+RUNNING   = "running"
+DONE      = "done"
+FAILED    = "failed"
+CANCELLED = "cancelled"
+
+JOB_STATUS_RU = {
+    PENDING:   "в очереди",
+    RUNNING:   "выполняется",
+    DONE:      "завершена",
+    FAILED:    "ошибка",
+    CANCELLED: "отменена",
+}
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    title: str
+    chat_id: int | None      # None — фоновая задача без сообщения прогресса (например по расписанию)
+    status: str = PENDING
+    progress: JobProgress = field(default_factory=JobProgress)
+    created: float = field(default_factory=time.time)
+    started: float | None = None
+    finished: float | None = None
+    error: str | None = None
+    watchers: set[int] = field(default_factory=set)  # чаты, которые ждут итог объединённой задачи
+    task: asyncio.Task | None = None
+    progress_message_id: int | None = None
+    finished_event: asyncio.Event = field(default_factory=asyncio.Event)
+    runner: Callable[[JobProgress], Awaitable[Any]] | None = field(default=None, repr=False)
+    priority: int = 0        # запрос с приоритетом не ниже заменяет собой задачу в очереди
+    key: str = ""            # ключ SingleFlight
+    bot: Bot | None = field(default=None, repr=False)
+
+    @property
+    def duration(self) -> float:
+        if not self.started:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def summary(self) -> str:
+        lines = [f"Задача #{self.id} «{self.title}»: {JOB_STATUS_RU[self.status]}"]
+        if self.status == RUNNING:
+            lines.append(self.progress.render())
+        if self.started:
+            lines.append(f"Время: {self.duration:.1f} с")
+        if self.progress.timings:
+            lines.append(", ".join(f"{k} {v:.1f} с" for k, v in self.progress.timings.items()))
+        if self.status in (DONE, CANCELLED) and self.progress.messages:
+            lines.append(f"Отправлено сообщений: {self.progress.messages}")
+        if self.progress.warnings:
+            lines.append(f"Предупреждений: {len(self.progress.warnings)}")
+            lines += self.progress.warnings[:5]
+        if self.error:
+            lines.append(f"Ошибка: {self.error}")
+        return "\n".join(lines)
+
+
+def get_job_cancel_kb(job_id: str):
+    return types.InlineKeyboardMarkup(
+        inline_keyboard=[[types.InlineKeyboardButton(text="Отменить", callback_data=f"job_cancel:{job_id}")]]
+    )
+
+
+class JobRunner:
+    """
+    Запускает публикации фоном поверх SingleFlight: обработчик сразу получает
+    номер задачи, а ход работы показывается в одном редактируемом сообщении.
+    """
+
+    PROGRESS_INTERVAL = 1.5  # не чаще одного редактирования в 1.5 с
+    HISTORY = 20
+
+    def __init__(self, flights: SingleFlight = FLIGHTS):
+        self.flights = flights
+        self.jobs: dict[str, Job] = {}
+        self._pending: dict[str, Job] = {}
+        self.on_finish: list[Callable[[Job], Any]] = []  # вызываются после завершения любой задачи
+
+    def submit(
+        self,
+        bot: Bot,
+        key: str,
+        kind: str,
+        title: str,
+        chat_id: int | None,
+        runner: Callable[[JobProgress], Awaitable[Any]],
+        priority: int = 0,
+    ) -> tuple[Job, str]:
+        """
+        Ставит задачу и сразу возвращает её вместе со статусом SingleFlight.
+        Если под ключом уже ждёт задача, запрос присоединяется к ней (MERGED). Как и в SingleFlight,
+        выполнится последний запрос: его runner, вид и заголовок заменяют ожидающие, если
+        priority не ниже приоритета ожидающей задачи (полная публикация не уступает частичной).
+        """
+        pending = self._pending.get(key)
+        if pending is not None and pending.status == PENDING:
+            if priority >= pending.priority:
+                pending.runner, pending.kind, pending.title, pending.priority = runner, kind, title, priority
+            if pending.chat_id is None:
+                pending.chat_id = chat_id
+            elif chat_id is not None:
+                pending.watchers.add(chat_id)
+            return pending, MERGED
+
+        job = Job(id=uuid.uuid4().hex[:6], kind=kind, title=title, chat_id=chat_id, runner=runner,
+                  priority=priority, key=key, bot=bot)
+        self.jobs[job.id] = job
+        self._trim()
+
+        async def execute():
+            if self._pending.get(key) is job:
+                self._pending.pop(key, None)
+            if job.status == CANCELLED:
+                return
+            await self._execute(bot, job, job.runner)
+
+        fut, status = self.flights.submit(key, execute)
+        job.task = fut if status == STARTED else None
+        if status != STARTED:
+            self._pending[key] = job
+        if status == MERGED:
+            # Ожидавшая задача была отменена: эта встала вместо неё следующей
+            status = QUEUED
+        return job, status
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.jobs.get(job_id)
+        if not job or job.status not in (PENDING, RUNNING):
+            return False
+        if job.status == PENDING:
+            job.status = CANCELLED
+            job.finished = time.time()
+            if self._pending.get(job.key) is job:
+                self._pending.pop(job.key, None)
+            asyncio.create_task(self._complete(job.bot, job))
+            return True
+        if job.task is not None:
+            job.task.cancel()
+        return True
+
+    async def wait(self, job: Job) -> Job:
+        """Ждёт завершения задачи (в том числе поставленной в очередь или объединённой)."""
+        await job.finished_event.wait()
+        return job
+
+    def recent(self) -> list[Job]:
+        return sorted(self.jobs.values(), key=lambda j: j.created, reverse=True)
+
+    def _trim(self):
+        finished = [j for j in self.recent() if j.status not in (PENDING, RUNNING)]
+        for job in finished[self.HISTORY:]:
+            self.jobs.pop(job.id, None)
+
+    async def _execute(self, bot: Bot, job: Job, runner: Callable[[JobProgress], Awaitable[Any]]):
+        job.task = asyncio.current_task()
+        job.task.set_name(f"задача {job.kind} #{job.id}")  # контекст для сторожа зависаний
+        job.status = RUNNING
+        job.started = time.time()
+        reporter = asyncio.create_task(self._report(bot, job))
+        try:
+            await runner(job.progress)
+            job.status = DONE
+        except asyncio.CancelledError:
+            job.status = CANCELLED
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e) or e.__class__.__name__
+            logging.exception(f"Задача #{job.id} завершилась с ошибкой")
+        finally:
+            job.finished = time.time()
+            reporter.cancel()
+            await self._complete(bot, job)
+
+    async def _complete(self, bot: Bot, job: Job):
+        """Итог в чат, пробуждение ожидающих и колбэки — и для выполненной, и для отменённой в очереди задачи."""
+        await self._finish(bot, job)
+        job.finished_event.set()
+        logging.info(f"Задача #{job.id} {job.kind}: {job.status} за {job.duration:.2f} с {job.progress.timings}")
+        for callback in self.on_finish:
+            try:
+                callback(job)
+            except Exception:
+                logging.exception(f"Ошибка обработчика завершения задачи #{job.id}")
+
+    async def _report(self, bot: Bot, job: Job):
+        """Периодически редактирует сообщение прогресса в чате администратора."""
+        last = None
+        if job.chat_id is None:
+            return
+        try:
+            msg = await bot.send_message(job.chat_id, job.summary(), reply_markup=get_job_cancel_kb(job.id))
+            job.progress_message_id = msg.message_id
+            while True:
+                await asyncio.sleep(self.PROGRESS_INTERVAL)
+                text = job.summary()
+                if text != last:
+                    last = text
+                    await bot.edit_message_text(
+                        text=text, chat_id=job.chat_id, message_id=job.progress_message_id,
+                        reply_markup=get_job_cancel_kb(job.id),
+                    )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logging.exception(f"Не удалось обновить прогресс задачи #{job.id}")
+
+    async def _finish(self, bot: Bot, job: Job):
+        text = job.summary()
+        try:
+            if job.progress_message_id:
+                await bot.edit_message_text(text=text, chat_id=job.chat_id, message_id=job.progress_message_id)
+            elif job.chat_id is not None:
+                await bot.send_message(job.chat_id, text)
+            for chat_id in job.watchers - {job.chat_id}:
+                await bot.send_message(chat_id, text)
+        except Exception:
+            logging.exception(f"Не удалось отправить итог задачи #{job.id}")
+
+
+JOBS = JobRunner()
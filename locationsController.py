@@ -0,0 +1,215 @@
+# locationsController.py
+import asyncio
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Callable
+
+# === Реестр городов: темы, ячейки таблицы и варианты названий ===
+#
+# Города описаны в locations.json (путь — LOCATIONS_PATH). Файл проверяется при
+# запуске: с ошибками в реестре бот не стартует. Изменения подхватываются без
+# перезапуска (watch или команда админа); если новый файл не прошёл проверку,
+# остаётся прежний реестр.
+#
+# LOCATIONS — один и тот же словарь на всё время работы, при перезагрузке он
+# обновляется на месте, поэтому `from locationsController import LOCATIONS` безопасен.
+
+LOCATIONS_PATH = Path(os.getenv("LOCATIONS_PATH") or Path(__file__).with_name("locations.json"))
+WATCH_INTERVAL = 10  # с, как часто проверять изменение файла
+
+CELL_RE = re.compile(r"^[A-Z]{1,3}[1-9]\d*$")
+SLUG_RE = re.compile(r"^[a-z][a-z0-9_]*$")
+
+
+class LocationsError(ValueError):
+    """Реестр не прошёл проверку. errors — список всех найденных проблем."""
+
+    def __init__(self, errors: list[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def _check_thread(value, where: str, errors: list[str]) -> None:
+    if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value <= 0):
+        errors.append(f"{where}: thread_id должен быть положительным числом или null")
+
+
+def validate_locations(data: dict) -> dict:
+    """Проверяет и нормализует содержимое файла реестра. Бросает LocationsError."""
+    errors: list[str] = []
+    if not isinstance(data, dict):
+        raise LocationsError(["корень файла должен быть объектом"])
+
+    _check_thread(data.get("default_thread_id"), "default_thread_id", errors)
+    cells = data.get("cells") or {}
+    for name in ("begin", "finish"):
+        if not CELL_RE.match(str(cells.get(name, ""))):
+            errors.append(f"cells.{name}: ожидается адрес ячейки вида N18")
+
+    locations = data.get("locations")
+    if not isinstance(locations, dict) or not locations:
+        errors.append("locations: нужен хотя бы один город")
+        locations = {}
+
+    seen_variants: dict[str, str] = {}
+    normalized: dict[str, dict] = {}
+    for slug, cfg in locations.items():
+        where = f"locations.{slug}"
+        if not SLUG_RE.match(slug):
+            errors.append(f"{where}: slug — латиница в нижнем регистре, цифры и _")
+        if not isinstance(cfg, dict):
+            errors.append(f"{where}: ожидается объект")
+            continue
+        if not str(cfg.get("ru") or "").strip():
+            errors.append(f"{where}.ru: пустое название")
+        variants = cfg.get("variants_ru")
+        if not isinstance(variants, list) or not variants or not all(isinstance(v, str) and v.strip() for v in variants):
+            errors.append(f"{where}.variants_ru: нужен непустой список строк")
+            variants = []
+        variants = [v.strip().lower() for v in variants]
+        for v in variants:
+            # Совпадение по началу строки: вариант другого города не может быть префиксом нашего
+            for other, owner in seen_variants.items():
+                if owner != slug and (v.startswith(other) or other.startswith(v)):
+                    errors.append(f"{where}.variants_ru: «{v}» пересекается с «{other}» ({owner})")
+            seen_variants[v] = slug
+        exel = cfg.get("exel") or {}
+        for name in ("intro", "outro"):
+            if not CELL_RE.match(str(exel.get(name, ""))):
+                errors.append(f"{where}.exel.{name}: ожидается адрес ячейки вида N2")
+        _check_thread(cfg.get("thread_id"), where, errors)
+        normalized[slug] = {
+            "ru": str(cfg.get("ru") or "").strip(),
+            "variants_ru": variants,
+            "exel": {"intro": exel.get("intro"), "outro": exel.get("outro")},
+            "thread_id": cfg.get("thread_id"),
+        }
+
+    if errors:
+        raise LocationsError(errors)
+    return {
+        "default_thread_id": data.get("default_thread_id"),
+        "cells": {"begin": cells["begin"], "finish": cells["finish"]},
+        "locations": normalized,
+    }
+
+
+def read_locations(path: Path) -> dict:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        raise LocationsError([f"файл {path} не найден"])
+    except json.JSONDecodeError as e:
+        raise LocationsError([f"{path}: некорректный JSON ({e})"])
+    return validate_locations(data)
+
+
+class LocationRegistry:
+    """Текущий реестр и перезагрузка файла по изменению mtime."""
+
+    def __init__(self, path: Path = LOCATIONS_PATH):
+        self.path = Path(path)
+        self.locations: dict[str, dict] = {}
+        self.default_thread_id: int | None = None
+        self.cells: dict[str, str] = {}
+        self.version = 0
+        self._mtime: float | None = None
+        self._on_reload: list[Callable] = []
+
+    def on_reload(self, callback: Callable) -> None:
+        """Регистрирует функцию, вызываемую после успешной перезагрузки (например сброс кэшей)."""
+        self._on_reload.append(callback)
+
+    def load(self) -> None:
+        """Загрузка с проверкой. При ошибке бросает LocationsError и не трогает текущий реестр."""
+        mtime = self.path.stat().st_mtime if self.path.exists() else None
+        config = read_locations(self.path)
+        self.locations.clear()
+        self.locations.update(config["locations"])
+        self.default_thread_id = config["default_thread_id"]
+        self.cells = config["cells"]
+        self._mtime = mtime
+        self.version += 1
+        for callback in self._on_reload:
+            try:
+                callback()
+            except Exception:
+                logging.exception("Ошибка в обработчике перезагрузки реестра городов.")
+
+    def reload(self) -> list[str]:
+        """Перезагружает файл. Возвращает список ошибок (пустой — успех)."""
+        try:
+            self.load()
+        except LocationsError as e:
+            logging.error(f"Реестр городов {self.path} не перезагружен: {e}")
+            return e.errors
+        logging.info(f"Реестр городов перезагружен: {', '.join(self.locations)} (версия {self.version}).")
+        return []
+
+    def changed(self) -> bool:
+        try:
+            return self.path.stat().st_mtime != self._mtime
+        except FileNotFoundError:
+            return False
+
+    async def watch(self, interval: float = WATCH_INTERVAL):
+        """Фоновая проверка файла: изменённый реестр подхватывается без перезапуска."""
+        while True:
+            await asyncio.sleep(interval)
+            if self.changed():
+                errors = self.reload()
+                if errors:
+                    # Не повторяем ту же ошибку каждые interval секунд
+                    self._mtime = self.path.stat().st_mtime
+
+    def thread_for(self, slug: str, default: int | None = None) -> int | None:
+        """Тема города: своя, если задана, иначе общая тема отчёта."""
+        return self.locations[slug].get("thread_id") or default or self.default_thread_id
+
+    def describe(self) -> str:
+        lines = [f"Реестр городов ({self.path.name}, версия {self.version}), общая тема {self.default_thread_id}:"]
+        for slug, cfg in self.locations.items():
+            thread = cfg.get("thread_id") or "общая"
+            lines.append(f"• {cfg['ru']} ({slug}): тема {thread}, ячейки {cfg['exel']['intro']}/{cfg['exel']['outro']}, "
+                         f"варианты: {', '.join(cfg['variants_ru'])}")
+        return "\n".join(lines)
+
+
+REGISTRY = LocationRegistry()
+REGISTRY.load()  # с некорректным реестром бот не запускается
+LOCATIONS = REGISTRY.locations
+
+
+def detect_location_slug(text: str) -> str | None:
+    """Определяет локацию, если её вариант стоит в начале строки (без учёта регистра)."""
+    text = text.lower().lstrip()
+    for slug, cfg in LOCATIONS.items():
+        if any(text.startswith(v) for v in cfg["variants_ru"]):
+            return slug
+    return None
+
+
+if __name__ == "__main__":
+    # Проверка файла реестра: python locationsController.py [path]
+    import sys
+
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else LOCATIONS_PATH
+    try:
+        config = read_locations(path)
+    except LocationsError as e:
+        print("Ошибки:\n" + "\n".join(f"- {err}" for err in e.errors))
+        sys.exit(1)
+    print(f"OK: {len(config['locations'])} городов")
+    assert detect_location_slug("Казань 5 шт") == "kazan"
+    assert detect_location_slug("Томск") == "tomsk" and detect_location_slug("омск") == "omsk"
+    try:
+        validate_locations({"cells": {"begin": "N18", "finish": "x"}, "locations": {
+            "a": {"ru": "А", "variants_ru": ["том"], "exel": {"intro": "A1", "outro": "A2"}},
+            "b": {"ru": "Б", "variants_ru": ["томск"], "exel": {"intro": "B1", "outro": "B2"}, "thread_id": "7"},
+        }})
+    except LocationsError as e:
+        print("\n".join(e.errors))
+        assert len(e.errors) == 3
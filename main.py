@@ -1,25 +1,36 @@
 # main.py
 
 import asyncio
-from functools import wraps
-import json
 import os
 import random
 import re
 import time
 import logging
-from pathlib import Path
 
 from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command, StateFilter
+from aiogram.filters import StateFilter
 from aiogram import F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from dotenv import load_dotenv
 
-from reportingController import send_reports, update_reports
-from generalController import send_general
+from reportingController import apply_report_changes, load_pandas, parse_report, reconcile_report_data, update_reports
+from telegramController import is_message_missing
+from jobController import DONE, JOBS, QUEUED, STARTED, JobProgress
+from generalController import parse_general, send_general
+from sheetController import SHEETS, SOURCE
+from markupController import split_message
+from pipelineController import execute_plan, render_plan_summary
+from mediaController import FILE_IDS
+from locationsController import REGISTRY
+from schedulerController import SCHEDULE_KINDS, SCHEDULER
+from watcherController import SheetWatcher
+from profilerController import PERF_DEFAULT_COUNT, PROFILER, PerfMiddleware, record_job
+from metricsController import METRICS, METRICS_LOG_INTERVAL, METRICS_PORT, instrument, instrument_bot, log_metrics_forever, serve_metrics
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.fsm.storage.memory import MemoryStorage
+from storageController import LEADER, STORE, create_fsm_storage
+from routingController import PRIVATE, RoutingMiddleware, Routes, guarded
 
 # from chatController import THRESHOLD, build_question_vectors, chat_listener_active, cosine_similarity, find_answer, text_to_vector
 
@@ -27,74 +38,15 @@ load_dotenv()
 
 API_TOKEN = os.getenv("API_TOKEN_OLD") or ""  # Токен бота
 CHAT_ID = os.getenv("CHAT_ID") or ""   # Идентификатор чата
-CHAT_THREAD_ID = {
-    'Казань':   745,  # Тема в которую публикуют
-}
-DATA_FILE = Path('promo_data.json')
+SHEET_WATCH = (os.getenv("SHEET_WATCH") or "0") == "1"  # обновлять отчёт по изменениям таблицы
+DATA_KEY = 'promo_data'  # Ключ акции в общем хранилище (для file бэкенда — promo_data.json)
+BOT_MODE = os.getenv("BOT_MODE") or "polling"  # polling | webhook
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL") or ""  # свой Bot API сервер (например fakeTelegram.py serve)
 
 logging.basicConfig(level=logging.INFO)
 
-# Фунция для проверки админ ли это
-def is_admin(user_id):
-    if user_id == 1303257033 or user_id == 577151281:
-        return True
-    return False
-
-# Декоратор для проверки на обращение от админов
-def admin_only(handler):
-    @wraps(handler)
-    async def wrapper(message: types.Message, *args, **kwargs):
-        if is_admin(message.from_user.id):
-            return await handler(message, *args, **kwargs)
-        await message.answer("Недостаточно прав.", show_alert=True)
-        return
-    return wrapper
-
-# Декоратор для проверки на обращение от админов в callback кнопках
-def admin_only_callback(handler):
-    @wraps(handler)
-    async def wrapper(callback: types.CallbackQuery, *args, **kwargs):
-        if is_admin(callback.from_user.id):
-            return await handler(callback, *args, **kwargs)
-        await callback.answer("Недостаточно прав.", show_alert=True)
-        return
-    return wrapper
-
-# Декоратор проверяет пришло ли сообщение с группы. Если пришло с бота то игнорирует
-def from_group_only(handler):
-    @wraps(handler)
-    async def wrapper(message: types.Message, *args, **kwargs):
-        if message.chat.type in {"group", "supergroup"}:
-            return await handler(message, *args, **kwargs)
-        return
-    return wrapper
-
-# Декоратор проверяет пришло ли сообщение с группы callback. Если пришло с бота то игнорирует
-def from_group_only_callback(handler):
-    @wraps(handler)
-    async def wrapper(callback: types.CallbackQuery, *args, **kwargs):
-        if callback.message.chat.type in {"group", "supergroup"}:
-            return await handler(callback, *args, **kwargs)
-        return
-    return wrapper
-
-# Декоратор проверяет пришло ли сообщение с бота. Если пришло с группы то игнорирует
-def from_personal_only(handler):
-    @wraps(handler)
-    async def wrapper(message: types.Message, *args, **kwargs):
-        if message.chat.type == "private":
-            return await handler(message, *args, **kwargs)
-        return
-    return wrapper
-
-# Декоратор проверяет пришло ли сообщение с бота callback. Если пришло с группы то игнорирует
-def from_private_only_callback(handler):
-    @wraps(handler)
-    async def wrapper(callback: types.CallbackQuery, *args, **kwargs):
-        if callback.message.chat.type == "private":
-            return await handler(callback, *args, **kwargs)
-        return
-    return wrapper
+# Права и тип чата проверяет routingController: админы задаются ADMIN_IDS,
+# is_admin и chat_kind считаются один раз на апдейт в RoutingMiddleware.
 
 
 # === Глобальные клавиатуры ===
@@ -123,6 +75,10 @@ def get_main_menu_kb():
             ],
             [
                 types.KeyboardButton(text="Опубликовать отчет 'Отправление в общую'")
+            ],
+            [
+                types.KeyboardButton(text="Предпросмотр 'Отчет о наличии'"),
+                types.KeyboardButton(text="Предпросмотр 'Отправление в общую'"),
             ]
         ],
         resize_keyboard=True
@@ -166,23 +122,27 @@ def get_inactive_promo_kb():
         ]
     )
 
-# Функция для загрузки данных с json
+# Функция для загрузки данных из общего хранилища
 def load_data():
-    if not DATA_FILE.exists():
-        return {'admin_id': None, 'promo': None}
     try:
-        return json.loads(DATA_FILE.read_text())
+        return STORE.get(DATA_KEY) or {'admin_id': None, 'promo': None}
     except Exception:
         logging.exception("Ошибка чтения данных, загружаем пустые.")
         return {'admin_id': None, 'promo': None}
 
-# Функция сохранения данных в json
+# Функция сохранения данных в общее хранилище
 def save_data(data):
     try:
-        DATA_FILE.write_text(json.dumps(data, ensure_ascii=False, indent=2))
+        STORE.set(DATA_KEY, data)
     except Exception:
         logging.exception("Ошибка при сохранении данных.")
 
+# Функция перечитывания данных: акцию могли изменить на другом экземпляре бота
+def refresh_data():
+    fresh = load_data()
+    data.clear()
+    data.update(fresh)
+
 # Загружаем данные
 data = load_data()
 
@@ -212,18 +172,22 @@ def group_command_reader(command: str):
     return None
 
 
-# Функция публикации акции. Закреп акции в темах.
-async def send_initial_messages(bot: Bot, promo: dict):
-    promo['messages'] = {}
-    # for thread_name, thread_id in CHAT_THREAD_ID.items():
-    text = render_text(promo['template'], promo['initial'])
+# Функция подсчета оставшегося времени акции
+def promo_remaining(promo: dict, now: int | None = None) -> int:
+    if not promo.get('start_time'):
+        return promo['initial']
+    now = now or int(time.time())
+    return max(0, promo['initial'] - (now - promo['start_time']))
+
+# Функция публикации сообщения акции в одной теме с закрепом
+async def post_promo_message(bot: Bot, promo: dict, thread_id: int, text: str):
     try:
         msg = await bot.send_message(
             chat_id=CHAT_ID,
             text=text,
-            message_thread_id=CHAT_THREAD_ID['Казань']
+            message_thread_id=thread_id
         )
-        promo['messages'][str(CHAT_THREAD_ID['Казань'])] = msg.message_id
+        promo.setdefault('messages', {})[str(thread_id)] = msg.message_id
 
         # Закрепляем сообщение
         await bot.pin_chat_message(
@@ -232,14 +196,22 @@ async def send_initial_messages(bot: Bot, promo: dict):
             disable_notification=True  # Чтобы без лишнего уведомления
         )
     except Exception:
-        logging.exception(f"Не удалось отправить или закрепить сообщение в теме {CHAT_THREAD_ID['Казань']}")
+        logging.exception(f"Не удалось отправить или закрепить сообщение в теме {thread_id}")
+
+# Функция публикации акции. Закреп акции в темах.
+async def send_initial_messages(bot: Bot, promo: dict):
+    promo['messages'] = {}
+    # Акция публикуется в общей теме из реестра городов (default_thread_id в locations.json)
+    text = render_text(promo['template'], promo['initial'])
+    await post_promo_message(bot, promo, REGISTRY.default_thread_id, text)
 
     promo['start_time'] = int(time.time())
     save_data(data)
+    ensure_minute_updater(bot)
 
 # Функция завершения акции. Удаление акции из тем.
 async def finish_promo(bot: Bot, promo: dict):
-    thread_id = CHAT_THREAD_ID['Казань']
+    thread_id = REGISTRY.default_thread_id
     # удаляем единственное сообщение акции
     msg_id = promo.get('messages', {}).get(str(thread_id))
     if msg_id:
@@ -264,12 +236,15 @@ async def finish_promo(bot: Bot, promo: dict):
 async def minute_updater(bot: Bot):
     while True:
         await asyncio.sleep(60)
-        print('update minute')
+        logging.debug('update minute')
+        # Таймер ведёт только ведущий экземпляр
+        if not LEADER.is_leader:
+            continue
+        refresh_data()
         promo = data.get('promo')
         if not promo or not promo.get('active'):
             continue
-        now = int(time.time())
-        rem = max(0, promo['initial'] - (now - promo['start_time']))
+        rem = promo_remaining(promo)
         if rem <= 0:
             await finish_promo(bot, promo)
             continue
@@ -284,39 +259,271 @@ async def minute_updater(bot: Bot):
             except Exception:
                 logging.exception(f"Ошибка обновления сообщения {message_id} в теме {thread_id_str}")
 
-# Функция запускающая таймер акции заново после перезапуска бота
-# async def on_startup(bot: Bot, dispatcher: Dispatcher):
-#     global question_vectors
-#     question_vectors = build_question_vectors()
-#     promo = data.get('promo')
-#     if promo and promo.get('active'):
-#         logging.info("Восстановление активной акции после рестарта.")
-#         if not promo.get('messages'):
-#             logging.info("Сообщения отсутствуют, пересоздаем...")
-#             await send_initial_messages(bot, promo)
-#         asyncio.create_task(minute_updater(bot))
-#     else:
-#         logging.info("Активных акций для восстановления нет.")
+# Задача таймера акции. Запускается один раз на процесс.
+_updater_task: asyncio.Task | None = None
 
-# Функция инициализации и запуска бота
-async def main():
-    bot = Bot(token=API_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
+def ensure_minute_updater(bot: Bot):
+    global _updater_task
+    if _updater_task is None or _updater_task.done():
+        _updater_task = asyncio.create_task(minute_updater(bot))
+
+# Функция восстановления активной акции после рестарта.
+# Проверяет сохранённые сообщения и перепубликует только пропавшие.
+async def restore_promo(bot: Bot, promo: dict):
+    if not promo.get('start_time'):
+        logging.info("Акция активна, но ещё не публиковалась. Публикуем.")
+        return await send_initial_messages(bot, promo)
+
+    rem = promo_remaining(promo)
+    if rem <= 0:
+        logging.info("Акция истекла пока бот был выключен. Завершаем.")
+        return await finish_promo(bot, promo)
+
+    text = render_text(promo['template'], rem)
+    messages = promo.setdefault('messages', {})
+
+    # Сразу обновляем таймер; ошибка "not found" означает что сообщение удалено
+    async def refresh(thread_id_str: str, message_id: int) -> tuple[str, bool]:
+        try:
+            await bot.edit_message_text(text=text, chat_id=CHAT_ID, message_id=message_id)
+        except Exception as e:
+            if is_message_missing(e):
+                return thread_id_str, False
+        return thread_id_str, True
+
+    results = await asyncio.gather(*(refresh(t, mid) for t, mid in messages.items()))
+    for thread_id_str, alive in results:
+        if not alive:
+            messages.pop(thread_id_str, None)
+
+    # Перепубликуем только в темах, где сообщения нет
+    for thread_id in (REGISTRY.default_thread_id,):
+        if str(thread_id) not in messages:
+            logging.info(f"Сообщение акции в теме {thread_id} отсутствует, публикуем заново.")
+            await post_promo_message(bot, promo, thread_id, text)
+
+    save_data(data)
+    logging.info(f"Акция восстановлена, осталось {fmt_secs(rem)}.")
+
+# Функция сверки состояния после перезапуска бота или смены ведущего
+async def restore_state(bot: Bot):
+    refresh_data()
+    promo = data.get('promo')
+    if promo and promo.get('active'):
+        logging.info("Восстановление активной акции после рестарта.")
+        await restore_promo(bot, promo)
+    else:
+        logging.info("Активных акций для восстановления нет.")
+
+    try:
+        await reconcile_report_data(bot)
+    except Exception:
+        logging.exception("Не удалось сверить сообщения отчёта.")
+
+    ensure_minute_updater(bot)
+
+# === Публикации ===
+# Публикации выполняет только ведущий экземпляр. Остальные кладут задачу
+# в очередь общего хранилища, ведущий забирает её в command_consumer.
+
+COMMANDS_KEY = 'commands'
+
+PUBLISH_TITLES = {
+    'report_create': "Публикация отчета о наличии",
+    'report_update': "Обновление отчета о наличии",
+    'general':       "Отправление в общую",
+    'report_preview':  "Предпросмотр отчета о наличии",
+    'general_preview': "Предпросмотр отправления в общую",
+}
+PREVIEW_KINDS = {'report_preview', 'general_preview'}
+# Приоритеты при объединении задач: запрошенная публикация заменяет ждущее применение изменений, но не наоборот
+PUBLISH_PRIORITY = 1
+CHANGES_PRIORITY = 0
+
+# Функция предпросмотра: сводка плана и сами сообщения в личном чате админа
+async def send_preview(bot: Bot, chat_id: int, summary: dict, title: str, progress: JobProgress):
+    for chunk in split_message(render_plan_summary(summary, title), 4000, parse_mode=None):
+        await bot.send_message(chat_id, chunk)
+    await execute_plan(bot, summary['plan'], progress=progress, chat_id=chat_id)
+
+# Функция выполнения публикации. Ход работы пишется в progress задачи.
+async def run_publish(bot: Bot, kind: str, progress: JobProgress, chat_id: int | None = None, raw: bytes | None = None):
+    # Все листы берутся из одного снимка таблицы: параллельные публикации видят одну версию данных.
+    # raw — уже скачанный лист (например планировщиком), чтобы не загружать его повторно
+    if kind in ('report_create', 'report_update'):
+        # Публикация целиком заменила ждавшее применение изменений (приоритет выше), они уже не нужны
+        PENDING_CHANGES.clear()
+    if raw is None:
+        with progress.timed("загрузка"):
+            snapshot = await SHEETS.get()
+        raw = snapshot.raw['general' if kind.startswith('general') else 'stock']
+    if kind == 'report_create':
+        await update_reports(None, bot, type_='create', progress=progress, raw=raw)
+    elif kind == 'report_update':
+        await update_reports(None, bot, type_='update', progress=progress, raw=raw)
+    elif kind == 'general':
+        await send_general(bot, CHAT_ID, REGISTRY.default_thread_id, progress=progress, rows=parse_general(raw))
+    elif kind == 'report_preview':
+        summary = await update_reports(None, bot, progress=progress, dry_run=True, raw=raw)
+        await send_preview(bot, chat_id, summary, "Отчет о наличии", progress)
+    elif kind == 'general_preview':
+        summary = await send_general(bot, CHAT_ID, REGISTRY.default_thread_id, progress=progress, dry_run=True, rows=parse_general(raw))
+        await send_preview(bot, chat_id, summary, "Отправление в общую", progress)
+    else:
+        logging.warning(f"Неизвестная публикация: {kind}")
+
+# Функция запуска публикации фоновой задачей с объединением одновременных запросов.
+# Отчёт создаётся и обновляется в одних и тех же сообщениях, поэтому у них общий ключ.
+async def start_publish(bot: Bot, kind: str, chat_id: int):
+    if kind in PREVIEW_KINDS:
+        key = f'preview:{chat_id}'
+    else:
+        key = 'general' if kind == 'general' else 'report'
+    job, status = JOBS.submit(
+        bot, key, kind, PUBLISH_TITLES.get(kind, kind), chat_id,
+        lambda progress: run_publish(bot, kind, progress, chat_id),
+        priority=PUBLISH_PRIORITY,
+    )
+    if status == STARTED:
+        return
+    if status == QUEUED:
+        text = (f"Публикация уже выполняется. Запрос поставлен следующим (задача #{job.id}), "
+                f"она возьмёт актуальные данные таблицы.")
+    else:
+        text = f"Такой запрос уже стоит в очереди. Запрос объединён с задачей #{job.id}, итог придёт сюда."
+    await bot.send_message(chat_id, text, reply_markup=get_main_menu_kb())
+
+# Функция публикации по расписанию: та же фоновая задача, но без сообщения прогресса.
+# Итог записывается в расписание и виден админам в /schedule.
+SCHEDULED_PUBLISH = {'report': 'report_create', 'general': 'general'}
+
+async def run_scheduled(bot: Bot, kind: str, raw: bytes) -> dict:
+    publish_kind = SCHEDULED_PUBLISH[kind]
+    job, _ = JOBS.submit(
+        bot, 'general' if kind == 'general' else 'report', publish_kind,
+        f"{PUBLISH_TITLES.get(publish_kind, publish_kind)} (по расписанию)", None,
+        lambda progress: run_publish(bot, publish_kind, progress, raw=raw),
+        priority=PUBLISH_PRIORITY,
+    )
+    await JOBS.wait(job)
+    return {'status': 'done' if job.status == DONE else job.status, 'messages': job.progress.messages, 'error': job.error}
+
+# Функция применения изменений таблицы к опубликованному отчёту (наблюдение за листом).
+# Задача с тем же ключом, что и публикация отчёта: одновременно они не выполняются.
+# Изменения копятся до запуска задачи: объединённые запросы применяют все события
+# с последней версией листа. Публикация целиком (приоритет выше) заменяет такую задачу
+# и при старте очищает буфер (run_publish), иначе старые события применились бы повторно.
+PENDING_CHANGES: list = []
+
+async def on_sheet_change(bot: Bot, raw: bytes, model: dict, events: list):
+    PENDING_CHANGES.extend(events)
+
+    async def apply(progress: JobProgress):
+        changes = PENDING_CHANGES[:]
+        PENDING_CHANGES.clear()
+        await apply_report_changes(bot, raw, changes, progress)
+
+    JOBS.submit(
+        bot, 'report', 'report_changes', f"Обновление отчёта по изменениям таблицы ({len(PENDING_CHANGES)})", None,
+        apply, priority=CHANGES_PRIORITY,
+    )
+
+WATCHER: SheetWatcher | None = None
+
+# Функция запуска публикации из обработчика: у себя или через ведущего
+async def request_publish(message: types.Message, kind: str):
+    # Предпросмотр ничего не публикует в группе, его может выполнить любой экземпляр
+    if LEADER.is_leader or kind in PREVIEW_KINDS:
+        return await start_publish(message.bot, kind, message.chat.id)
+    await asyncio.to_thread(STORE.push, COMMANDS_KEY, {'kind': kind, 'chat_id': message.chat.id})
+    await message.answer("Задача передана ведущему экземпляру бота.")
+
+# Функция отмены фоновой задачи (на ведущем экземпляре или через очередь)
+async def cancel_job(bot: Bot, job_id: str, chat_id: int):
+    if not LEADER.is_leader:
+        await asyncio.to_thread(STORE.push, COMMANDS_KEY, {'kind': 'cancel', 'job_id': job_id})
+        return await bot.send_message(chat_id, "Отмена передана ведущему экземпляру.")
+    ok = JOBS.cancel(job_id)
+    await bot.send_message(chat_id, f"Задача #{job_id} отменяется." if ok else f"Задача #{job_id} не найдена или уже завершена.")
+
+# Функция разбора очереди публикаций на ведущем экземпляре
+async def command_consumer(bot: Bot):
+    while True:
+        await asyncio.sleep(2)
+        if not LEADER.is_leader:
+            continue
+        for cmd in await asyncio.to_thread(STORE.pop_all, COMMANDS_KEY):
+            if cmd['kind'] == 'cancel':
+                JOBS.cancel(cmd['job_id'])
+                continue
+            await start_publish(bot, cmd['kind'], cmd['chat_id'])
+
+# Прогрев тяжёлых модулей в фоне: polling стартует с одним aiogram, а pandas
+# (разбор отчёта) загружается, пока бот уже отвечает. Чат (chatController.warm_up) — так же.
+def warm_up():
+    started = time.perf_counter()
+    load_pandas()
+    logging.info(f"Прогрев модулей: {time.perf_counter() - started:.2f} с")
+
+# Функция запуска фоновых задач при старте бота
+async def on_startup(bot: Bot):
+    asyncio.create_task(asyncio.to_thread(warm_up))
+    # Сверка состояния выполняется тем экземпляром, который стал ведущим
+    LEADER.on_elected(lambda: restore_state(bot))
+    await LEADER.try_acquire()
+    asyncio.create_task(LEADER.run())
+    asyncio.create_task(command_consumer(bot))
+    # Реестр городов подхватывается без перезапуска на каждом экземпляре
+    asyncio.create_task(REGISTRY.watch())
+    # Публикации по расписанию (срабатывают только на ведущем)
+    SCHEDULER.fetchers = {'report': lambda: SHEETS.tab('stock'), 'general': lambda: SHEETS.tab('general')}
+    SCHEDULER.publish = lambda kind, raw: run_scheduled(bot, kind, raw)
+    asyncio.create_task(SCHEDULER.run_forever())
+    # Наблюдение за листом наличия (SHEET_WATCH=1), опрашивает только ведущий
+    global WATCHER
+    if SHEET_WATCH:
+        WATCHER = SheetWatcher(
+            SOURCE.url('stock'), parse_report,
+            on_change=lambda raw, model, events: on_sheet_change(bot, raw, model, events),
+            is_active=lambda: LEADER.is_leader,
+            source=SOURCE,
+        )
+        asyncio.create_task(WATCHER.run())
+    # Задержка event loop, сторож зависаний и длительность задач для /perf
+    PROFILER.watchdog.start()
+    JOBS.on_finish.append(record_job)
+    # Метрики: отдельный /metrics для polling (в webhook режиме он на том же сервере) и дамп в лог
+    if METRICS_PORT and BOT_MODE != "webhook":
+        await serve_metrics(METRICS_PORT)
+    if METRICS_LOG_INTERVAL:
+        asyncio.create_task(log_metrics_forever(METRICS_LOG_INTERVAL))
+
+# Функция создания диспетчера со всеми обработчиками
+def create_dispatcher() -> Dispatcher:
+    dp = Dispatcher(storage=create_fsm_storage(STORE))
+    instrument(dp)
+    dp.message.middleware(PerfMiddleware())
+    dp.callback_query.middleware(PerfMiddleware())
+    dp.message.outer_middleware(RoutingMiddleware())
+    dp.callback_query.outer_middleware(RoutingMiddleware())
+
+    # Кнопки, команды и callback_data — одна таблица, регистрируется первой:
+    # она проверяется раньше шагов формы, поэтому «Отменить создание акции» и команды работают и во время ввода.
+    routes = Routes()
+    routes.register(dp)
 
     # Команада запуска бота: /start. Доступна только в персональном чате. 
-    @dp.message(Command("start"))
-    @from_personal_only
-    async def cmd_start(message: types.Message, state: FSMContext):
-        if (user := message.from_user) and is_admin(user.id):
+    @routes.command("start", chat=PRIVATE)
+    async def cmd_start(message: types.Message, is_admin: bool):
+        if is_admin:
             return await message.answer("Привет! Выберите действие:", reply_markup=get_main_menu_kb())
         
         return await message.answer("Добро пожаловать!")
 
     # Создание акции. Доступн только у администратора. Доступн только в персональном чате.
-    @dp.message(F.text == "Создать акцию")
-    @admin_only
-    @from_personal_only
+    @routes.text("Создать акцию", admin=True, chat=PRIVATE)
     async def cmd_create(message: types.Message, state: FSMContext):
+        refresh_data()
         promo = data.get('promo')
         if promo:
             return await message.answer("Акция уже существует. Заменить её?", reply_markup=get_replace_confirm_kb())
@@ -324,38 +531,25 @@ async def main():
 
         await message.answer("Введите шаблон (с {{time}}):", reply_markup=CANCEL_CREATION_KB)
 
-    @dp.message(F.text == "Опубликовать отчет 'Отчет о наличии'")
-    @admin_only
-    @from_personal_only
+    @routes.text("Опубликовать отчет 'Отчет о наличии'", admin=True, chat=PRIVATE)
     async def cmd_publish_report(message: types.Message):
         if message.bot:
-            await message.answer("Публикую отчет…")
-            await send_reports(message, message.bot)
-            await message.answer("Отчет опубликован.", reply_markup=get_main_menu_kb())
+            await request_publish(message, 'report_create')
 
-    @dp.message(F.text == "Обновить отчёт 'Отчет о наличии'")
-    @admin_only
-    @from_personal_only
+    @routes.text("Обновить отчёт 'Отчет о наличии'", admin=True, chat=PRIVATE)
     async def cmd_update_report(message: types.Message):
         if message.bot:
-            await message.answer("Обновляю…")
-            await update_reports(message, message.bot)
-            await message.answer("Готово.", reply_markup=get_main_menu_kb())
+            await request_publish(message, 'report_update')
 
-    @dp.message(F.text == "Опубликовать отчет 'Отправление в общую'")
-    @admin_only
-    @from_personal_only
+    @routes.text("Опубликовать отчет 'Отправление в общую'", admin=True, chat=PRIVATE)
     async def cmd_general(message: types.Message):
         if message.bot:
-            await message.answer("Формирую и отправляю…")
-            await send_general(message.bot, CHAT_ID, CHAT_THREAD_ID["Казань"])
-            await message.answer("Готово.", reply_markup=get_main_menu_kb())
+            await request_publish(message, 'general')
 
     # 
-    @dp.callback_query(F.data == "confirm_replace")
-    @admin_only_callback
-    @from_personal_only
+    @routes.callback("confirm_replace", admin=True, chat=PRIVATE)
     async def cb_confirm_replace(callback: types.CallbackQuery, state: FSMContext):
+        refresh_data()
         data['promo'] = None
         save_data(data)
         await callback.message.edit_reply_markup(None)
@@ -365,9 +559,7 @@ async def main():
         await callback.answer()
 
     # 
-    @dp.callback_query(F.data == "cancel_replace")
-    @admin_only_callback
-    @from_personal_only
+    @routes.callback("cancel_replace", admin=True, chat=PRIVATE)
     async def cb_cancel_replace(callback: types.CallbackQuery, state: FSMContext):
         await callback.message.edit_reply_markup(None)
         await state.clear()
@@ -377,17 +569,14 @@ async def main():
 
     # 
 
-    @dp.message(F.text == "Отменить создание акции")
-    @admin_only
-    @from_personal_only
+    @routes.text("Отменить создание акции", admin=True, chat=PRIVATE)
     async def cancel_flow(message: types.Message, state: FSMContext):
         await state.clear()
 
         await message.answer("Создание акции отменено.", reply_markup=get_main_menu_kb())
 
     @dp.message(StateFilter(Form.template), F.text)
-    @admin_only
-    @from_personal_only
+    @guarded(admin=True, chat=PRIVATE)
     async def process_template(message: types.Message, state: FSMContext):
         if not message.text or message.text.count("{{time}}") != 1:
             return await message.answer("Шаблон должен содержать ровно один {{time}}. Повторите ввод:")
@@ -397,8 +586,7 @@ async def main():
         await message.answer("Укажите длительность акции в формате ЧЧ:ММ[:СС]:", reply_markup=CANCEL_CREATION_KB)
 
     @dp.message(StateFilter(Form.duration), F.text)
-    @admin_only
-    @from_personal_only
+    @guarded(admin=True, chat=PRIVATE)
     async def process_duration(message: types.Message, state: FSMContext):
         if not message.text:
             return await message.answer("Отправьте текстовое сообщение.")
@@ -408,6 +596,7 @@ async def main():
         h, mi, s = int(m.group(1)), int(m.group(2)), int(m.group(3) or 0)
         if mi >= 60 or s >= 60 or (h == 0 and mi == 0 and s == 0) or h > 24:
             return await message.answer("Минуты/секунды <60, длительность >0 и ≤24ч. Повторите:")
+        refresh_data()
         data['promo'] = {
             'template': (await state.get_data())['template'],
             'initial': h * 3600 + mi * 60 + s,
@@ -422,17 +611,15 @@ async def main():
         await message.answer("Акция создана.", reply_markup=get_main_menu_kb())
 
 
-    @dp.message(F.text == "Просмотреть акции")
-    @admin_only
-    @from_personal_only
+    @routes.text("Просмотреть акции", admin=True, chat=PRIVATE)
     async def cmd_view(message: types.Message):
+        refresh_data()
         promo = data.get('promo')
         if not promo:
 
             return await message.answer("Нет созданных акций.", reply_markup=get_main_menu_kb())
 
-        now = int(time.time())
-        rem = promo['initial'] if not promo['active'] else max(0, promo['initial'] - (now - promo['start_time']))
+        rem = promo['initial'] if not promo['active'] else promo_remaining(promo)
         text = (
             f"Шаблон:\n{render_text(promo['template'], rem)}\n\n"
             f"Оставшееся время: {fmt_secs(rem)}\n"
@@ -443,8 +630,7 @@ async def main():
         kb = get_active_promo_kb() if promo['active'] else get_inactive_promo_kb()
         await message.answer(text, reply_markup=kb)
 
-    @dp.message(F.text == "get_chat_id")
-    @admin_only
+    @routes.text("get_chat_id", admin=True)
     async def get_chat_id(message: types.Message):
         chat_id = message.chat.id
         thread_id = message.message_thread_id
@@ -458,10 +644,108 @@ async def main():
         await message.reply(text, parse_mode="Markdown")
 
 
-    @dp.callback_query(F.data.in_(["activate", "deactivate", "reset", "delete"]))
-    @admin_only_callback
-    @from_private_only_callback
+    @routes.text("Предпросмотр 'Отчет о наличии'", admin=True, chat=PRIVATE)
+    async def cmd_preview_report(message: types.Message):
+        if message.bot:
+            await request_publish(message, 'report_preview')
+
+    @routes.text("Предпросмотр 'Отправление в общую'", admin=True, chat=PRIVATE)
+    async def cmd_preview_general(message: types.Message):
+        if message.bot:
+            await request_publish(message, 'general_preview')
+
+    # Список последних фоновых задач публикации
+    @routes.command("jobs", admin=True, chat=PRIVATE)
+    async def cmd_jobs(message: types.Message):
+        jobs = JOBS.recent()
+        if not jobs:
+            return await message.answer("Задач пока не было.")
+        extra = [FILE_IDS.stats_text()] + ([SHEETS.latest.describe()] if SHEETS.latest else []) + ([WATCHER.stats_text()] if WATCHER else [])
+        await message.answer("\n\n".join([job.summary() for job in jobs[:10]] + extra))
+
+    # Время обработчиков, вызовов Bot API и этапов публикации
+    @routes.command("metrics", admin=True, chat=PRIVATE)
+    async def cmd_metrics(message: types.Message):
+        await message.answer(METRICS.summary() or "Замеров пока нет.")
+
+    # Профилирование: /perf — задержка loop и долгие вызовы, /perf start [N] — cProfile
+    # на следующие N обработчиков и задач, /perf stop — завершить раньше. Отчёт приходит файлом.
+    @routes.command("perf", admin=True, chat=PRIVATE)
+    async def cmd_perf(message: types.Message):
+        parts = (message.text or "").split()
+        action = parts[1] if len(parts) > 1 else ""
+        if action == "start":
+            count = int(parts[2]) if len(parts) > 2 and parts[2].isdigit() else PERF_DEFAULT_COUNT
+            if PROFILER.active:
+                return await message.answer("Профилирование уже идёт. /perf stop — завершить.")
+            PROFILER.start(message.bot, message.chat.id, count)
+            return await message.answer(f"Профилирую следующие {count} обработчиков и задач, отчёт пришлю файлом.")
+        if action == "stop":
+            if not await PROFILER.stop():
+                await message.answer("Профилирование не запущено.")
+            return
+        await message.answer(PROFILER.status_text() + "\n\n/perf start [N] — профиль следующих N вызовов")
+
+    # Реестр городов: /locations — текущий, /locations reload — перечитать файл
+    @routes.command("locations", admin=True, chat=PRIVATE)
+    async def cmd_locations(message: types.Message):
+        parts = (message.text or "").split()
+        if len(parts) > 1 and parts[1] == "reload":
+            errors = REGISTRY.reload()
+            if errors:
+                return await message.answer("Реестр не перезагружен, остался прежний:\n" + "\n".join(f"- {e}" for e in errors))
+        for chunk in split_message(REGISTRY.describe(), 4000, parse_mode=None):
+            await message.answer(chunk)
+
+    # Расписание публикаций:
+    # /schedule — список и итоги, /schedule add <report|general> <cron>,
+    # /schedule del|on|off|run <id>
+    @routes.command("schedule", admin=True, chat=PRIVATE)
+    async def cmd_schedule(message: types.Message):
+        parts = (message.text or "").split(maxsplit=2)
+        action = parts[1] if len(parts) > 1 else ""
+        arg = parts[2].strip() if len(parts) > 2 else ""
+        if action == "add":
+            kind, _, cron = arg.partition(" ")
+            try:
+                schedule = SCHEDULER.add(kind, cron.strip())
+            except ValueError as e:
+                return await message.answer(f"Расписание не добавлено: {e}\nДоступны: {', '.join(SCHEDULE_KINDS)}")
+            await message.answer(f"Расписание #{schedule['id']} добавлено.")
+        elif action in ("del", "on", "off", "run"):
+            if action == "del":
+                ok = SCHEDULER.remove(arg)
+            elif action == "run":
+                ok = SCHEDULER.run_now(arg)
+            else:
+                ok = SCHEDULER.set_enabled(arg, action == "on")
+            if not ok:
+                return await message.answer(f"Расписание #{arg} не найдено.")
+            await message.answer("Запуск на ближайшей проверке планировщика." if action == "run" else "Готово.")
+        elif action:
+            return await message.answer("Использование: /schedule [add <report|general> <cron> | del|on|off|run <id>]")
+        await message.answer(SCHEDULER.describe())
+
+    # Отмена задачи: /cancel <номер>
+    @routes.command("cancel", admin=True, chat=PRIVATE)
+    async def cmd_cancel_job(message: types.Message):
+        parts = (message.text or "").split()
+        if len(parts) != 2:
+            return await message.answer("Укажите номер задачи: /cancel <номер>")
+        await cancel_job(message.bot, parts[1].lstrip('#'), message.chat.id)
+
+    @routes.callback("job_cancel:", admin=True, chat=PRIVATE)
+    async def cb_cancel_job(callback: types.CallbackQuery):
+        job_id = callback.data.split(":", 1)[1]
+        if not LEADER.is_leader:
+            await asyncio.to_thread(STORE.push, COMMANDS_KEY, {'kind': 'cancel', 'job_id': job_id})
+            return await callback.answer("Отмена передана ведущему экземпляру.")
+        ok = JOBS.cancel(job_id)
+        await callback.answer("Задача отменяется." if ok else "Задача уже завершена.")
+
+    @routes.callback("activate", "deactivate", "reset", "delete", admin=True, chat=PRIVATE)
     async def cb_action(callback: types.CallbackQuery):
+        refresh_data()
         promo = data.get('promo')
         if not promo:
             return await callback.answer("Акция отсутствует.")
@@ -486,13 +770,26 @@ async def main():
             save_data(data)
             await callback.answer("Акция удалена.")
 
-    # dp.startup.register(on_startup)
+    dp.startup.register(on_startup)
 
-    # запускаем ежедневную рассылку в фоне
-    # asyncio.create_task(daily_job(bot))
+    return dp
 
-    # и дальше запускаем polling
-    await dp.start_polling(bot)
+# Функция инициализации и запуска бота
+async def main():
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+        bot = Bot(token=API_TOKEN, session=session)
+    else:
+        bot = Bot(token=API_TOKEN)
+    instrument_bot(bot)
+    dp = create_dispatcher()
+
+    # webhook: BOT_MODE=webhook, настройки в webhookController
+    if BOT_MODE == "webhook":
+        from webhookController import run_webhook
+        await run_webhook(bot, dp)
+    else:
+        await dp.start_polling(bot)
 
 if __name__ == '__main__':
     asyncio.run(main())
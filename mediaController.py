@@ -0,0 +1,475 @@
+# mediaController.py
+import asyncio
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import aiohttp
+
+from storageController import STORE
+
+# === Медиа: пачки по 10 фото для send_media_group ===
+
+MEDIA_GROUP_MAX = 10  # ограничение Telegram на одну медиа-группу
+
+
+def dedupe_urls(urls: list[str]) -> list[str]:
+    """Убирает повторы URL, сохраняя порядок первого появления."""
+    seen: set[str] = set()
+    out = []
+    for url in urls:
+        url = url.strip()
+        if url and url not in seen:
+            seen.add(url)
+            out.append(url)
+    return out
+
+
+def batch_media(urls: list[str], size: int = MEDIA_GROUP_MAX) -> list[list[str]]:
+    """
+    Делит фото на группы не больше size. В медиа-группе должно быть минимум 2 фото,
+    поэтому одиночный хвост забирает одно фото из предыдущей группы (11 → 9 + 2).
+    """
+    groups = [urls[i:i + size] for i in range(0, len(urls), size)]
+    if len(groups) > 1 and len(groups[-1]) == 1:
+        groups[-1].insert(0, groups[-2].pop())
+    return groups
+
+
+def media_ops(
+    urls: list[str],
+    caption: str | None,
+    parse_mode: str,
+    chat_id: int | str,
+    thread_id: int | None,
+    key: str | None = None,
+) -> list[dict]:
+    """
+    Операции плана для всех фото: медиа-группы по 10 подряд, одно фото — send_photo.
+    Подпись ставится на первое фото первой группы.
+    """
+    ops = []
+    for i, group in enumerate(batch_media(dedupe_urls(urls))):
+        op = {"key": key, "chat_id": chat_id, "thread_id": thread_id, "parse_mode": parse_mode,
+              "caption": caption if i == 0 else None}
+        if len(group) == 1:
+            op.update(method="send_photo", media=group)
+        else:
+            op.update(method="send_media_group", media=group)
+        ops.append(op)
+    return ops
+
+
+# === Кэш file_id: повторные публикации не заставляют Telegram качать фото заново ===
+
+FILE_IDS_KEY = "file_ids"
+REVALIDATE_AFTER = 6 * 3600  # раз в 6 часов проверяем, не поменялась ли картинка по URL
+VALIDATOR_HEADERS = ("ETag", "Last-Modified", "Content-Length")
+
+
+def validators_changed(old: dict, new: dict) -> bool:
+    """Изменилась ли картинка: сравниваются заголовки, которые источник отдал оба раза."""
+    return any(old.get(h) and new.get(h) and old[h] != new[h] for h in VALIDATOR_HEADERS)
+
+
+class FileIdCache:
+    """
+    URL → file_id из ответа Telegram на первую загрузку. Хранится в общем хранилище.
+    Для проверки изменений запоминаются ETag / Last-Modified / Content-Length источника
+    в момент загрузки (их сообщает preflight_images через observe): если при перепроверке
+    они отличаются, запись удаляется и фото грузится заново. Запись без них перепроверить
+    не с чем — она тоже удаляется.
+    """
+
+    def __init__(self, store=None):
+        self.store = store
+        self.entries: dict[str, dict] | None = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._dirty = False
+        self._observed: dict[str, dict] = {}  # URL → заголовки последнего скачивания
+
+    def _load(self) -> dict[str, dict]:
+        if self.entries is None:
+            self.entries = (self.store.get(FILE_IDS_KEY) if self.store else None) or {}
+        return self.entries
+
+    def known(self, url: str) -> bool:
+        return url in self._load()
+
+    def resolve(self, url: str) -> str:
+        """file_id, если фото уже загружалось, иначе исходный URL."""
+        entry = self._load().get(url)
+        if entry:
+            self.hits += 1
+            return entry["file_id"]
+        self.misses += 1
+        return url
+
+    def observe(self, url: str, validators: dict) -> None:
+        """Заголовки источника при скачивании перед загрузкой; remember сохранит их с file_id."""
+        self._observed[url] = validators
+
+    def remember(self, url: str, file_id: str) -> None:
+        entries = self._load()
+        if url == file_id or entries.get(url, {}).get("file_id") == file_id:
+            return
+        entries[url] = {"file_id": file_id, "checked": time.time(), "validators": self._observed.pop(url, None)}
+        self._dirty = True
+
+    def forget(self, urls: list[str]) -> None:
+        entries = self._load()
+        for url in urls:
+            if entries.pop(url, None) is not None:
+                self.invalidated += 1
+                self._dirty = True
+
+    async def revalidate(self, urls: list[str], concurrency: int = 8) -> None:
+        """HEAD-проверка источников с устаревшей отметкой; изменившиеся удаляются из кэша."""
+        entries = self._load()
+        now = time.time()
+        stale = [u for u in dict.fromkeys(urls) if u in entries and now - entries[u].get("checked", 0) > REVALIDATE_AFTER]
+        if not stale:
+            return
+        sem = asyncio.Semaphore(concurrency)
+        timeout = aiohttp.ClientTimeout(total=10)
+
+        async def check(session: aiohttp.ClientSession, url: str):
+            async with sem:
+                try:
+                    async with session.head(url, allow_redirects=True) as resp:
+                        if resp.status >= 400:
+                            return
+                        validators = {h: resp.headers.get(h) for h in VALIDATOR_HEADERS}
+                except Exception:
+                    return  # источник недоступен — оставляем file_id как есть
+            entry = entries.get(url)
+            if entry is None:
+                return
+            old = entry.get("validators")
+            if old is None or validators_changed(old, validators):
+                self.forget([url])
+                return
+            entry["checked"] = now
+            self._dirty = True
+
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            await asyncio.gather(*(check(session, u) for u in stale))
+
+    def save(self) -> None:
+        if self._dirty and self.store is not None:
+            self.store.set(FILE_IDS_KEY, self._load())
+            self._dirty = False
+        self._observed.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._load()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def stats_text(self) -> str:
+        st = self.stats()
+        return (f"Кэш file_id: {st['entries']} фото, попаданий {st['hits']}, промахов {st['misses']} "
+                f"({st['hit_rate']:.0%}), сброшено {st['invalidated']}")
+
+
+FILE_IDS = FileIdCache(STORE)
+
+
+# === Предварительная проверка фото до удаления старых сообщений ===
+#
+# Все URL качаются заранее ограниченным пулом и складываются в дисковый кэш.
+# Битые (ошибка, не картинка, слишком большие) выкидываются из плана до того,
+# как старый отчёт будет удалён. Медленные и крупные (>5 МБ, Telegram не скачает
+# их сам по URL) отправляются байтами из кэша.
+
+IMAGE_CACHE_DIR   = Path(os.getenv("IMAGE_CACHE_DIR") or ".image_cache")
+IMAGE_CACHE_TTL   = 24 * 3600
+PHOTO_MAX_BYTES   = 10 * 1024 * 1024  # лимит Telegram на загрузку фото
+URL_PHOTO_MAX     = 5 * 1024 * 1024   # лимит Telegram на фото, которое он качает сам по URL
+SLOW_URL_SECONDS  = 3.0               # дольше — отправляем байтами, не заставляя Telegram ждать
+PREFLIGHT_TIMEOUT = 20
+PREFLIGHT_ENABLED = (os.getenv("IMAGE_PREFLIGHT") or "1") == "1"  # 0 — без скачивания (офлайн данные, бенчмарки)
+IMAGE_TYPES = {"image/jpeg", "image/png", "image/webp"}
+IMAGE_MAGIC = ((b"\xff\xd8\xff", "image/jpeg"), (b"\x89PNG", "image/png"))
+
+
+def sniff_image_type(head: bytes) -> str | None:
+    for magic, mime in IMAGE_MAGIC:
+        if head.startswith(magic):
+            return mime
+    # RIFF — общий контейнер (WAV, AVI), webp только с "WEBP" в байтах 8–12
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _cache_paths(url: str) -> tuple[Path, Path]:
+    name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return IMAGE_CACHE_DIR / f"{name}.bin", IMAGE_CACHE_DIR / f"{name}.json"
+
+
+def _read_cached(url: str) -> dict | None:
+    data_path, meta_path = _cache_paths(url)
+    if not (data_path.exists() and meta_path.exists()):
+        return None
+    try:
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if time.time() - meta.get("fetched", 0) > IMAGE_CACHE_TTL:
+        return None
+    return {**meta, "path": str(data_path)}
+
+
+def _write_cached(url: str, body: bytes, meta: dict) -> str:
+    IMAGE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    data_path, meta_path = _cache_paths(url)
+    data_path.write_bytes(body)
+    meta_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+    return str(data_path)
+
+
+def prune_image_cache(ttl: float = IMAGE_CACHE_TTL) -> int:
+    """Удаляет из дискового кэша файлы старше ttl. Возвращает число удалённых файлов."""
+    if not IMAGE_CACHE_DIR.is_dir():
+        return 0
+    cutoff = time.time() - ttl
+    removed = 0
+    for path in IMAGE_CACHE_DIR.iterdir():
+        try:
+            if path.suffix in (".bin", ".json") and path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+async def _read_body(resp: aiohttp.ClientResponse, limit: int) -> bytes:
+    """Читает тело ответа целиком, но не больше limit байт."""
+    chunks: list[bytes] = []
+    size = 0
+    async for chunk in resp.content.iter_chunked(64 * 1024):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > limit:
+            break
+    return b"".join(chunks)
+
+
+def check_image(size: int, mime: str | None) -> str | None:
+    """Причина отказа или None, если фото подходит Telegram."""
+    if mime not in IMAGE_TYPES:
+        return f"не картинка ({mime or 'неизвестный тип'})"
+    if size == 0:
+        return "пустой файл"
+    if size > PHOTO_MAX_BYTES:
+        return f"слишком большое ({size // 1024} КБ)"
+    return None
+
+
+async def preflight_images(
+    urls: list[str],
+    concurrency: int = 8,
+    timeout: float = PREFLIGHT_TIMEOUT,
+) -> dict[str, dict]:
+    """
+    Проверяет фото по URL. Результат по каждому URL:
+    {"ok": bool, "reason": str|None, "size", "type", "path", "upload": bool}.
+    Фото с file_id в кэше не качаются — Telegram их уже принял.
+    """
+    results: dict[str, dict] = {}
+    todo = []
+    for url in dict.fromkeys(urls):
+        if FILE_IDS.known(url):
+            results[url] = {"ok": True, "reason": None, "cached_file_id": True, "upload": False}
+        else:
+            todo.append(url)
+    if not todo:
+        return results
+
+    await asyncio.to_thread(prune_image_cache)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch(session: aiohttp.ClientSession, url: str):
+        cached = await asyncio.to_thread(_read_cached, url)
+        if cached:
+            reason = check_image(cached["size"], cached["type"])
+            results[url] = {**cached, "ok": reason is None, "reason": reason}
+            if reason is None and cached.get("validators"):
+                FILE_IDS.observe(url, cached["validators"])
+            return
+        async with sem:
+            started = time.perf_counter()
+            try:
+                async with session.get(url, allow_redirects=True) as resp:
+                    if resp.status != 200:
+                        results[url] = {"ok": False, "reason": f"HTTP {resp.status}", "upload": False}
+                        return
+                    length = int(resp.headers.get("Content-Length") or 0)
+                    if length > PHOTO_MAX_BYTES:
+                        results[url] = {"ok": False, "reason": f"слишком большое ({length // 1024} КБ)", "upload": False}
+                        return
+                    body = await _read_body(resp, PHOTO_MAX_BYTES)
+                    if length and len(body) != length:
+                        results[url] = {"ok": False, "reason": f"обрезано ({len(body)} из {length} байт)", "upload": False}
+                        return
+                    header_type = (resp.headers.get("Content-Type") or "").split(";")[0].strip().lower()
+                    validators = {h: resp.headers.get(h) for h in VALIDATOR_HEADERS}
+            except Exception as e:
+                results[url] = {"ok": False, "reason": f"недоступно ({e.__class__.__name__})", "upload": False}
+                return
+            elapsed = time.perf_counter() - started
+        # Тип определяется только по содержимому: страница ошибки с Content-Type image/jpeg
+        # иначе прошла бы проверку и сломала медиа-группу посреди публикации
+        mime = sniff_image_type(body[:16])
+        reason = check_image(len(body), mime) if mime else f"не картинка ({header_type or 'неизвестный тип'})"
+        if reason:
+            results[url] = {"ok": False, "reason": reason, "upload": False}
+            return
+        meta = {
+            "url": url, "type": mime, "size": len(body), "sha256": hashlib.sha256(body).hexdigest(),
+            "fetched": time.time(), "elapsed": round(elapsed, 3), "validators": validators,
+            # Telegram сам не скачает файлы больше 5 МБ, а медленный источник может не успеть отдать
+            "upload": len(body) > URL_PHOTO_MAX or elapsed > SLOW_URL_SECONDS,
+        }
+        FILE_IDS.observe(url, validators)
+        path = await asyncio.to_thread(_write_cached, url, body, meta)
+        results[url] = {**meta, "path": path, "ok": True, "reason": None}
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        await asyncio.gather(*(fetch(session, u) for u in todo))
+    return {u: results[u] for u in dict.fromkeys(urls)}
+
+
+def apply_preflight(plan: list[dict], results: dict[str, dict]) -> tuple[list[dict], list[str]]:
+    """
+    Убирает битые фото из плана и заново делит оставшиеся на группы.
+    Если у блока не осталось фото, подпись уходит обычным сообщением.
+    Возвращает новый план и список предупреждений.
+    """
+    warnings = [f"Пропущено фото {u}: {r['reason']}" for u, r in results.items() if not r["ok"]]
+    uploads = {u: r["path"] for u, r in results.items() if r["ok"] and r.get("upload") and r.get("path")}
+    out: list[dict] = []
+    i = 0
+    while i < len(plan):
+        op = plan[i]
+        if op["method"] not in ("send_media_group", "send_photo"):
+            out.append(op)
+            i += 1
+            continue
+        # Подряд идущие медиа-операции одного блока (одного вызова media_ops)
+        block = [op]
+        while (i + len(block) < len(plan)
+               and plan[i + len(block)]["method"] in ("send_media_group", "send_photo")
+               and plan[i + len(block)].get("caption") is None
+               and plan[i + len(block)].get("key") == op.get("key")):
+            block.append(plan[i + len(block)])
+        i += len(block)
+        urls = [u for b in block for u in b["media"] if results.get(u, {"ok": True})["ok"]]
+        # city_done стоит на последней операции блока — не терять его, даже если фото не осталось
+        extra = {k: v for b in block for k, v in b.items() if k in ("city_done",) and v is not None}
+        if urls:
+            new_ops = media_ops(urls, op.get("caption"), op["parse_mode"], op["chat_id"], op.get("thread_id"), key=op.get("key"))
+            for new_op in new_ops:
+                local = {u: uploads[u] for u in new_op["media"] if u in uploads}
+                if local:
+                    new_op["uploads"] = local
+            new_ops[-1].update(extra)
+            out.extend(new_ops)
+        elif op.get("caption"):
+            out.append({"key": op.get("key"), "method": "send_message", "chat_id": op["chat_id"],
+                        "thread_id": op.get("thread_id"), "text": op["caption"], "parse_mode": op["parse_mode"], **extra})
+    return out, warnings
+
+
+if __name__ == "__main__":
+    # Проверка на локальном HTTP сервере: хорошее, битое, не картинка, медленное
+    import tempfile
+    from aiohttp import web
+
+    PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 100
+    ETAG = ['"v1"']
+    BIG_PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * (3 * 1024 * 1024)
+
+    async def serve(request: web.Request):
+        name = request.match_info["name"]
+        if name == "ok.png":
+            return web.Response(body=PNG, content_type="image/png")
+        if name == "etag.png":
+            return web.Response(body=PNG, content_type="image/png", headers={"ETag": ETAG[0]})
+        if name == "slow.png":
+            await asyncio.sleep(0.3)
+            return web.Response(body=PNG, content_type="image/png")
+        if name == "big.png":
+            resp = web.StreamResponse(headers={"Content-Type": "image/png"})
+            resp.enable_chunked_encoding()
+            await resp.prepare(request)
+            for i in range(0, len(BIG_PNG), 100_000):
+                await resp.write(BIG_PNG[i:i + 100_000])
+                await asyncio.sleep(0.001)
+            await resp.write_eof()
+            return resp
+        if name == "fake.jpg":
+            return web.Response(text="<html>error</html>", content_type="image/jpeg")
+        if name == "page.png":
+            return web.Response(text="<html>", content_type="text/html")
+        return web.Response(status=404)
+
+    async def main():
+        global IMAGE_CACHE_DIR, SLOW_URL_SECONDS
+        IMAGE_CACHE_DIR = Path(tempfile.mkdtemp())
+        SLOW_URL_SECONDS = 0.2
+        FILE_IDS.entries = {}
+        app = web.Application()
+        app.router.add_get("/{name}", serve)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 18092).start()
+        base = "http://127.0.0.1:18092/"
+        urls = [base + n for n in ("ok.png", "slow.png", "page.png", "missing.png")]
+        results = await preflight_images(urls)
+        for u, r in results.items():
+            print(u.rsplit("/", 1)[-1], r["ok"], r["reason"], "upload" if r.get("upload") else "")
+        plan = media_ops(urls, "подпись", "HTML", 1, None, key="kazan")
+        plan, warnings = apply_preflight(plan, results)
+        print([(op["method"], len(op["media"]), op.get("uploads")) for op in plan], warnings)
+        assert [results[u]["ok"] for u in urls] == [True, True, False, False]
+        assert results[urls[1]]["upload"] and not results[urls[0]]["upload"]
+        fake = (await preflight_images([base + "fake.jpg"]))[base + "fake.jpg"]
+        assert not fake["ok"] and "image/jpeg" in fake["reason"], fake
+        big = (await preflight_images([base + "big.png"]))[base + "big.png"]
+        assert big["ok"] and big["size"] == len(BIG_PNG), big
+        assert sniff_image_type(b"RIFF\x00\x00\x00\x00WAVEfmt ") is None
+        assert sniff_image_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+        many = [f"{base}missing{i}.png" for i in range(12)]
+        block = media_ops(many, "подпись", "HTML", 1, None, key="kazan")
+        block[-1]["city_done"] = "kazan"
+        plan2, _ = apply_preflight(block, {u: {"ok": False, "reason": "x"} for u in many})
+        assert [op["method"] for op in plan2] == ["send_message"] and plan2[0]["city_done"] == "kazan", plan2
+        # file_id запоминается с заголовками скачивания; смена картинки до перепроверки не теряется
+        etag_url = base + "etag.png"
+        await preflight_images([etag_url])
+        FILE_IDS.remember(etag_url, "file-1")
+        assert FILE_IDS.entries[etag_url]["validators"]["ETag"] == '"v1"'
+        FILE_IDS.entries[etag_url]["checked"] = 0
+        await FILE_IDS.revalidate([etag_url])
+        assert FILE_IDS.known(etag_url)  # не изменилась — остаётся
+        ETAG[0] = '"v2"'
+        FILE_IDS.entries[etag_url]["checked"] = 0
+        await FILE_IDS.revalidate([etag_url])
+        assert not FILE_IDS.known(etag_url)
+        cached = await preflight_images(urls[:1])
+        assert cached[urls[0]]["ok"] and cached[urls[0]]["path"]
+        await runner.cleanup()
+
+    asyncio.run(main())
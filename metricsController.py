@@ -0,0 +1,253 @@
+# metricsController.py
+import asyncio
+import json
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiohttp import web
+
+# === Метрики: время обработчиков, вызовов Bot API и этапов публикации ===
+#
+# Гистограммы с фиксированными границами, как в Prometheus: наблюдение — это
+# bisect по ~15 границам и пара сложений, поэтому метрики включены всегда.
+# Отдаются в формате Prometheus (/metrics на webhook сервере или METRICS_PORT)
+# и/или периодически пишутся в лог одной JSON строкой (METRICS_LOG_INTERVAL).
+
+METRICS_PORT         = int(os.getenv("METRICS_PORT") or 0)             # 0 — отдельный HTTP сервер не поднимается
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL") or 0)   # с, 0 — не писать в лог
+
+# Границы в секундах: от обработчика в пару миллисекунд до минутной публикации
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последний — +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по границам корзин (верхняя граница корзины)."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Реестр метрик: histograms[name][labels] и counters[name][labels],
+    labels — кортеж пар (имя, значение).
+    """
+
+    def __init__(self):
+        self.histograms: dict[str, dict[tuple, Histogram]] = {}
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.help: dict[str, str] = {}
+        self.started = time.time()
+
+    def describe(self, name: str, text: str) -> None:
+        self.help[name] = text
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = tuple(labels.items())
+        series = self.histograms.setdefault(name, {})
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram()
+        hist.observe(value)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key = tuple(labels.items())
+        series = self.counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, **labels: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def reset(self) -> None:
+        self.histograms.clear()
+        self.counters.clear()
+
+    # --- вывод ---------------------------------------------------------------
+
+    def render_prometheus(self) -> str:
+        lines: list[str] = []
+        for name, series in self.counters.items():
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in series.items():
+                lines.append(f"{name}{_labels(labels)} {value:g}")
+        for name, series in self.histograms.items():
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, hist in series.items():
+                cumulative = 0
+                for bound, n in zip(hist.buckets, hist.counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {hist.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {hist.sum:.6f}")
+                lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+        lines.append(f"bot_uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict[str, Any]:
+        """Компактная сводка для лога: count, sum, p50/p99 по каждой серии."""
+        out: dict[str, Any] = {}
+        for name, series in self.histograms.items():
+            for labels, hist in series.items():
+                out[name + _labels(labels)] = {
+                    "count": hist.count, "sum": round(hist.sum, 4),
+                    "p50": hist.quantile(0.5), "p99": hist.quantile(0.99),
+                }
+        for name, series in self.counters.items():
+            for labels, value in series.items():
+                out[name + _labels(labels)] = value
+        return out
+
+    def summary(self, limit: int = 10) -> str:
+        """Самые затратные серии по суммарному времени — для /jobs."""
+        rows = [(hist.sum, name + _labels(labels), hist)
+                for name, series in self.histograms.items() for labels, hist in series.items()]
+        rows.sort(key=lambda r: r[0], reverse=True)
+        return "\n".join(f"{title}: {h.count} шт, всего {total:.1f} с, p50 ≤{h.quantile(0.5) * 1000:g} мс, p99 ≤{h.quantile(0.99) * 1000:g} мс"
+                         for total, title, h in rows[:limit])
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+    return "{" + ",".join(escaped) + "}"
+
+
+METRICS = Metrics()
+METRICS.describe("bot_handler_seconds", "Время обработчика апдейта")
+METRICS.describe("bot_handler_errors_total", "Исключения в обработчиках")
+METRICS.describe("bot_api_seconds", "Время вызова Bot API по методу")
+METRICS.describe("bot_api_errors_total", "Ошибки вызовов Bot API по методу")
+METRICS.describe("bot_stage_seconds", "Этапы конвейера публикации (разбор, рендер, разбиение)")
+METRICS.describe("bot_job_stage_seconds", "Этапы фоновых задач (загрузка, проверка фото, удаление, отправка)")
+METRICS.describe("bot_sheet_fetch_seconds", "Загрузка листов таблицы")
+
+
+# === Подключение к aiogram ===
+
+def handler_name(data: dict[str, Any]) -> str:
+    """Имя обработчика для меток: маршрут из таблицы routingController или сам callback."""
+    route = data.get("route")
+    if route is not None:
+        return route.name
+    return getattr(getattr(data.get("handler"), "callback", None), "__name__", "unknown")
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware (dp.message / dp.callback_query): вызывается только
+    для апдейтов, нашедших обработчик, имя которого и идёт в метку.
+    """
+
+    def __init__(self, event: str):
+        self.event = event
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Any, data: dict[str, Any]) -> Any:
+        name = handler_name(data)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            METRICS.inc("bot_handler_errors_total", handler=name, event=self.event)
+            raise
+        finally:
+            METRICS.observe("bot_handler_seconds", time.perf_counter() - started, handler=name, event=self.event)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии Bot: время каждого исходящего вызова по методу."""
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            METRICS.inc("bot_api_errors_total", method=name, error=type(e).__name__)
+            raise
+        finally:
+            METRICS.observe("bot_api_seconds", time.perf_counter() - started, method=name)
+
+
+def instrument(dp) -> None:
+    """Замеры обработчиков сообщений и кнопок диспетчера."""
+    dp.message.middleware(HandlerTimingMiddleware("message"))
+    dp.callback_query.middleware(HandlerTimingMiddleware("callback_query"))
+
+
+def instrument_bot(bot) -> None:
+    """Замеры исходящих вызовов Bot API через сессию бота."""
+    bot.session.middleware(ApiTimingMiddleware())
+
+
+# === Экспорт ===
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=METRICS.render_prometheus(), content_type="text/plain")
+
+
+async def serve_metrics(port: int = METRICS_PORT, host: str = "0.0.0.0") -> web.AppRunner:
+    """Отдельный сервер /metrics для режима polling."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Метрики: http://{host}:{port}/metrics")
+    return runner
+
+
+async def log_metrics_forever(interval: float = METRICS_LOG_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        if METRICS.histograms or METRICS.counters:
+            logging.info("metrics " + json.dumps(METRICS.snapshot(), ensure_ascii=False, default=str))
+
+
+if __name__ == "__main__":
+    n = 200_000
+    started = time.perf_counter()
+    for i in range(n):
+        METRICS.observe("bot_handler_seconds", (i % 100) / 1000, handler="cmd_start", event="message")
+    per_call = (time.perf_counter() - started) / n
+    print(f"observe: {per_call * 1e6:.2f} мкс")
+    hist = METRICS.histograms["bot_handler_seconds"][(("handler", "cmd_start"), ("event", "message"))]
+    assert hist.count == n and hist.quantile(0.5) == 0.05
+    text = METRICS.render_prometheus()
+    assert 'bot_handler_seconds_bucket{handler="cmd_start",event="message",le="+Inf"} 200000' in text
+    print(METRICS.summary())
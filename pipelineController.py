@@ -0,0 +1,292 @@
+# pipelineController.py
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from types import MappingProxyType
+from typing import Any, Callable
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+from markupController import visible_len
+from metricsController import METRICS
+from mediaController import FILE_IDS, PREFLIGHT_ENABLED, apply_preflight, preflight_images
+from telegramController import call_limited, estimate_send_seconds
+
+# === Этапы публикации: кэш результата по хэшу входа и замеры времени ===
+#
+# Каждый этап — чистая функция. Если на вход пришли те же данные (тот же хэш),
+# результат берётся из кэша: предпросмотр, обновление и ответы в чате
+# переиспользуют уже отрисованные блоки без повторного рендера.
+
+STAGE_STATS: dict[str, dict[str, float]] = {}
+
+
+def _jsonable(value: Any) -> Any:
+    # Неизменяемые представления снимка таблицы (sheetController.freeze)
+    if isinstance(value, MappingProxyType):
+        return dict(value)
+    return str(value)
+
+
+def stage_hash(value: Any) -> str:
+    """Стабильный хэш входа этапа: байты хэшируются напрямую, остальное через JSON."""
+    h = hashlib.sha1()
+    if isinstance(value, (bytes, bytearray)):
+        h.update(value)
+    else:
+        h.update(json.dumps(value, ensure_ascii=False, sort_keys=True, default=_jsonable).encode("utf-8"))
+    return h.hexdigest()
+
+
+def record_stage(name: str, elapsed: float, hit: bool = False) -> None:
+    stat = STAGE_STATS.setdefault(name, {"calls": 0, "hits": 0, "total": 0.0, "last": 0.0})
+    stat["calls"] += 1
+    stat["hits"] += int(hit)
+    stat["total"] += elapsed
+    stat["last"] = elapsed
+    METRICS.observe("bot_stage_seconds", elapsed, stage=name, cache="hit" if hit else "miss")
+
+
+@contextmanager
+def timed_stage(name: str):
+    """Замер этапа без кэша (например загрузки из сети)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def stage(name: str, cache_size: int = 64) -> Callable:
+    """Декоратор этапа: LRU кэш по хэшу аргументов + замер времени."""
+
+    def decorator(fn: Callable) -> Callable:
+        cache: OrderedDict[str, Any] = OrderedDict()
+
+        @wraps(fn)
+        def wrapper(*args):
+            started = time.perf_counter()
+            key = stage_hash(args) if len(args) != 1 else stage_hash(args[0])
+            if key in cache:
+                cache.move_to_end(key)
+                record_stage(name, time.perf_counter() - started, hit=True)
+                return cache[key]
+            result = fn(*args)
+            cache[key] = result
+            if len(cache) > cache_size:
+                cache.popitem(last=False)
+            record_stage(name, time.perf_counter() - started)
+            return result
+
+        wrapper.cache_clear = cache.clear
+        wrapper.cache_len = lambda: len(cache)
+        return wrapper
+
+    return decorator
+
+
+def stage_report() -> str:
+    """Сводка по этапам для логов и админов."""
+    lines = []
+    for name, st in STAGE_STATS.items():
+        avg = st["total"] / st["calls"] if st["calls"] else 0.0
+        lines.append(f"{name}: {st['calls']} вызовов, кэш {st['hits']}, среднее {avg * 1000:.1f} мс, последнее {st['last'] * 1000:.1f} мс")
+    return "\n".join(lines)
+
+
+def log_stage_report() -> None:
+    if STAGE_STATS:
+        logging.info("Этапы публикации:\n" + stage_report())
+
+
+# === Выполнение и описание плана отправки ===
+#
+# План — упорядоченный список вызовов Bot API:
+# {"method": "send_message" | "send_media_group" | "send_photo", "chat_id", "thread_id",
+#  "text" | "media" + "caption", "parse_mode", "key", "delay", "city_done"}
+# key — куда записать message_id в хранилище, delay — пауза после вызова.
+# Все вызовы идут через общий ограничитель скорости (telegramController.LIMITER).
+# Вызовы в разные темы/чаты выполняются параллельно (по «полосе» на тему),
+# внутри одной темы — строго в порядке плана.
+
+
+def op_text(op: dict) -> str:
+    return (op.get("text") if op["method"] == "send_message" else op.get("caption")) or ""
+
+
+def op_messages(op: dict) -> int:
+    return len(op["media"]) if op["method"] == "send_media_group" else 1
+
+
+async def send_media_op(bot, op: dict, target: int | str, thread_id: int | None) -> list[int]:
+    """
+    Отправляет фото операции. Уже загружавшиеся фото идут по file_id из кэша,
+    новые file_id запоминаются из ответа. Если Telegram не принял file_id — повтор по URL.
+    Фото из op["uploads"] (медленные/крупные источники) загружаются байтами из дискового кэша.
+    """
+    urls = op["media"]
+    uploads = op.get("uploads") or {}
+
+    def source(url: str, use_cache: bool):
+        if use_cache and FILE_IDS.known(url):
+            return FILE_IDS.resolve(url)
+        if url in uploads:
+            return types.FSInputFile(uploads[url])
+        return FILE_IDS.resolve(url) if use_cache else url
+
+    async def send(use_cache: bool):
+        media = [source(u, use_cache) for u in urls]
+        if op["method"] == "send_photo":
+            msg = await call_limited(target, lambda: bot.send_photo(
+                target, media[0], caption=op.get("caption"), parse_mode=op["parse_mode"], message_thread_id=thread_id
+            ))
+            return [msg]
+        items = [types.InputMediaPhoto(media=media[0], caption=op.get("caption"), parse_mode=op["parse_mode"])]
+        items += [types.InputMediaPhoto(media=m) for m in media[1:]]
+        return await call_limited(
+            target, lambda: bot.send_media_group(target, items, message_thread_id=thread_id), cost=len(items)
+        )
+
+    try:
+        msgs = await send(use_cache=True)
+    except TelegramBadRequest as e:
+        if "file" not in str(e).lower():
+            raise
+        FILE_IDS.forget(urls)
+        msgs = await send(use_cache=False)
+
+    for url, msg in zip(urls, msgs):
+        if getattr(msg, "photo", None):
+            FILE_IDS.remember(url, msg.photo[-1].file_id)
+    return [m.message_id for m in msgs]
+
+
+async def execute_plan(
+    bot,
+    plan: list[dict],
+    store: dict[str, list[int]] | None = None,
+    progress=None,
+    chat_id: int | str | None = None,
+) -> None:
+    """
+    Выполняет план: темы параллельно, внутри темы по порядку. message_id записываются в store[op["key"]].
+    chat_id переопределяет чат (предпросмотр в личке админа), тема при этом не указывается —
+    весь план тогда идёт одной полосой.
+    """
+    lanes = plan_lanes(plan, chat_id)
+    tasks = [asyncio.create_task(_execute_ops(bot, ops, store, progress, chat_id)) for ops in lanes.values()]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        # Ошибка или отмена в одной теме останавливает остальные
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        FILE_IDS.save()
+
+
+def plan_lanes(plan: list[dict], chat_id: int | str | None = None) -> dict[tuple, list[dict]]:
+    """Операции плана по темам (chat_id, thread_id) с сохранением порядка внутри темы."""
+    lanes: dict[tuple, list[dict]] = {}
+    for op in plan:
+        lane = (str(chat_id), None) if chat_id is not None else (str(op["chat_id"]), op.get("thread_id"))
+        lanes.setdefault(lane, []).append(op)
+    return lanes
+
+
+def plan_media_urls(plan: list[dict]) -> list[str]:
+    return [url for op in plan for url in op.get("media") or []]
+
+
+async def prepare_plan_media(plan: list[dict], progress=None) -> list[dict]:
+    """
+    До удаления старых сообщений: перепроверка file_id, скачивание и проверка новых фото.
+    Битые фото убираются из плана (предупреждения — в прогресс задачи и лог).
+    """
+    urls = plan_media_urls(plan)
+    if not urls or not PREFLIGHT_ENABLED:
+        return plan
+    await FILE_IDS.revalidate(urls)
+    results = await preflight_images(urls)
+    plan, warnings = apply_preflight(plan, results)
+    for warning in warnings:
+        logging.warning(warning)
+    if progress is not None:
+        progress.warnings.extend(warnings)
+    return plan
+
+
+async def _execute_ops(bot, plan, store, progress, chat_id) -> None:
+    for op in plan:
+        target = chat_id if chat_id is not None else op["chat_id"]
+        thread_id = None if chat_id is not None else op.get("thread_id")
+        if op["method"] in ("send_media_group", "send_photo"):
+            ids = await send_media_op(bot, op, target, thread_id)
+        else:
+            msg = await call_limited(target, lambda: bot.send_message(
+                target, op["text"], parse_mode=op["parse_mode"], message_thread_id=thread_id
+            ))
+            ids = [msg.message_id]
+        if store is not None and op.get("key"):
+            store.setdefault(op["key"], []).extend(ids)
+        if progress is not None:
+            progress.add_messages(len(ids))
+            if op.get("city_done"):
+                progress.set(done=progress.done + 1)
+        if op.get("delay"):
+            await asyncio.sleep(op["delay"])
+
+
+def describe_plan(plan: list[dict]) -> dict:
+    """Пробный прогон: точный список вызовов с размерами и оценкой времени, без обращения к Telegram."""
+    calls = []
+    for op in plan:
+        text = op_text(op)
+        calls.append({
+            "method":     op["method"],
+            "chat_id":    op["chat_id"],
+            "thread_id":  op.get("thread_id"),
+            "parse_mode": op.get("parse_mode"),
+            "text":       text,
+            "media":      list(op.get("media") or []),
+            "chars":      len(text),
+            "utf16":      visible_len(text, op.get("parse_mode")),  # то, что считает лимит Telegram
+            "bytes":      len(text.encode("utf-8")),
+            "messages":   op_messages(op),
+        })
+    messages = sum(c["messages"] for c in calls)
+    delays = sum(op.get("delay") or 0 for op in plan)
+    lanes = plan_lanes(plan)
+    return {
+        "calls":             calls,
+        "plan":              plan,
+        "api_calls":         len(calls),
+        "messages":          messages,
+        "chars":             sum(c["chars"] for c in calls),
+        "bytes":             sum(c["bytes"] for c in calls),
+        "media":             sum(len(c["media"]) for c in calls),
+        "lanes":             len(lanes),
+        "estimated_seconds": round(estimate_send_seconds(messages, delays, lanes=len(lanes)), 1),
+    }
+
+
+def render_plan_summary(summary: dict, title: str) -> str:
+    lines = [
+        f"Предпросмотр: {title}",
+        f"Вызовов API: {summary['api_calls']}, сообщений: {summary['messages']}, картинок: {summary['media']}, тем: {summary['lanes']}",
+        f"Текст: {summary['chars']} символов, {summary['bytes']} байт",
+        f"Оценка времени публикации: ~{summary['estimated_seconds']} с",
+        "",
+    ]
+    for i, call in enumerate(summary["calls"], start=1):
+        media = f", {len(call['media'])} фото" if call["media"] else ""
+        lines.append(f"{i}. {call['method']} → тема {call['thread_id']}: {call['utf16']} симв.{media}")
+    return "\n".join(lines)
@@ -0,0 +1,343 @@
+# profilerController.py
+import asyncio
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.types import BufferedInputFile
+
+from metricsController import METRICS, handler_name
+
+# === Профилирование по запросу: /perf ===
+#
+# cProfile включается на время следующих N обработчиков и фоновых задач (но не
+# дольше PERF_MAX_SECONDS) и видит всё, что в это время выполняется в event loop.
+# Работа в asyncio.to_thread (разбор CSV наблюдателем) в профиль не попадает.
+# Задержка event loop и длительность последних обработчиков и задач собираются
+# всегда — это дёшево — и входят в отчёт. Отчёт приходит файлом в личку.
+#
+# Сторож зависаний — отдельный поток: если event loop не отзывается дольше
+# STALL_THRESHOLD, поток снимает стек потока loop (где именно он заблокирован)
+# и запоминает, какой обработчик или задача в этот момент выполнялись.
+
+PERF_DEFAULT_COUNT = 20
+PERF_MAX_SECONDS   = float(os.getenv("PERF_MAX_SECONDS") or 300)
+PERF_TOP           = 30     # строк в таблицах функций
+LAG_INTERVAL       = 0.1    # с, период замера задержки event loop
+LAG_WINDOW         = 6000   # замеров в окне (10 минут)
+RECENT_CALLS       = 200    # последних обработчиков/задач для списка самых долгих
+STALL_THRESHOLD    = float(os.getenv("STALL_THRESHOLD") or 0.5)  # с, блокировка loop дольше считается зависанием
+STALL_HISTORY      = 20
+
+
+class LoopLagMonitor:
+    """Спит LAG_INTERVAL и меряет, насколько позже проснулся: это и есть задержка event loop."""
+
+    def __init__(self, interval: float = LAG_INTERVAL, window: int = LAG_WINDOW):
+        self.interval = interval
+        self.samples: deque[float] = deque(maxlen=window)
+        self.last_beat = 0.0  # time.monotonic() последнего пробуждения, читает сторож зависаний
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self.last_beat = time.monotonic()
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def stats_text(self) -> str:
+        if not self.samples:
+            return "Задержка event loop: замеров нет"
+        ordered = sorted(self.samples)
+        p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+        mean = sum(ordered) / len(ordered)
+        window = len(ordered) * self.interval
+        period = f"{window / 60:.0f} мин" if window >= 120 else f"{window:.0f} с"
+        return (f"Задержка event loop за {period}: средняя {mean * 1000:.1f} мс, "
+                f"p99 {p99 * 1000:.1f} мс, максимум {ordered[-1] * 1000:.1f} мс")
+
+
+@dataclass
+class Stall:
+    at: float              # time.time() обнаружения
+    context: str           # обработчик или задача (имя текущей задачи asyncio)
+    stack: list[str]       # стек потока event loop в момент блокировки
+    duration: float = 0.0  # с, уточняется, когда loop снова отзовётся
+
+    def render(self) -> str:
+        took = f"{self.duration:.2f} с" if self.duration else "ещё длится"
+        return (f"Зависание event loop {datetime.fromtimestamp(self.at):%H:%M:%S}, {took}, {self.context}\n"
+                + "".join(self.stack))
+
+
+class LoopStallError(AssertionError):
+    """Строгий режим: за время проверки event loop блокировался дольше порога."""
+
+
+class StallWatchdog:
+    """
+    Поток, который каждые threshold/4 проверяет пульс LoopLagMonitor. Пульс старше
+    threshold — loop заблокирован: снимается стек его потока и имя текущей задачи
+    (PerfMiddleware и JobRunner называют задачи по обработчику и задаче).
+    """
+
+    def __init__(self, monitor: LoopLagMonitor, threshold: float = STALL_THRESHOLD):
+        self.monitor = monitor
+        self.threshold = threshold
+        self.stalls: deque[Stall] = deque(maxlen=STALL_HISTORY)
+        self.total = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self._thread: threading.Thread | None = None
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Запускает пульс в текущем loop и поток сторожа (повторный вызов ничего не делает)."""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._task = self._loop.create_task(self.monitor.run(), name="пульс event loop")
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._watch, name="stall-watchdog", daemon=True)
+            self._thread.start()
+
+    def _watch(self):
+        reported_beat = None
+        stall: Stall | None = None
+        while self._task is not None and not self._task.done():
+            time.sleep(self.threshold / 4)
+            beat = self.monitor.last_beat
+            if stall is not None and beat != reported_beat:
+                # loop снова отзывается: длительность — от прошлого пульса до нового минус интервал сна
+                stall.duration = max(self.threshold, beat - reported_beat - self.monitor.interval)
+                METRICS.observe("bot_loop_stall_seconds", stall.duration)
+                logging.warning(stall.render())
+                stall = None
+            if not beat or beat == reported_beat or time.monotonic() - beat - self.monitor.interval < self.threshold:
+                continue
+            reported_beat = beat
+            stall = self.capture()
+            self.stalls.append(stall)
+            self.total += 1
+            METRICS.inc("bot_loop_stalls_total")
+
+    def capture(self) -> Stall:
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.format_stack(frame) if frame is not None else ["(стек недоступен)\n"]
+        task = asyncio.current_task(self._loop) if self._loop is not None else None
+        return Stall(time.time(), task.get_name() if task else "вне задачи (колбэк loop)", stack[-15:])
+
+    @asynccontextmanager
+    async def strict(self, threshold: float | None = None):
+        """
+        Строгий режим для проверок: любая блокировка loop дольше порога внутри
+        блока завершает его LoopStallError со стеком виновника.
+        """
+        previous, self.threshold = self.threshold, threshold or self.threshold
+        self.start()
+        await asyncio.sleep(self.monitor.interval)  # первый пульс
+        before = self.total
+        try:
+            yield self
+            await asyncio.sleep(self.threshold / 2)  # даём потоку дописать последнюю блокировку
+        finally:
+            self.threshold = previous
+        if self.total > before:
+            stalls = list(self.stalls)[-(self.total - before):]
+            raise LoopStallError(f"event loop блокировался {len(stalls)} раз:\n\n" + "\n".join(s.render() for s in stalls))
+
+    def stats_text(self, limit: int = 3) -> str:
+        if not self.total:
+            return f"Зависаний event loop дольше {self.threshold} с не было"
+        lines = [f"Зависаний event loop дольше {self.threshold} с: {self.total}, последние:"]
+        for stall in list(self.stalls)[-limit:]:
+            took = f"{stall.duration:.2f} с" if stall.duration else "ещё длится"
+            where = stall.stack[-1].strip().splitlines()[0] if stall.stack else ""
+            lines.append(f"{datetime.fromtimestamp(stall.at):%H:%M:%S} {took}, {stall.context}: {where}")
+        return "\n".join(lines)
+
+
+class PerfSession:
+    def __init__(self, bot: Bot, chat_id: int, count: int):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.count = count
+        self.seen = 0
+        self.started = time.perf_counter()
+        self.calls: list[tuple[float, str]] = []
+        self.profile = cProfile.Profile()
+
+
+class Profiler:
+    """
+    Хранит длительности последних обработчиков и задач и ведёт не больше одной
+    сессии cProfile. Сессия завершается после count вызовов, по таймауту или /perf stop.
+    """
+
+    def __init__(self):
+        self.lag = LoopLagMonitor()
+        self.watchdog = StallWatchdog(self.lag)
+        self.recent: deque[tuple[float, str, float]] = deque(maxlen=RECENT_CALLS)  # (длительность, что, когда)
+        self.session: PerfSession | None = None
+        self._timeout: asyncio.TimerHandle | None = None
+
+    @property
+    def active(self) -> bool:
+        return self.session is not None
+
+    def start(self, bot: Bot, chat_id: int, count: int = PERF_DEFAULT_COUNT) -> None:
+        if self.session is not None:
+            raise RuntimeError("профилирование уже идёт")
+        self.session = PerfSession(bot, chat_id, count)
+        self.session.profile.enable()
+        self._timeout = asyncio.get_running_loop().call_later(PERF_MAX_SECONDS, lambda: asyncio.create_task(self.stop()))
+        logging.info(f"Профилирование: следующие {count} обработчиков и задач")
+
+    def record(self, name: str, started: float, elapsed: float) -> None:
+        """Итог обработчика или задачи; started — perf_counter на старте."""
+        self.recent.append((elapsed, name, time.time()))
+        session = self.session
+        if session is None or started < session.started:
+            return  # начался до сессии (в том числе сама команда /perf)
+        session.calls.append((elapsed, name))
+        session.seen += 1
+        if session.seen >= session.count:
+            asyncio.get_running_loop().create_task(self.stop())
+
+    async def stop(self) -> bool:
+        """Останавливает сессию и отправляет отчёт. False — сессии не было."""
+        session, self.session = self.session, None
+        if session is None:
+            return False
+        session.profile.disable()
+        if self._timeout is not None:
+            self._timeout.cancel()
+            self._timeout = None
+        report = self.render(session)
+        name = f"perf-{datetime.now():%Y%m%d-%H%M%S}.txt"
+        try:
+            await session.bot.send_document(
+                session.chat_id,
+                BufferedInputFile(report.encode("utf-8"), filename=name),
+                caption=f"Профиль: {session.seen} вызовов за {time.perf_counter() - session.started:.1f} с",
+            )
+        except Exception:
+            logging.exception("Не удалось отправить отчёт профилирования")
+        return True
+
+    # --- отчёт ---------------------------------------------------------------
+
+    def slowest(self, limit: int = 10) -> list[str]:
+        rows = sorted(self.recent, reverse=True)[:limit]
+        return [f"{elapsed * 1000:9.1f} мс  {name}  ({datetime.fromtimestamp(ts):%H:%M:%S})" for elapsed, name, ts in rows]
+
+    def render(self, session: PerfSession) -> str:
+        elapsed = time.perf_counter() - session.started
+        lines = [
+            f"Профиль {datetime.now():%d.%m.%Y %H:%M:%S}: {session.seen} из {session.count} вызовов за {elapsed:.1f} с",
+            self.lag.stats_text(),
+            "",
+            "Вызовы в сессии (самые долгие):",
+            *(f"{t * 1000:9.1f} мс  {name}" for t, name in sorted(session.calls, reverse=True)[:15]),
+            "",
+            "Самые долгие обработчики и задачи за последнее время:",
+            *self.slowest(),
+            "",
+            *(s.render() for s in self.watchdog.stalls),
+        ]
+        for sort, title in (("tottime", "собственному"), ("cumulative", "общему")):
+            out = io.StringIO()
+            try:
+                stats = pstats.Stats(session.profile, stream=out)
+            except TypeError:
+                out.write("(пусто)\n")  # за сессию ничего не выполнялось
+            else:
+                stats.strip_dirs().sort_stats(sort).print_stats(PERF_TOP)
+            lines += ["", f"Функции по {title} времени:", out.getvalue().strip()]
+        return "\n".join(lines) + "\n"
+
+    def status_text(self) -> str:
+        lines = [self.lag.stats_text(), self.watchdog.stats_text()]
+        if self.session is not None:
+            lines.append(f"Идёт профилирование: {self.session.seen}/{self.session.count}")
+        if self.recent:
+            lines += ["Самые долгие обработчики и задачи:", *self.slowest(5)]
+        return "\n".join(lines)
+
+
+PROFILER = Profiler()
+
+
+class PerfMiddleware(BaseMiddleware):
+    """Длительность обработчиков для Profiler (внутренний middleware, как HandlerTimingMiddleware)."""
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Any, data: dict[str, Any]) -> Any:
+        name = handler_name(data)
+        # Имя задачи — контекст для сторожа зависаний; в webhook режиме задача-обработчик общая, имя возвращаем
+        task = asyncio.current_task()
+        previous = task.get_name() if task else None
+        if task:
+            update = data.get("event_update")
+            task.set_name(f"обработчик {name}" + (f" (update {update.update_id})" if update else ""))
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            PROFILER.record(f"обработчик {name}", started, time.perf_counter() - started)
+            if task:
+                task.set_name(previous)
+
+
+def record_job(job) -> None:
+    """Колбэк JOBS.on_finish: задача попадает в профиль так же, как обработчик."""
+    if job.started and job.finished:
+        PROFILER.record(f"задача {job.kind} #{job.id}", time.perf_counter() - job.duration, job.duration)
+
+
+if __name__ == "__main__":
+    class _Bot:
+        async def send_document(self, chat_id, document, caption=None):
+            print(caption)
+            print(document.data.decode()[:1500])
+
+    async def demo():
+        PROFILER.watchdog.start()
+        asyncio.current_task().set_name("обработчик demo")
+        await asyncio.sleep(0.15)
+        PROFILER.start(_Bot(), 1, count=2)
+        for i in range(2):
+            started = time.perf_counter()
+            sum(x * x for x in range(200_000))
+            time.sleep(1.0)  # блокирует loop — видно в задержке и у сторожа
+            await asyncio.sleep(0.05)
+            PROFILER.record(f"обработчик demo{i}", started, time.perf_counter() - started)
+        await asyncio.sleep(0.3)
+        assert PROFILER.session is None
+        assert PROFILER.watchdog.total == 2 and "time.sleep" in "".join(PROFILER.watchdog.stalls[0].stack)
+        print(PROFILER.status_text())
+
+        async with PROFILER.watchdog.strict(threshold=0.5):
+            time.sleep(0.2)  # короче порога — не ошибка
+        try:
+            async with PROFILER.watchdog.strict(threshold=0.1):
+                time.sleep(0.3)
+        except LoopStallError as e:
+            print(str(e).splitlines()[2])
+        else:
+            raise AssertionError("блокировка не обнаружена")
+
+    asyncio.run(demo())
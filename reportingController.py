@@ -1,151 +1,130 @@
 import asyncio
 import csv
 import io
-import json
+import logging
 import os
 import random
 import re
-import urllib.request
 from datetime import datetime, timedelta
-from pathlib import Path
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
 from aiogram import Bot, types
-import pandas as pd
+from aiogram.exceptions import TelegramBadRequest
 
-load_dotenv()
-
-CHAT_ID = os.getenv("CHAT_ID")
-CHAT_PUBLIC_ID =  745
+if TYPE_CHECKING:
+    import pandas as pd
 
-# === Работа с городами и его идентификации ===
+from jobController import JobProgress
+from locationsController import LOCATIONS, REGISTRY, detect_location_slug
+from markupController import Mark2, esc, esc_attr, split_message
+from mediaController import FILE_IDS, dedupe_urls, media_ops
+from pipelineController import describe_plan, execute_plan, log_stage_report, op_messages, prepare_plan_media, stage, timed_stage
+from sheetController import GIDS, SHEETS, fetch_tab_sync, sheet_url
+from storageController import STORE
+from telegramController import call_limited, is_message_missing, probe_messages
+from watcherController import ChangeEvent, affected_cities
 
-BEGIN_PUBLICATION_CELL = "N18"
-FINISH_PUBLICATION_CELL = "N19"
-
-# Массив локаций и их данные
-LOCATIONS = {
-    "kazan": {
-        "ru": "Казань",
-        "variants_ru": ["казан", "казани"],
-        "exel": {
-            "intro": "N2",
-            "outro": "N3",
-        }
-    },
-    "novosibirsk": {
-        "ru": "Новосибирск",
-        "variants_ru": ["новосиб", "новосибир", "новосибирске"],
-        "exel": {
-            "intro": "O2",
-            "outro": "O3",
-        }
-    },
-    "tomsk": {
-        "ru": "Томск",
-        "variants_ru": ["томск"],
-        "exel": {
-            "intro": "P2",
-            "outro": "P3",
-        }
-    },
-    "omsk": {
-        "ru": "Омск",
-        "variants_ru": ["омск"],
-        "exel": {
-            "intro": "Q2",
-            "outro": "Q3",
-        }
-    },
-    "barnaul": {
-        "ru": "Барнаул",
-        "variants_ru": ["барнаул"],
-        "exel": {
-            "intro": "R2",
-            "outro": "R3",
-        }
-    },
-    "cheboksary": {
-        "ru": "Чебоксары",
-        "variants_ru": ["чебокс"],
-        "exel": {
-            "intro": "S2",
-            "outro": "S3",
-        }
-    }
-}
+load_dotenv()
 
-def detect_location_slug(text: str) -> str | None:
-    """Определяет локацию, если её вариант стоит в начале строки (без учёта регистра)."""
-    text = text.lower().lstrip()
-    for slug, cfg in LOCATIONS.items():
-        if any(text.startswith(v) for v in cfg["variants_ru"]):
-            return slug
-    return None
+CHAT_ID = os.getenv("CHAT_ID")
 
-# === ===
+# Города, их темы, ячейки и варианты названий — в реестре locations.json (locationsController)
 
 # === Хранение message_id для редактирования сообщений после перезапуска ===
 
-REPORT_FILE = Path("report_data.json")
-INIT_REPORT_DATA = {slug: [] for slug in LOCATIONS}
-INIT_REPORT_DATA['all'] = []
+REPORT_KEY = "report_data"  # Ключ в общем хранилище (для file бэкенда — report_data.json)
+
+def empty_report_data() -> dict[str, list[int]]:
+    data = {slug: [] for slug in LOCATIONS}
+    data['all'] = []
+    return data
 
 def load_report_data() -> dict[str, list[int]]:
-    """Загружает message_id по каждому городу и для 'all' из файла."""
-    if REPORT_FILE.exists():
-        try:
-            data = json.loads(REPORT_FILE.read_text(encoding="utf-8"))
-            result = {slug: list(map(int, data.get(slug, []))) for slug in LOCATIONS}
-            result['all'] = list(map(int, data.get('all', [])))
+    """
+    Загружает message_id по каждому городу и для 'all' из хранилища.
+    Города, убранные из реестра, остаются в данных, чтобы их сообщения удалились при следующей публикации.
+    """
+    try:
+        data = STORE.get(REPORT_KEY)
+        if data:
+            result = empty_report_data()
+            result.update({key: list(map(int, ids)) for key, ids in data.items()})
             return result
-        except Exception:
-            pass
-    return INIT_REPORT_DATA.copy()
+    except Exception:
+        pass
+    return empty_report_data()
 
 
 def save_report_data(data: dict[str, list[int]]) -> None:
-    """Сохраняет message_id по каждому городу и для 'all' в файл без дубликатов."""
-    norm = {slug: sorted(set(data.get(slug, []))) for slug in LOCATIONS}
-    norm['all'] = sorted(set(data.get('all', [])))
-    REPORT_FILE.write_text(
-        json.dumps(norm, ensure_ascii=False, indent=2),
-        encoding="utf-8"
-    )
+    """Сохраняет message_id по каждому городу и для 'all' в хранилище без дубликатов."""
+    norm = empty_report_data()
+    norm.update({key: sorted(set(ids)) for key, ids in data.items() if ids or key in norm})
+    STORE.set(REPORT_KEY, norm)
+
 
+async def reconcile_report_data(bot: Bot) -> dict[str, list[int]]:
+    """
+    Сверяет сохранённые message_id с чатом после перезапуска.
+    Удалённые вручную сообщения убираются из хранилища, отчёт заново не публикуется.
+    """
+    store = load_report_data()
+    all_ids = {mid for lst in store.values() for mid in lst}
+    if not all_ids:
+        return store
+
+    alive = await probe_messages(bot, CHAT_ID, all_ids)
+    missing = all_ids - alive
+    if missing:
+        store = {key: [mid for mid in lst if mid in alive] for key, lst in store.items()}
+        save_report_data(store)
+        logging.info(f"Отчёт: {len(missing)} из {len(all_ids)} сообщений не найдены, убраны из хранилища.")
+    else:
+        logging.info(f"Отчёт: все {len(all_ids)} сообщений на месте.")
+    return store
 
 # === ===
 
 # === Парсинг данных с эксель таблицы ===
 
-def fetch_csv_df() -> pd.DataFrame:
-    url = (
-        "https://docs.google.com/spreadsheets/"
-        "d/1NRGPRwpMyXTe9LhS4adwfPo7nyx68GqweYdAdqo3LpM/"
-        "export?format=csv&gid=1265864442"
-    )
+STOCK_CSV_URL = sheet_url(GIDS["stock"])
+
+def fetch_csv_bytes() -> bytes:
+    """Скачивает CSV выгрузку листа с наличием (вне снимка таблицы, см. sheetController)."""
+    with timed_stage("загрузка"):
+        return fetch_tab_sync("stock")
+
+def load_pandas():
+    """
+    pandas (~0.2 с импорта) нужен только для разбора отчёта: грузится при первом
+    разборе или фоновым прогревом после старта бота (main.warm_up).
+    """
+    import pandas
+    return pandas
+
+def csv_bytes_to_df(raw: bytes) -> "pd.DataFrame":
+    pd = load_pandas()
+    df = pd.read_csv(io.BytesIO(raw), encoding='utf-8-sig', header=None)
+    df = df.where(pd.notna(df), None)  # ← заменяет все NaN на None
+
+    # Генерация буквенных заголовков: A, B, ..., Z, AA, AB, ...
+    def colname(n):
+        name = ""
+        while n >= 0:
+            name = chr(n % 26 + 65) + name
+            n = n // 26 - 1
+        return name
+
+    df.columns = [colname(i) for i in range(len(df.columns))]
+    return df
+
+def fetch_csv_df() -> "pd.DataFrame":
     try:
-        with urllib.request.urlopen(url) as resp:
-            if resp.status != 200:
-                raise Exception(f"Ошибка запроса: {resp.status}")
-            data = io.BytesIO(resp.read())
-            df = pd.read_csv(data, encoding='utf-8-sig', header=None)
-            df = df.where(pd.notna(df), None)  # ← заменяет все NaN на None
-
-            # Генерация буквенных заголовков: A, B, ..., Z, AA, AB, ...
-            def colname(n):
-                name = ""
-                while n >= 0:
-                    name = chr(n % 26 + 65) + name
-                    n = n // 26 - 1
-                return name
-
-            df.columns = [colname(i) for i in range(len(df.columns))]
-            return df
+        return csv_bytes_to_df(fetch_csv_bytes())
     except Exception as e:
         print(f"Ошибка при загрузке CSV: {e}")
-        return pd.DataFrame()
+        return load_pandas().DataFrame()
     
-def get_excel_cell_value(df: pd.DataFrame, cell: str):
+def get_excel_cell_value(df: "pd.DataFrame", cell: str):
     """Получение данных с указанной ячейки."""
 
     def split_cell(cell: str) -> tuple[str, int]:
@@ -167,7 +146,7 @@ def get_excel_cell_value(df: pd.DataFrame, cell: str):
 # === ===
 
 
-def parse_stock_data_from_csv(df: pd.DataFrame) -> dict[str, dict[str, list[dict]]]:
+def parse_stock_data_from_csv(df: "pd.DataFrame") -> dict[str, dict[str, list[dict]]]:
     # Найти строку с заголовками
     header_idx = None
     for i, row in df.iterrows():
@@ -229,24 +208,6 @@ def parse_stock_data_from_csv(df: pd.DataFrame) -> dict[str, dict[str, list[dict
     return result
 
 
-class Mark2:
-    @staticmethod
-    def escape(text: str) -> str:
-        return re.sub(r'([_*\[\]()~>#+=|{}.!\\-])', r'\\\1', text)
-
-    @classmethod
-    def bold(cls, text: str) -> str:
-        return f"*{cls.escape(text)}*"
-
-    @classmethod
-    def italic(cls, text: str) -> str:
-        return f"_{cls.escape(text)}_"
-
-    @classmethod
-    def link(cls, text: str, url: str) -> str:
-        return f"[{cls.escape(text)}]({cls.escape(url)})"
-
-
 def text_new_line(existing: str, addition: str) -> str:
         """Добавляет строку к существующей с двумя переносами, если обе непустые."""
         if not addition.strip():
@@ -256,37 +217,183 @@ def text_new_line(existing: str, addition: str) -> str:
         return f"{existing}\n\n{addition}"
 
 def split_text_safe(text: str, limit: int = 1024) -> list[str]:
-    """Разделяет текст на части, не обрывая строки, не превышая лимит."""
-    lines = text.splitlines(keepends=True)
-    parts = []
-    current = ""
-    for line in lines:
-        if len(current) + len(line) > limit:
-            parts.append(current.rstrip())
-            current = line
-        else:
-            current += line
-    if current.strip():
-        parts.append(current.rstrip())
-    return parts
+    """Разделяет MarkdownV2 текст на части по видимой длине, не ломая разметку (см. split_message)."""
+    return split_message(text, limit, "MarkdownV2")
+
+# === Пайплайн отчёта: таблица → модель → блоки городов → части → план отправки ===
+
+EMOJIS = ['🚀🚀🚀🚀🚀🚀', '🔥🔥🔥🔥🔥🔥']
+CAPTION_LIMIT = 1024
+MESSAGE_LIMIT = 4096
+
+def empty_city_data() -> dict:
+    return {"availability": {"list": []}, "onTheWay": {"list": []}, "intro": "", "outro": ""}
+
+@stage("разбор")
+def parse_report(raw: bytes) -> dict:
+    """Модель отчёта: тексты начала/конца и данные по каждому городу из LOCATIONS."""
+    df    = csv_bytes_to_df(raw)
+    stock = parse_stock_data_from_csv(df)
+    cities = {}
+    for slug, cfg in LOCATIONS.items():
+        city = stock.get(slug) or empty_city_data()
+        if slug not in stock:
+            # Город без позиций: текст до/после всё равно берём из таблицы
+            city["intro"] = str(get_excel_cell_value(df, cfg["exel"]["intro"]) or "").strip()
+            city["outro"] = str(get_excel_cell_value(df, cfg["exel"]["outro"]) or "").strip()
+        cities[slug] = city
+    return {
+        "begin":  str(get_excel_cell_value(df, REGISTRY.cells["begin"]) or "").strip(),
+        "finish": str(get_excel_cell_value(df, REGISTRY.cells["finish"]) or "").strip(),
+        "cities": cities,
+    }
+
+# Разбор зависит от ячеек и вариантов названий из реестра — после его перезагрузки кэш неактуален
+REGISTRY.on_reload(parse_report.cache_clear)
+
+@stage("рендер")
+def render_city_block(city_name: str, city: dict) -> dict:
+    """MarkdownV2 текст блока города и список его картинок."""
+    parts: list[str] = [Mark2.bold(f"Отчёт по складу ({city_name})")]
+    if city["intro"]:
+        parts.append(Mark2.escape(city["intro"]))
+
+    images: list[str] = []
+    for section, title in (("availability", "Наличие:"), ("onTheWay", "В пути:")):
+        items = city[section]["list"]
+        if not items:
+            continue
+        parts.append(Mark2.bold(title))
+        for it in items:
+            line = Mark2.link(it["name"], it["link"]) if it["link"] else Mark2.escape(it["name"])
+            if it["desc"]:
+                line += f" {Mark2.escape(it['desc'])}"
+            if it["reviews"]:
+                line += f" {Mark2.link('Отзывы', it['reviews'])}"
+            if it["price_avail"]:
+                line += f" Цена {Mark2.escape(it['price_avail'])}"
+            if it["link_order"] and it["price_order"]:
+                order_text = f"Под заказ {it['price_order']}"
+                line += f" {Mark2.link(order_text, it['link_order'])}"
+            elif it["link_order"]:
+                line += f" {Mark2.link('Под заказ', it['link_order'])}"
+            elif it["price_order"]:
+                line += f" Под заказ {Mark2.escape(it['price_order'])}"
+            if it["arrival"]:
+                arrival_text = f"Прибытие {it['arrival']}"
+                line += f"\n{Mark2.escape(arrival_text)}"
+            parts.append(line)
+            images.extend(it["images"])
+
+    if city["outro"]:
+        parts.append(Mark2.escape(city["outro"]))
+
+    return {"text": "\n\n".join(parts), "images": dedupe_urls(images)}
+
+@stage("разбиение")
+def chunk_city_block(text: str, with_images: bool) -> dict:
+    """Подпись к медиа-группе (если есть картинки) и текстовые части блока."""
+    if not with_images:
+        return {"caption": None, "chunks": split_message(text, MESSAGE_LIMIT, "MarkdownV2")}
+    cap, *rest = split_message(text, MESSAGE_LIMIT, "MarkdownV2", first_limit=CAPTION_LIMIT) or [""]
+    return {"caption": cap, "chunks": rest}
+
+def render_report(model: dict) -> dict[str, dict]:
+    """Отрисованные и разбитые блоки всех городов: {slug: {"text", "images", "caption", "chunks"}}."""
+    blocks = {}
+    for slug, cfg in LOCATIONS.items():
+        block = render_city_block(cfg["ru"], model["cities"][slug])
+        blocks[slug] = {**block, **chunk_city_block(block["text"], bool(block["images"]))}
+    return blocks
+
+def build_send_plan(model: dict, thread_id: int | None = None) -> list[dict]:
+    """
+    Упорядоченный список вызовов API. key — куда записать message_id (slug или "all"),
+    city_done — номер города, завершённого этим вызовом (для прогресса).
+    Города со своей темой публикуются параллельно с остальными (см. execute_plan),
+    разделители ставятся только между соседними городами одной темы.
+    thread_id — общая тема отчёта, по умолчанию из реестра.
+    """
+    thread_id = thread_id or REGISTRY.default_thread_id
+    with timed_stage("план"):
+        blocks = render_report(model)
+        plan: list[dict] = []
+
+        def text_op(key: str, text: str, thread: int = thread_id) -> dict:
+            op = {"key": key, "method": "send_message", "chat_id": CHAT_ID, "thread_id": thread,
+                  "text": text, "parse_mode": "MarkdownV2"}
+            plan.append(op)
+            return op
+
+        # —– начало блока
+        if model["begin"]:
+            text_op("all", Mark2.escape(model["begin"]))
+            text_op("all", random.choice(EMOJIS))
+
+        # —– города
+        slugs = list(LOCATIONS)
+        for idx, slug in enumerate(slugs, start=1):
+            block  = blocks[slug]
+            thread = REGISTRY.thread_for(slug, thread_id)
+            # --- публикация с картинками / без
+            if block["images"]:
+                plan.extend(media_ops(block["images"], block["caption"], "MarkdownV2", CHAT_ID, thread, key=slug))
+            for txt in block["chunks"]:
+                text_op(slug, txt, thread)
+            # разделитель
+            if idx < len(slugs) and REGISTRY.thread_for(slugs[idx], thread_id) == thread:
+                text_op("all", random.choice(EMOJIS), thread)
+            if plan:
+                plan[-1]["city_done"] = idx
+
+        # —– конец блока
+        if model["finish"]:
+            text_op("all", Mark2.escape(model["finish"]))
+        return plan
 
 async def update_reports(
     message: types.Message | None,
     bot: Bot,
     type_: str = "create",
-) -> None:
+    progress: JobProgress | None = None,
+    dry_run: bool = False,
+    raw: bytes | None = None,
+) -> dict | None:
     """
-    create  – публикуем новый отчёт, предварительно удаляя все старые сообщения  
+    create  – публикуем новый отчёт, предварительно удаляя все старые сообщения
     update  – логика обновления при необходимости (не реализована здесь)
+    progress – прогресс фоновой задачи: города, сообщения и время этапов
+    dry_run – ничего не удаляем и не отправляем, возвращаем план (describe_plan)
+    raw     – готовый CSV вместо загрузки из таблицы (например фикстура)
     """
-    # ---------- 1. Удаляем старые публикации ----------
+    progress = progress or JobProgress()
     store = load_report_data()          # {slug: [...], "all": [...]}
 
-    if type_ == "create" or type_ == "update":
-        ids_to_delete: set[int] = {
-            mid for lst in store.values() for mid in lst
-        }
-        if ids_to_delete:
+    if type_ not in ("create", "update"):
+        if all(not store[s] for s in LOCATIONS):
+            await message.answer("Обновление невозможно. Публикаций не найдено.")
+        return None
+
+    # ---------- 1. Готовим данные и план до удаления старых сообщений ----------
+    if raw is None:
+        with progress.timed("загрузка"):
+            raw = await SHEETS.tab("stock")
+    with progress.timed("подготовка"):
+        model = parse_report(raw)
+        plan  = build_send_plan(model)
+    progress.set(done=0, total=len(LOCATIONS))
+
+    if dry_run:
+        return describe_plan(plan)
+
+    # Проверяем, не поменялись ли картинки, у которых уже есть file_id
+    with progress.timed("проверка фото"):
+        plan = await prepare_plan_media(plan, progress)
+
+    # ---------- 2. Удаляем старые публикации ----------
+    ids_to_delete: set[int] = {mid for lst in store.values() for mid in lst}
+    if ids_to_delete:
+        with progress.timed("удаление"):
             for mid in sorted(ids_to_delete, reverse=True):
                 try:
                     await bot.delete_message(chat_id=CHAT_ID, message_id=mid)
@@ -294,125 +401,154 @@ async def update_reports(
                 except Exception:
                     pass                             # сообщение уже удалено/недоступно
 
-            # обнуляем хранилище и сохраняем
-            store = {slug: [] for slug in LOCATIONS}
-            store["all"] = []
-            save_report_data(store)
-
-    # ---------- 2. Готовим данные ----------
-    df         = fetch_csv_df()
-    stock      = parse_stock_data_from_csv(df)
-    begin_text = get_excel_cell_value(df, BEGIN_PUBLICATION_CELL)
-    finish_text= get_excel_cell_value(df, FINISH_PUBLICATION_CELL)
-    emojis     = ['🚀🚀🚀🚀🚀🚀', '🔥🔥🔥🔥🔥🔥']
-    thread_id  = CHAT_PUBLIC_ID
-
-    # ---------- 3. Публикация (type_ == "create") ----------
-    if type_ == "create" or type_ == "update":
-        # —– начало блока
-        if begin_text:
-            msg = await bot.send_message(
-                CHAT_ID, Mark2.escape(begin_text),
-                parse_mode="MarkdownV2", message_thread_id=thread_id
-            )
-            store["all"].append(msg.message_id)
-
-            msg = await bot.send_message(
-                CHAT_ID, random.choice(emojis),
-                parse_mode="MarkdownV2", message_thread_id=thread_id
-            )
-            store["all"].append(msg.message_id)
+        # обнуляем хранилище и сохраняем
+        store = {slug: [] for slug in LOCATIONS}
+        store["all"] = []
+        save_report_data(store)
 
-        # —– города
-        for idx, (slug, cfg) in enumerate(LOCATIONS.items(), start=1):
-            city_name = cfg["ru"]
-            intro     = stock[slug]["intro"]
-            outro     = stock[slug]["outro"]
-
-            parts: list[str] = [Mark2.bold(f"Отчёт по складу ({city_name})")]
-            if intro:
-                parts.append(Mark2.escape(intro))
-
-            images: list[str] = []
-            for section, title in (("availability", "Наличие:"), ("onTheWay", "В пути:")):
-                items = stock[slug][section]["list"]
-                if not items:
-                    continue
-                parts.append(Mark2.bold(title))
-                for it in items:
-                    line = Mark2.link(it["name"], it["link"]) if it["link"] else Mark2.escape(it["name"])
-                    if it["desc"]:
-                        line += f" {Mark2.escape(it['desc'])}"
-                    if it["reviews"]:
-                        line += f" {Mark2.link('Отзывы', it['reviews'])}"
-                    if it["price_avail"]:
-                        line += f" Цена {Mark2.escape(it['price_avail'])}"
-                    if it["link_order"] and it["price_order"]:
-                        order_text = f"Под заказ {it['price_order']}"
-                        line += f" {Mark2.link(order_text, it['link_order'])}"
-                    elif it["link_order"]:
-                        line += f" {Mark2.link('Под заказ', it['link_order'])}"
-                    elif it["price_order"]:
-                        line += f" Под заказ {Mark2.escape(it['price_order'])}"
-                    if it["arrival"]:
-                        arrival_text = f"Прибытие {it['arrival']}"
-                        line += f"\n{Mark2.escape(arrival_text)}"
-                    parts.append(line)
-                    images.extend(it["images"])
-
-            if outro:
-                parts.append(Mark2.escape(outro))
-
-            full_text = "\n\n".join(parts)
+    # ---------- 3. Публикация ----------
+    # Хранилище сохраняем и при ошибке/отмене, чтобы не потерять уже отправленные сообщения
+    try:
+        with progress.timed("отправка"):
+            await execute_plan(bot, plan, store, progress)
+    finally:
+        save_report_data(store)
+        STORE.set(REPORT_LAYOUT_KEY, plan_layout(plan))
+        log_stage_report()
+        logging.info(FILE_IDS.stats_text())
 
-            # --- публикация с картинками / без
-            if images:
-                cap, *rest = split_text_safe(full_text, 1024)
-                media = [types.InputMediaPhoto(
-                    media=images[0],
-                    caption=cap,
-                    parse_mode="MarkdownV2"
-                )]
-                media += [types.InputMediaPhoto(media=u) for u in images[1:10]]
-                msgs = await bot.send_media_group(CHAT_ID, media, message_thread_id=thread_id)
-                store[slug].extend(m.message_id for m in msgs)
-
-                remaining = "\n".join(rest)
-                chunks = split_text_safe(remaining, 4096)
-            else:
-                chunks = split_text_safe(full_text, 4096)
 
-            for txt in chunks:
-                msg = await bot.send_message(
-                    CHAT_ID, txt, parse_mode="MarkdownV2", message_thread_id=thread_id
-                )
-                store[slug].append(msg.message_id)
-                await asyncio.sleep(0.5)
+# === Обновление только изменившихся городов ===
+#
+# Для каждого города запоминается раскладка публикации: какие фото и сколько текстовых
+# сообщений. Если фото те же и число сообщений совпадает, сообщения города редактируются
+# на месте. Город в собственной теме можно переопубликовать целиком, не трогая остальные.
+# В остальных случаях (изменилась структура в общей теме, начало/конец отчёта) — полная публикация.
 
-            # разделитель
-            if idx < len(LOCATIONS):
-                msg = await bot.send_message(
-                    CHAT_ID, random.choice(emojis),
-                    parse_mode="MarkdownV2", message_thread_id=thread_id
-                )
-                store["all"].append(msg.message_id)
+REPORT_LAYOUT_KEY = "report_layout"  # {slug: {"media": [url, ...], "texts": n}}
 
-        # —– конец блока
-        if finish_text:
-            msg = await bot.send_message(
-                CHAT_ID, Mark2.escape(finish_text),
-                parse_mode="MarkdownV2", message_thread_id=thread_id
-            )
-            store["all"].append(msg.message_id)
+def plan_layout(plan: list[dict]) -> dict[str, dict]:
+    layout: dict[str, dict] = {}
+    for op in plan:
+        if op.get("key") in (None, "all"):
+            continue
+        entry = layout.setdefault(op["key"], {"media": [], "texts": 0})
+        if op["method"] == "send_message":
+            entry["texts"] += 1
+        else:
+            entry["media"].extend(op["media"])
+    return layout
+
+def city_has_own_topic(slug: str) -> bool:
+    """Город один в своей теме: там нет ни других городов, ни начала/конца отчёта."""
+    thread = REGISTRY.thread_for(slug)
+    return thread != REGISTRY.default_thread_id and all(REGISTRY.thread_for(s) != thread for s in LOCATIONS if s != slug)
+
+async def edit_city_messages(bot: Bot, ids: list[int], ops: list[dict]) -> None:
+    """Редактирует подпись и тексты города на месте. ids — его сообщения в порядке отправки."""
+    pos = 0
+    for op in ops:
+        mid = ids[pos]
+        if op["method"] == "send_message":
+            call = lambda: bot.edit_message_text(op["text"], chat_id=CHAT_ID, message_id=mid, parse_mode=op["parse_mode"])
+        elif op.get("caption") is not None:
+            call = lambda: bot.edit_message_caption(chat_id=CHAT_ID, message_id=mid, caption=op["caption"], parse_mode=op["parse_mode"])
+        else:
+            call = None
+        if call is not None:
+            try:
+                await call_limited(CHAT_ID, call)
+            except TelegramBadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+        pos += op_messages(op)
+
+async def update_cities(bot: Bot, raw: bytes, slugs: set[str], progress: JobProgress | None = None) -> bool:
+    """
+    Обновляет только города slugs. False — на месте обновить нельзя, нужна полная публикация.
+    """
+    progress = progress or JobProgress()
+    store  = load_report_data()
+    layout = STORE.get(REPORT_LAYOUT_KEY) or {}
+    with progress.timed("подготовка"):
+        model = parse_report(raw)
+        # city_done нужен только полной публикации
+        city_plan = [{k: v for k, v in op.items() if k != "city_done"}
+                     for op in build_send_plan(model) if op.get("key") in slugs]
+    with progress.timed("проверка фото"):
+        city_plan = await prepare_plan_media(city_plan, progress)
+    new_layout = plan_layout(city_plan)
+    ordered = [slug for slug in LOCATIONS if slug in slugs]
+    progress.set(done=0, total=len(ordered))
 
+    try:
+        for slug in ordered:
+            ops = [op for op in city_plan if op["key"] == slug]
+            ids = sorted(store.get(slug, []))
+            new = new_layout.get(slug, {"media": [], "texts": 0})
+            old = layout.get(slug)
+            if ids and old is not None and old["media"] == new["media"] and len(ids) == len(new["media"]) + new["texts"]:
+                with progress.timed("редактирование"):
+                    try:
+                        await edit_city_messages(bot, ids, ops)
+                    except TelegramBadRequest as e:
+                        if is_message_missing(e):
+                            return False
+                        raise
+                progress.add_messages(len(ids))
+            elif city_has_own_topic(slug):
+                with progress.timed("удаление"):
+                    for mid in ids:
+                        try:
+                            await bot.delete_message(chat_id=CHAT_ID, message_id=mid)
+                        except Exception:
+                            pass
+                store[slug] = []
+                with progress.timed("отправка"):
+                    await execute_plan(bot, ops, store, progress)
+            else:
+                logging.info(f"Отчёт: у города {slug} изменилась структура в общей теме, нужна полная публикация.")
+                return False
+            layout[slug] = new
+            progress.set(done=progress.done + 1)
+    finally:
         save_report_data(store)
-
-    # ---------- 4. Обновление (type_ == "update") ----------
-    else:
-        if all(not store[s] for s in LOCATIONS):
-            await message.answer("Обновление невозможно. Публикаций не найдено.")
-            return
-        # (допишите логику при необходимости)
+        STORE.set(REPORT_LAYOUT_KEY, layout)
+    return True
+
+async def apply_report_changes(bot: Bot, raw: bytes, events: list[ChangeEvent], progress: JobProgress | None = None) -> None:
+    """Применяет изменения таблицы к опубликованному отчёту: по городам или, если нельзя, целиком."""
+    store = load_report_data()
+    if not any(store.values()):
+        logging.info("Отчёт не опубликован, изменения таблицы не применяются.")
+        return
+    slugs = affected_cities(events)
+    if slugs is not None and not slugs:
+        return
+    if slugs is None or not await update_cities(bot, raw, slugs, progress):
+        await update_reports(None, bot, type_="create", progress=progress, raw=raw)
+
+
+# === Короткий отчёт по городу для ответов чата ===
+
+CHAT_REPORT_MAX_AGE = 300  # с, ответы в чате могут взять снимок таблицы не старше 5 минут
+
+async def get_report(city: str, mode: str) -> str:
+    """HTML список позиций города: mode «наличие» или «в пути». Берёт снимок таблицы не старше CHAT_REPORT_MAX_AGE."""
+    slug = detect_location_slug(city)
+    if slug is None:
+        return "Город не найден."
+    model = (await SHEETS.get(max_age=CHAT_REPORT_MAX_AGE)).stock
+    section = "onTheWay" if "пут" in mode.lower() else "availability"
+    lines = []
+    for it in model["cities"][slug][section]["list"]:
+        line = f"<a href='{esc_attr(it['link'])}'>{esc(it['name'])}</a>" if it["link"] else esc(it["name"])
+        if it["price_avail"]:
+            line += f" — {esc(it['price_avail'])}"
+        if section == "onTheWay" and it["arrival"]:
+            line += f", прибытие {esc(it['arrival'])}"
+        lines.append(line)
+    return "\n".join(lines) or "Позиций нет."
 
 
 # для совместимости: если где-то ещё зовётся send_reports
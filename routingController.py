@@ -0,0 +1,227 @@
+# routingController.py
+import inspect
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot, types
+
+# === Маршрутизация: права и тип чата — один раз на апдейт, кнопки — словарём ===
+#
+# Раньше каждый обработчик был обёрнут admin_only/from_personal_only, а каждое
+# сообщение по очереди проходило десяток фильтров F.text == "...". Синхронные
+# фильтры aiogram выполняет через asyncio.to_thread, поэтому даже сообщение
+# участника группы, не адресованное боту, стоило ~9 переходов в пул потоков.
+# Теперь RoutingMiddleware один раз определяет is_admin и chat_kind, а текст
+# кнопки, команда и callback_data ищутся в словарях одним асинхронным фильтром.
+
+# Администраторы: ADMIN_IDS=1303257033,577151281 (через запятую или пробел)
+ADMIN_IDS: frozenset[int] = frozenset(
+    int(x) for x in re.split(r"[,\s]+", os.getenv("ADMIN_IDS") or "1303257033,577151281") if x
+)
+
+PRIVATE = "private"  # личный чат с ботом
+GROUP   = "group"    # group и supergroup
+CHAT_KINDS = {"private": PRIVATE, "group": GROUP, "supergroup": GROUP}
+
+ACCESS_DENIED = "Недостаточно прав."
+
+
+def is_admin(user_id: int | None) -> bool:
+    return user_id in ADMIN_IDS
+
+
+class RoutingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware (dp.message / dp.callback_query): кладёт в data is_admin
+    и chat_kind до проверки фильтров. Для кнопок тип чата берётся из сообщения
+    с клавиатурой (event_chat), у самого CallbackQuery поля chat нет.
+    """
+
+    async def __call__(self, handler: Callable[..., Awaitable[Any]], event: Any, data: dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        data["is_admin"] = user is not None and user.id in ADMIN_IDS
+        data["chat_kind"] = CHAT_KINDS.get(chat.type) if chat else None
+        return await handler(event, data)
+
+
+@dataclass(frozen=True)
+class Route:
+    handler: Callable[..., Awaitable[Any]]
+    admin: bool = False            # только для ADMIN_IDS
+    chat: str | None = None        # PRIVATE, GROUP или None — любой чат
+    params: frozenset[str] | None = None  # аргументы обработчика из data; None — принимает **kwargs
+
+    @classmethod
+    def of(cls, handler: Callable[..., Awaitable[Any]], admin: bool = False, chat: str | None = None) -> "Route":
+        sig = inspect.signature(handler)
+        if any(p.kind is p.VAR_KEYWORD for p in sig.parameters.values()):
+            params = None
+        else:
+            params = frozenset(list(sig.parameters)[1:])  # первый — само сообщение или кнопка
+        return cls(handler, admin, chat, params)
+
+    @property
+    def name(self) -> str:
+        return self.handler.__name__
+
+    async def __call__(self, event: types.Message | types.CallbackQuery, data: dict[str, Any]) -> Any:
+        # Порядок как у прежних декораторов: сначала права (с ответом), затем тип чата (молча)
+        if self.admin and not data.get("is_admin"):
+            if isinstance(event, types.CallbackQuery):
+                return await event.answer(ACCESS_DENIED, show_alert=True)
+            return await event.answer(ACCESS_DENIED)
+        if self.chat is not None and data.get("chat_kind") != self.chat:
+            return None
+        if self.params is None:
+            return await self.handler(event, **data)
+        return await self.handler(event, **{k: v for k, v in data.items() if k in self.params})
+
+
+class Routes:
+    """
+    Таблица маршрутов: точный текст кнопки, команда (/name, /name@bot) и
+    callback_data (точное значение или префикс "name:"). В диспетчер
+    регистрируется двумя обработчиками, порядок относительно остальных
+    обработчиков задаёт место вызова register().
+    """
+
+    def __init__(self):
+        self.texts: dict[str, Route] = {}
+        self.commands: dict[str, Route] = {}
+        self.callbacks: dict[str, Route] = {}
+        self.prefixes: dict[str, Route] = {}
+
+    # --- регистрация --------------------------------------------------------
+
+    def text(self, *texts: str, admin: bool = False, chat: str | None = None):
+        return self._add(self.texts, texts, admin, chat)
+
+    def command(self, *names: str, admin: bool = False, chat: str | None = None):
+        return self._add(self.commands, names, admin, chat)
+
+    def callback(self, *values: str, admin: bool = False, chat: str | None = None):
+        """Значение с двоеточием на конце ("job_cancel:") — префикс."""
+        exact = tuple(v for v in values if not v.endswith(":"))
+        prefixes = tuple(v[:-1] for v in values if v.endswith(":"))
+
+        def decorator(handler):
+            self._add(self.callbacks, exact, admin, chat)(handler)
+            return self._add(self.prefixes, prefixes, admin, chat)(handler)
+        return decorator
+
+    @staticmethod
+    def _add(table: dict[str, Route], keys: tuple[str, ...], admin: bool, chat: str | None):
+        def decorator(handler):
+            route = Route.of(handler, admin, chat)
+            for key in keys:
+                if key in table:
+                    raise ValueError(f"Маршрут '{key}' уже занят обработчиком {table[key].name}")
+                table[key] = route
+            return handler
+        return decorator
+
+    # --- поиск (фильтры aiogram) ---------------------------------------------
+
+    async def match_message(self, message: types.Message, bot: Bot) -> dict[str, Any] | bool:
+        text = message.text
+        route = self.texts.get(text) if text is not None else None
+        if route is None:
+            text = text or message.caption
+            if not text or text[0] != "/" or not self.commands:
+                return False
+            name, _, mention = text.split(maxsplit=1)[0][1:].partition("@")
+            route = self.commands.get(name)
+            if route is None:
+                return False
+            if mention:
+                me = await bot.me()
+                if me.username and mention.lower() != me.username.lower():
+                    return False
+        return {"route": route}
+
+    async def match_callback(self, callback: types.CallbackQuery) -> dict[str, Any] | bool:
+        value = callback.data
+        if value is None:
+            return False
+        route = self.callbacks.get(value)
+        if route is None and ":" in value:
+            route = self.prefixes.get(value.split(":", 1)[0])
+        return {"route": route} if route else False
+
+    @staticmethod
+    async def dispatch(event: types.Message | types.CallbackQuery, route: Route, **data: Any) -> Any:
+        return await route(event, data)
+
+    def register(self, dp) -> None:
+        dp.message.register(self.dispatch, self.match_message)
+        dp.callback_query.register(self.dispatch, self.match_callback)
+
+
+def guarded(admin: bool = False, chat: str | None = None):
+    """
+    Те же проверки для обработчиков вне таблицы (например, шагов формы со
+    StateFilter): is_admin и chat_kind уже посчитаны RoutingMiddleware.
+    """
+    def decorator(handler):
+        route = Route.of(handler, admin, chat)
+
+        async def wrapper(event, **data):
+            return await route(event, data)
+
+        wrapper.__name__ = handler.__name__
+        wrapper.__qualname__ = handler.__qualname__
+        return wrapper
+    return decorator
+
+
+if __name__ == "__main__":
+    import asyncio
+    from types import SimpleNamespace
+
+    routes = Routes()
+    calls = []
+
+    @routes.text("Создать акцию", admin=True, chat=PRIVATE)
+    async def cmd_create(message, state):
+        calls.append(("create", state))
+
+    @routes.command("start", chat=PRIVATE)
+    async def cmd_start(message):
+        calls.append(("start",))
+
+    @routes.callback("job_cancel:", admin=True)
+    async def cb_cancel(callback):
+        calls.append(("cancel", callback.data))
+
+    async def check():
+        bot = SimpleNamespace(me=None)
+        msg = SimpleNamespace(text="Создать акцию", caption=None, answer=None)
+        found = await routes.match_message(msg, bot)
+        assert found["route"].name == "cmd_create"
+        await routes.dispatch(msg, found["route"], is_admin=True, chat_kind=PRIVATE, state="S", bot=bot)
+        assert calls[-1] == ("create", "S")
+        # не тот тип чата — молча
+        await routes.dispatch(msg, found["route"], is_admin=True, chat_kind=GROUP, state="S")
+        assert len(calls) == 1
+        # не админ — ответ «Недостаточно прав.»
+        answered = []
+
+        async def answer(text, **kwargs):
+            answered.append(text)
+        msg.answer = answer
+        await routes.dispatch(msg, found["route"], is_admin=False, chat_kind=PRIVATE, state="S")
+        assert answered == [ACCESS_DENIED] and len(calls) == 1
+
+        assert (await routes.match_message(SimpleNamespace(text="/start", caption=None), bot))["route"].name == "cmd_start"
+        assert await routes.match_message(SimpleNamespace(text="привет", caption=None), bot) is False
+        assert await routes.match_message(SimpleNamespace(text="/unknown", caption=None), bot) is False
+        cb = SimpleNamespace(data="job_cancel:abc123")
+        assert (await routes.match_callback(cb))["route"].name == "cb_cancel"
+        assert await routes.match_callback(SimpleNamespace(data="other")) is False
+
+    asyncio.run(check())
+    print("admins:", sorted(ADMIN_IDS))
+    print("OK")
@@ -0,0 +1,268 @@
+# schedulerController.py
+import asyncio
+import hashlib
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+from zoneinfo import ZoneInfo
+
+from storageController import LEADER, STORE, BaseStore
+
+# === Публикация по расписанию с проверкой изменений ===
+#
+# Расписание в формате cron из 5 полей: минута час день месяц день_недели
+# (*, */n, a-b, a-b/n, списки через запятую; день недели 0–6, 0 — воскресенье).
+# Как в обычном cron, если ограничены и день месяца, и день недели, достаточно
+# совпадения любого из них: «0 9 1 * 1» — 1-го числа и по понедельникам.
+# На каждом срабатывании лист таблицы скачивается и хэшируется: если содержимое
+# не изменилось с прошлой публикации, ничего не публикуется.
+# Расписания и итоги запусков лежат в общем хранилище, выполняет их только ведущий.
+
+SCHEDULES_KEY = "schedules"
+SCHEDULE_TZ   = ZoneInfo(os.getenv("SCHEDULE_TZ") or "Europe/Moscow")
+TICK_SECONDS  = 30
+
+SCHEDULE_KINDS = {
+    "report":  "Отчет о наличии",
+    "general": "Отправление в общую",
+}
+
+# Последний статус запуска
+PUBLISHED = "published"
+UNCHANGED = "unchanged"
+FAILED    = "failed"
+
+SCHEDULE_STATUS_RU = {
+    PUBLISHED: "опубликовано",
+    UNCHANGED: "без изменений",
+    FAILED:    "ошибка",
+}
+
+CRON_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 6))
+
+
+def parse_cron_field(field: str, low: int, high: int) -> set[int]:
+    values: set[int] = set()
+    for part in field.split(","):
+        rng, _, step = part.partition("/")
+        step = int(step) if step else 1
+        if rng == "*":
+            start, end = low, high
+        elif "-" in rng:
+            start, end = (int(x) for x in rng.split("-", 1))
+        else:
+            start = end = int(rng)
+        if step < 1 or start < low or end > high or start > end:
+            raise ValueError(f"значение «{part}» вне диапазона {low}–{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_cron(expr: str) -> list[set[int]]:
+    """Разбирает cron выражение. Бросает ValueError с понятным текстом."""
+    fields = expr.split()
+    if len(fields) != 5:
+        raise ValueError("нужно 5 полей: минута час день месяц день_недели")
+    try:
+        return [parse_cron_field(f, low, high) for f, (low, high) in zip(fields, CRON_RANGES)]
+    except ValueError as e:
+        raise ValueError(f"«{expr}»: {e}") from None
+
+
+def cron_matches(fields: list[set[int]], dt: datetime) -> bool:
+    minute, hour, day, month, weekday = fields
+    day_ok = dt.day in day
+    weekday_ok = (dt.weekday() + 1) % 7 in weekday
+    (day_low, day_high), (wd_low, wd_high) = CRON_RANGES[2], CRON_RANGES[4]
+    if len(day) <= day_high - day_low and len(weekday) <= wd_high - wd_low:
+        days_match = day_ok or weekday_ok  # ограничены оба поля — правило ИЛИ, как в cron
+    else:
+        days_match = day_ok and weekday_ok
+    return dt.minute in minute and dt.hour in hour and dt.month in month and days_match
+
+
+def next_run(expr: str, after: float) -> float:
+    """Ближайший момент срабатывания строго после after (timestamp) в поясе SCHEDULE_TZ."""
+    fields = parse_cron(expr)
+    dt = datetime.fromtimestamp(after, SCHEDULE_TZ).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = dt + timedelta(days=366)
+    while dt < limit:
+        if dt.hour not in fields[1] or dt.month not in fields[3]:
+            dt = dt.replace(minute=0) + timedelta(hours=1)  # целый час не подходит
+            continue
+        if cron_matches(fields, dt):
+            return dt.timestamp()
+        dt += timedelta(minutes=1)
+    raise ValueError(f"«{expr}» не срабатывает в течение года")
+
+
+def content_hash(raw: bytes) -> str:
+    return hashlib.sha256(raw).hexdigest()
+
+
+def format_ts(ts: float | None) -> str:
+    return datetime.fromtimestamp(ts, SCHEDULE_TZ).strftime("%d.%m %H:%M") if ts else "—"
+
+
+class Scheduler:
+    """
+    Расписания в общем хранилище: {id: {"kind", "cron", "enabled", "next", "force",
+    "last_run", "last_status", "last_duration", "last_messages", "last_error", "last_hash"}}.
+    fetchers[kind] — корутина-функция загрузки сырого листа (bytes, см. sheetController.SHEETS),
+    publish(kind, raw) — публикация, возвращает {"status", "messages", "error"}; задаётся в main.
+    """
+
+    def __init__(self, store: BaseStore, is_leader: Callable[[], bool] = lambda: True):
+        self.store = store
+        self.is_leader = is_leader
+        self.fetchers: dict[str, Callable[[], Awaitable[bytes]]] = {}
+        self.publish: Callable[[str, bytes], Awaitable[dict]] | None = None
+
+    # --- управление -----------------------------------------------------------
+
+    def schedules(self) -> dict[str, dict]:
+        return self.store.get(SCHEDULES_KEY) or {}
+
+    def _modify(self, schedule_id: str, fn: Callable[[dict], None]) -> bool:
+        found = False
+
+        def apply(all_: dict | None):
+            nonlocal found
+            all_ = all_ or {}
+            if schedule_id in all_:
+                fn(all_[schedule_id])
+                found = True
+            return all_
+
+        self.store.update(SCHEDULES_KEY, apply, {})
+        return found
+
+    def add(self, kind: str, cron: str) -> dict:
+        if kind not in SCHEDULE_KINDS:
+            raise ValueError(f"неизвестная публикация «{kind}», доступны: {', '.join(SCHEDULE_KINDS)}")
+        schedule = {
+            "id": uuid.uuid4().hex[:4], "kind": kind, "cron": cron, "enabled": True,
+            "next": next_run(cron, time.time()), "force": False,
+            "last_run": None, "last_status": None, "last_duration": None,
+            "last_messages": None, "last_error": None, "last_hash": None,
+        }
+        self.store.update(SCHEDULES_KEY, lambda all_: {**(all_ or {}), schedule["id"]: schedule}, {})
+        return schedule
+
+    def remove(self, schedule_id: str) -> bool:
+        removed = False
+
+        def drop(all_: dict | None):
+            nonlocal removed
+            all_ = dict(all_ or {})
+            removed = all_.pop(schedule_id, None) is not None
+            return all_
+
+        self.store.update(SCHEDULES_KEY, drop, {})
+        return removed
+
+    def set_enabled(self, schedule_id: str, enabled: bool) -> bool:
+        def apply(s: dict):
+            s["enabled"] = enabled
+            if enabled:
+                s["next"] = next_run(s["cron"], time.time())
+        return self._modify(schedule_id, apply)
+
+    def run_now(self, schedule_id: str) -> bool:
+        """Запуск на ближайшем тике ведущего, даже если таблица не менялась."""
+        return self._modify(schedule_id, lambda s: s.update(next=0, force=True))
+
+    # --- выполнение -----------------------------------------------------------
+
+    async def run(self, schedule: dict) -> dict:
+        """Скачивает лист, сравнивает хэш и публикует при изменениях. Итог пишется в хранилище."""
+        started = time.perf_counter()
+        result = {"last_run": time.time(), "last_error": None, "last_messages": 0, "force": False}
+        try:
+            raw = await self.fetchers[schedule["kind"]]()
+            digest = content_hash(raw)
+            if digest == schedule.get("last_hash") and not schedule.get("force"):
+                result["last_status"] = UNCHANGED
+            else:
+                outcome = await self.publish(schedule["kind"], raw)
+                result["last_messages"] = outcome.get("messages", 0)
+                if outcome.get("status") == "done":
+                    result["last_status"] = PUBLISHED
+                    result["last_hash"] = digest  # при ошибке хэш не обновляем: повтор на следующем срабатывании
+                else:
+                    result["last_status"] = FAILED
+                    result["last_error"] = outcome.get("error") or outcome.get("status")
+        except Exception as e:
+            logging.exception(f"Расписание {schedule['id']} ({schedule['kind']}) завершилось с ошибкой")
+            result["last_status"] = FAILED
+            result["last_error"] = str(e) or e.__class__.__name__
+        result["last_duration"] = round(time.perf_counter() - started, 2)
+        await asyncio.to_thread(self._modify, schedule["id"], lambda s: s.update(result))
+        logging.info(f"Расписание {schedule['id']} {schedule['kind']}: {result['last_status']} за {result['last_duration']} с")
+        return result
+
+    async def tick(self, now: float | None = None) -> list[str]:
+        """Запускает расписания, у которых подошло время. Возвращает их id."""
+        now = now or time.time()
+        due = []
+        for schedule_id, schedule in (await asyncio.to_thread(self.schedules)).items():
+            if not schedule.get("enabled") or (schedule.get("next") or 0) > now:
+                continue
+            # Следующее время ставим до запуска: долгая публикация не приведёт к повтору
+            await asyncio.to_thread(self._modify, schedule_id, lambda s: s.update(next=next_run(s["cron"], now)))
+            due.append(schedule)
+        for schedule in due:
+            await self.run(schedule)
+        return [s["id"] for s in due]
+
+    async def run_forever(self, interval: float = TICK_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            if not self.is_leader() or self.publish is None:
+                continue
+            try:
+                await self.tick()
+            except Exception:
+                logging.exception("Ошибка планировщика публикаций")
+
+    def describe(self) -> str:
+        schedules = self.schedules()
+        if not schedules:
+            return "Расписаний нет. Добавить: /schedule add report */30 9-21 * * *"
+        lines = [f"Расписания (пояс {SCHEDULE_TZ.key}):"]
+        for s in schedules.values():
+            state = "вкл" if s["enabled"] else "выкл"
+            lines.append(f"\n#{s['id']} {SCHEDULE_KINDS[s['kind']]}: «{s['cron']}», {state}, следующий {format_ts(s['next'] if s['enabled'] else None)}")
+            if s.get("last_run"):
+                last = (f"Последний: {format_ts(s['last_run'])}, {SCHEDULE_STATUS_RU.get(s['last_status'], s['last_status'])}, "
+                        f"{s['last_duration']} с")
+                if s.get("last_messages"):
+                    last += f", сообщений {s['last_messages']}"
+                if s.get("last_error"):
+                    last += f", {s['last_error']}"
+                lines.append(last)
+        return "\n".join(lines)
+
+
+SCHEDULER = Scheduler(STORE, is_leader=lambda: LEADER.is_leader)
+
+
+if __name__ == "__main__":
+    base = datetime(2024, 5, 6, 8, 59, tzinfo=SCHEDULE_TZ).timestamp()  # понедельник
+    assert datetime.fromtimestamp(next_run("*/30 9-21 * * *", base), SCHEDULE_TZ).strftime("%H:%M") == "09:00"
+    assert datetime.fromtimestamp(next_run("0 10 * * 0", base), SCHEDULE_TZ).strftime("%a %H:%M") == "Sun 10:00"
+    # день месяца и день недели ограничены оба — срабатывает по любому из них
+    assert datetime.fromtimestamp(next_run("0 9 1 * 1", base), SCHEDULE_TZ).strftime("%d.%m %H:%M") == "06.05 09:00"
+    assert datetime.fromtimestamp(next_run("0 9 1 * 3", base), SCHEDULE_TZ).strftime("%d.%m %H:%M") == "08.05 09:00"
+    assert datetime.fromtimestamp(next_run("0 9 1 * *", base), SCHEDULE_TZ).strftime("%d.%m %H:%M") == "01.06 09:00"
+    for bad in ("* * *", "61 * * * *", "5-1 * * * *"):
+        try:
+            parse_cron(bad)
+        except ValueError as e:
+            print(e)
+        else:
+            raise AssertionError(bad)
+    print("OK")
@@ -0,0 +1,424 @@
+# sheetController.py
+import asyncio
+import csv
+import hashlib
+import io
+import logging
+import os
+import random
+import sys
+import time
+import urllib.request
+from dataclasses import dataclass, field
+from functools import cached_property
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Mapping
+
+import aiohttp
+
+from metricsController import METRICS
+
+# === Снимок таблицы: все листы одной выгрузкой ===
+#
+# Отчёт, отправление в общую и ответы чата читают разные листы одной таблицы.
+# Снимок скачивает все листы параллельно за один шаг, и все потребители одной
+# операции работают с одной и той же версией данных. Версия растёт, только если
+# изменилось содержимое хотя бы одного листа. Разобранные данные — неизменяемые
+# представления (MappingProxyType / tuple), их нельзя случайно испортить в кэше.
+
+SHEET_ID = "1NRGPRwpMyXTe9LhS4adwfPo7nyx68GqweYdAdqo3LpM"
+GIDS = {
+    "stock":   "1265864442",  # наличие по городам (отчёт)
+    "general": "1339673984",  # отправление в общую
+    "faq":     "384502621",   # вопросы и ответы чата
+}
+SNAPSHOT_MAX_AGE = float(os.getenv("SHEET_SNAPSHOT_MAX_AGE") or 10)  # с, свежий снимок переиспользуется
+FETCH_TIMEOUT = 30
+
+
+def sheet_url(gid: str) -> str:
+    return f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=csv&gid={gid}"
+
+
+# === Источники листов ===
+#
+# Откуда берутся листы, решает SHEET_SOURCE:
+#   google           — CSV выгрузка Google Sheets (по умолчанию)
+#   dir:<путь>       — папка с <лист>.csv или <лист>.xlsx (stock, general, faq)
+#   synthetic:<rows> — сгенерированные данные в памяти (нагрузочные проверки, бенчмарки)
+# Все источники отдают лист как CSV bytes, остальной код от источника не зависит.
+
+
+class SheetSource:
+    name = "base"
+
+    def fetch_sync(self, tab: str) -> bytes:
+        raise NotImplementedError
+
+    async def fetch(self, tab: str) -> bytes:
+        return await asyncio.to_thread(self.fetch_sync, tab)
+
+    async def fetch_all(self, tabs: list[str]) -> dict[str, bytes]:
+        bodies = await asyncio.gather(*(self.fetch(tab) for tab in tabs))
+        return dict(zip(tabs, bodies))
+
+    def url(self, tab: str) -> str | None:
+        """HTTP адрес листа для условных запросов (наблюдение за таблицей), если он есть."""
+        return None
+
+
+class GoogleSheetSource(SheetSource):
+    name = "google"
+
+    def __init__(self, gids: Mapping[str, str] = GIDS):
+        self.gids = dict(gids)
+
+    def url(self, tab: str) -> str:
+        return sheet_url(self.gids[tab])
+
+    def fetch_sync(self, tab: str) -> bytes:
+        with urllib.request.urlopen(self.url(tab), timeout=FETCH_TIMEOUT) as resp:
+            if resp.status != 200:
+                raise Exception(f"Ошибка запроса листа {tab}: {resp.status}")
+            return resp.read()
+
+    async def fetch_all(self, tabs: list[str]) -> dict[str, bytes]:
+        async def one(session: aiohttp.ClientSession, tab: str) -> bytes:
+            async with session.get(self.url(tab), allow_redirects=True) as resp:
+                resp.raise_for_status()
+                return await resp.read()
+
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=FETCH_TIMEOUT)) as session:
+            bodies = await asyncio.gather(*(one(session, tab) for tab in tabs))
+        return dict(zip(tabs, bodies))
+
+    async def fetch(self, tab: str) -> bytes:
+        return (await self.fetch_all([tab]))[tab]
+
+
+class DirectorySource(SheetSource):
+    """Листы из папки: <tab>.csv, либо <tab>.xlsx (первый лист книги, нужен openpyxl)."""
+
+    name = "dir"
+
+    def __init__(self, path: str | os.PathLike):
+        self.path = Path(path)
+
+    def fetch_sync(self, tab: str) -> bytes:
+        csv_path = self.path / f"{tab}.csv"
+        if csv_path.exists():
+            return csv_path.read_bytes()
+        xlsx_path = self.path / f"{tab}.xlsx"
+        if xlsx_path.exists():
+            import pandas as pd  # только для xlsx
+            df = pd.read_excel(xlsx_path, header=None, dtype=str)
+            return df.to_csv(index=False, header=False).encode("utf-8")
+        raise FileNotFoundError(f"Нет листа {tab} в {self.path} (ожидается {tab}.csv или {tab}.xlsx)")
+
+
+class MemorySource(SheetSource):
+    name = "memory"
+
+    def __init__(self, tabs: Mapping[str, bytes] | None = None):
+        self.tabs: dict[str, bytes] = dict(tabs or {})
+
+    def fetch_sync(self, tab: str) -> bytes:
+        if tab not in self.tabs:
+            raise KeyError(f"Нет листа {tab} в памяти")
+        return self.tabs[tab]
+
+    async def fetch(self, tab: str) -> bytes:
+        return self.fetch_sync(tab)
+
+
+def create_source(spec: str | None = None) -> SheetSource:
+    spec = spec or os.getenv("SHEET_SOURCE") or "google"
+    kind, _, arg = spec.partition(":")
+    if kind == "google":
+        return GoogleSheetSource()
+    if kind == "dir":
+        return DirectorySource(arg or "sheets")
+    if kind == "synthetic":
+        return synthetic_source(int(arg or 1000))
+    raise ValueError(f"Неизвестный SHEET_SOURCE: {spec}")
+
+
+def fetch_tab_sync(tab: str) -> bytes:
+    """Синхронная загрузка одного листа из текущего источника (для кода вне event loop)."""
+    with METRICS.timer("bot_sheet_fetch_seconds", tabs=tab):
+        return SOURCE.fetch_sync(tab)
+
+
+# === Синтетические данные ===
+#
+# Листы той же структуры, что и настоящие: города и ячейки — из реестра городов.
+# Используются источником synthetic:<rows> и бенчмарками.
+
+STOCK_HEADER = ["Склад", "Статус", "Кол", "Название", "Ссылка", "Описание", "Картинки",
+                "Отзывы по модели", "Цена из наличия", "Цена под заказ", "Под заказ", "Прибытие"]
+GENERAL_HEADER = ["В начале", "В конце", "Кол", "Название", "Ссылка", "Описание",
+                  "Отзывы по модели", "Под заказ", "Под заказ ссылка", "Фото"]
+FAQ_HEADER = ["Варианты вопросов", "Варианты ответов", "Ключевые слова"]
+
+WORDS = ("смартфон", "наушники", "чехол", "зарядка", "планшет", "часы", "колонка", "кабель",
+         "ноутбук", "мышь", "клавиатура", "роутер", "камера", "монитор", "пульт", "адаптер")
+
+
+def _cell_index(cell: str) -> tuple[int, int]:
+    letters = cell.rstrip("0123456789")
+    col = 0
+    for ch in letters:
+        col = col * 26 + ord(ch) - 64
+    return int(cell[len(letters):]) - 1, col - 1
+
+
+def _to_csv(rows: list[list[str]]) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+def generate_stock(rows: int, seed: int = 0, images: int = 2) -> bytes:
+    from locationsController import REGISTRY
+
+    rnd = random.Random(seed)
+    cells = [_cell_index(c) for c in _registry_cells(REGISTRY)]
+    header_row = max(r for r, _ in cells) + 2  # заголовки ниже ячеек с текстами начала/конца
+    width = max(len(STOCK_HEADER), max(c for _, c in cells) + 1)
+    table = [[""] * width for _ in range(header_row + 1 + rows)]
+    for cell, text in (
+        (REGISTRY.cells["begin"], "Отчёт по складу на сегодня (наличие и поставки)."),
+        (REGISTRY.cells["finish"], "Вопросы — в личные сообщения!"),
+    ):
+        r, c = _cell_index(cell)
+        table[r][c] = text
+    for cfg in REGISTRY.locations.values():
+        for part, text in (("intro", f"Склад {cfg['ru']}: самовывоз 10-20."), ("outro", "Доставка по городу.")):
+            r, c = _cell_index(cfg["exel"][part])
+            table[r][c] = text
+    table[header_row][:len(STOCK_HEADER)] = STOCK_HEADER
+    cities = [cfg["ru"] for cfg in REGISTRY.locations.values()]
+    for i in range(rows):
+        name = f"{rnd.choice(WORDS).capitalize()} {rnd.choice(WORDS)} модель {i} (v{rnd.randint(1, 9)}.{rnd.randint(0, 9)})"
+        table[header_row + 1 + i][:len(STOCK_HEADER)] = [
+            rnd.choice(cities),
+            rnd.choice(["В наличии", "В наличии", "В пути"]),
+            str(rnd.randint(0, 20)),
+            name,
+            f"https://shop.example.com/p/{i}",
+            rnd.choice(["", "новинка!", "скидка -10%", "цвет: чёрный/белый"]),
+            " ".join(f"https://img.example.com/{i}_{k}.jpg" for k in range(rnd.randint(0, images))),
+            rnd.choice(["", f"https://reviews.example.com/{i}"]),
+            f"{rnd.randint(1, 300) * 100:,}".replace(",", " ") + " ₽",
+            rnd.choice(["", f"{rnd.randint(1, 300) * 100} ₽"]),
+            rnd.choice(["", f"https://shop.example.com/order/{i}"]),
+            rnd.choice(["", f"{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}"]),
+        ]
+    return _to_csv(table)
+
+
+def _registry_cells(registry) -> list[str]:
+    cells = list(registry.cells.values())
+    for cfg in registry.locations.values():
+        cells += [cfg["exel"]["intro"], cfg["exel"]["outro"]]
+    return cells
+
+
+def generate_general(rows: int, seed: int = 0) -> bytes:
+    rnd = random.Random(seed)
+    table = [GENERAL_HEADER]
+    for i in range(rows):
+        table.append([
+            "Поступление!" if i == 0 else "",
+            "Ждём вас!" if i == 0 else "",
+            str(rnd.randint(0, 5)),
+            f"{rnd.choice(WORDS).capitalize()} {i}",
+            f"https://shop.example.com/p/{i}",
+            rnd.choice(["", "<тест & экранирования>", "лучший выбор"]),
+            rnd.choice(["", f"https://reviews.example.com/{i}"]),
+            rnd.choice(["", f"{rnd.randint(1, 300) * 100} ₽"]),
+            rnd.choice(["", f"https://shop.example.com/order/{i}"]),
+            rnd.choice(["", f"https://img.example.com/g{i}.jpg"]),
+        ])
+    return _to_csv(table)
+
+
+def generate_faq(questions: int, seed: int = 0) -> bytes:
+    rnd = random.Random(seed)
+    table = [FAQ_HEADER]
+    for i in range(questions):
+        a, b = rnd.sample(WORDS, 2)
+        table.append([
+            f"Есть ли {a} {i}?;Сколько стоит {a} {b}?;Когда будет {a}",
+            f"Ответ {i}: {a} есть в наличии;Уточните у менеджера",
+            f"{a};{b}",
+        ])
+    return _to_csv(table)
+
+
+def synthetic_source(stock_rows: int, general_rows: int | None = None, faq_questions: int | None = None,
+                     seed: int = 0) -> MemorySource:
+    return MemorySource({
+        "stock":   generate_stock(stock_rows, seed),
+        "general": generate_general(general_rows if general_rows is not None else min(stock_rows, 50), seed),
+        "faq":     generate_faq(faq_questions if faq_questions is not None else 50, seed),
+    })
+
+
+def freeze(value: Any) -> Any:
+    """Глубокая неизменяемая копия: dict → MappingProxyType, list → tuple."""
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def csv_rows(raw: bytes) -> tuple[Mapping[str, str], ...]:
+    return tuple(MappingProxyType(row) for row in csv.DictReader(io.StringIO(raw.decode("utf-8-sig"))))
+
+
+@dataclass(frozen=True)
+class SheetSnapshot:
+    version: int
+    fetched_at: float
+    raw: Mapping[str, bytes]
+    hashes: Mapping[str, str] = field(default_factory=dict)
+
+    @cached_property
+    def stock(self) -> Mapping:
+        """Модель отчёта (reportingController.parse_report)."""
+        from reportingController import parse_report
+        return freeze(parse_report(self.raw["stock"]))
+
+    @cached_property
+    def general_rows(self) -> tuple[Mapping[str, str], ...]:
+        return csv_rows(self.raw["general"])
+
+    @cached_property
+    def faq_rows(self) -> tuple[Mapping[str, str], ...]:
+        return csv_rows(self.raw["faq"])
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def describe(self) -> str:
+        sizes = ", ".join(f"{tab} {len(body) // 1024} КБ" for tab, body in self.raw.items())
+        return f"Снимок таблицы v{self.version} ({self.age:.0f} с назад): {sizes}"
+
+
+class SheetSnapshots:
+    """
+    Выдаёт снимки таблицы. Одновременные запросы ждут одну загрузку,
+    снимок моложе max_age отдаётся без обращения к источнику.
+    """
+
+    def __init__(self, source: SheetSource | None = None, tabs: tuple[str, ...] = tuple(GIDS)):
+        self.source = source
+        self.tabs = list(tabs)
+        self.latest: SheetSnapshot | None = None
+        self.downloads = 0
+        self._inflight: asyncio.Future | None = None
+
+    async def _download(self) -> SheetSnapshot:
+        started = time.perf_counter()
+        raw = await (self.source or SOURCE).fetch_all(self.tabs)
+        self.downloads += len(raw)
+        METRICS.observe("bot_sheet_fetch_seconds", time.perf_counter() - started, tabs="all")
+        hashes = {tab: hashlib.sha256(body).hexdigest() for tab, body in raw.items()}
+        previous = self.latest
+        if previous is not None and dict(previous.hashes) == hashes:
+            version = previous.version
+        else:
+            version = (previous.version if previous else 0) + 1
+        snapshot = SheetSnapshot(version, time.time(), MappingProxyType(raw), MappingProxyType(hashes))
+        logging.info(f"Снимок таблицы v{version}: {len(raw)} листов за {time.perf_counter() - started:.2f} с")
+        self.latest = snapshot
+        return snapshot
+
+    async def get(self, max_age: float = SNAPSHOT_MAX_AGE) -> SheetSnapshot:
+        """Свежий снимок: из памяти, из уже идущей загрузки или новой загрузкой."""
+        if self.latest is not None and self.latest.age <= max_age:
+            return self.latest
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._download())
+            self._inflight.add_done_callback(lambda _: setattr(self, "_inflight", None))
+        return await asyncio.shield(self._inflight)
+
+    async def tab(self, name: str, max_age: float = SNAPSHOT_MAX_AGE) -> bytes:
+        """
+        Один лист: из свежего снимка или идущей загрузки, иначе скачивается только он
+        (планировщику и обновлению отчёта остальные листы не нужны).
+        """
+        if self.latest is not None and self.latest.age <= max_age:
+            return self.latest.raw[name]
+        if self._inflight is not None:
+            return (await asyncio.shield(self._inflight)).raw[name]
+        started = time.perf_counter()
+        body = await (self.source or SOURCE).fetch(name)
+        self.downloads += 1
+        METRICS.observe("bot_sheet_fetch_seconds", time.perf_counter() - started, tabs=name)
+        return body
+
+
+SOURCE = create_source()
+SHEETS = SheetSnapshots()
+
+
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] == "generate":
+    # Синтетические листы в папку для SHEET_SOURCE=dir:<папка>:
+    # python sheetController.py generate <папка> [строк наличия] [строк общей] [вопросов]
+    out = Path(sys.argv[2] if len(sys.argv) > 2 else "sheets")
+    sizes = [int(x) for x in sys.argv[3:6]] + [None] * (3 - len(sys.argv[3:6]))
+    source = synthetic_source(sizes[0] or 1000, sizes[1], sizes[2])
+    out.mkdir(parents=True, exist_ok=True)
+    for tab, body in source.tabs.items():
+        (out / f"{tab}.csv").write_bytes(body)
+        print(f"{out / tab}.csv: {len(body) // 1024} КБ")
+
+elif __name__ == "__main__":
+    # Проверка на локальном сервере вместо Google: один запрос на лист при одновременных вызовах
+    from aiohttp import web
+
+    bodies = {gid: f"Кол,Название\n1,лист {gid}\n".encode() for gid in GIDS.values()}
+    hits: list[str] = []
+
+    async def serve(request: web.Request):
+        gid = request.query["gid"]
+        hits.append(gid)
+        await asyncio.sleep(0.05)
+        return web.Response(body=bodies[gid])
+
+    async def main():
+        global sheet_url
+        app = web.Application()
+        app.router.add_get("/sheet", serve)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", 18094).start()
+        sheet_url = lambda gid: f"http://127.0.0.1:18094/sheet?gid={gid}"
+
+        snaps = SheetSnapshots(GoogleSheetSource())
+        a, b = await asyncio.gather(snaps.get(), snaps.get())
+        assert a is b and len(hits) == 3, hits
+        print(a.describe(), a.general_rows[0]["Название"])
+        again = await snaps.get(max_age=0)
+        assert again.version == a.version  # содержимое не менялось
+        bodies[GIDS["faq"]] += b"2,new\n"
+        assert (await snaps.get(max_age=0)).version == a.version + 1
+        try:
+            a.general_rows[0]["Кол"] = "5"
+        except TypeError:
+            print("только чтение")
+        await runner.cleanup()
+
+        # Синтетический источник: структура совпадает с настоящей
+        synthetic = await SheetSnapshots(synthetic_source(300, 20, 10)).get()
+        cities = synthetic.stock["cities"]
+        print(synthetic.describe(), {slug: len(c["availability"]["list"]) for slug, c in cities.items()})
+        assert sum(len(c["availability"]["list"]) + len(c["onTheWay"]["list"]) for c in cities.values()) > 200
+        assert synthetic.stock["begin"] and len(synthetic.faq_rows) == 10
+
+    asyncio.run(main())
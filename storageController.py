@@ -0,0 +1,369 @@
+# storageController.py
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable
+
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+try:
+    import fcntl  # Блокировки файлов есть только на Unix
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+# === Настройки общего хранилища ===
+
+STATE_BACKEND = os.getenv("STATE_BACKEND") or "file"  # file | sqlite | memory
+STATE_PATH    = os.getenv("STATE_PATH") or ""          # Папка для file, путь к базе для sqlite
+
+# === Хранилища ===
+#
+# Все хранилища — это ключ → JSON-значение. Атомарность обеспечивает update():
+# прочитать значение, изменить функцией и записать под блокировкой.
+# Очереди и аренды (lease) построены поверх update(), поэтому новому бэкенду
+# (например Redis) достаточно реализовать get/set/delete/update.
+
+
+class BaseStore:
+    def get(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def update(self, key: str, fn: Callable[[Any], Any], default: Any = None) -> Any:
+        """Атомарно заменяет значение на fn(старое) и возвращает новое."""
+        raise NotImplementedError
+
+    # --- очередь ------------------------------------------------------------
+
+    def push(self, key: str, value: Any) -> None:
+        self.update(key, lambda lst: (lst or []) + [value], [])
+
+    def pop_all(self, key: str) -> list:
+        taken: list = []
+
+        def take(lst):
+            taken.extend(lst or [])
+            return []
+
+        self.update(key, take, [])
+        return taken
+
+    # --- аренда (lease) -----------------------------------------------------
+
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Берёт или продлевает аренду. True, если владелец теперь owner."""
+        now = time.time()
+
+        def grab(lease):
+            if not lease or lease.get("owner") == owner or lease.get("expires", 0) < now:
+                return {"owner": owner, "expires": now + ttl}
+            return lease
+
+        return self.update(f"lease:{name}", grab)["owner"] == owner
+
+    def release_lease(self, name: str, owner: str) -> None:
+        self.update(f"lease:{name}", lambda lease: None if lease and lease.get("owner") == owner else lease)
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryStore(BaseStore):
+    """Хранилище в памяти процесса. Для разработки, тестов и одиночного запуска."""
+
+    def __init__(self):
+        self._data: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        raw = self._data.get(key)
+        return json.loads(raw) if raw is not None else default
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = json.dumps(value, ensure_ascii=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def update(self, key, fn, default=None):
+        with self._lock:
+            raw = self._data.get(key)
+            value = fn(json.loads(raw) if raw is not None else default)
+            if value is None:
+                self._data.pop(key, None)
+            else:
+                self._data[key] = json.dumps(value, ensure_ascii=False)
+            return value
+
+
+class FileStore(BaseStore):
+    """
+    Каждый ключ — отдельный JSON файл в папке (promo_data.json, report_data.json, ...).
+    Запись идёт через временный файл, update() держит flock на <key>.lock,
+    так что несколько процессов на одной машине не портят данные.
+    """
+
+    def __init__(self, base_dir: str | Path = "."):
+        self.base = Path(base_dir)
+        self.base.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> Path:
+        return self.base / f"{key.replace(':', '_').replace('/', '_')}.json"
+
+    @contextmanager
+    def _locked(self, key: str):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            lock_path = self._path(key).with_suffix(".lock")
+            with open(lock_path, "a") as fh:
+                fcntl.flock(fh, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _read(self, key, default):
+        path = self._path(key)
+        if not path.exists():
+            return default
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception:
+            logging.exception(f"Ошибка чтения {path}, используем значение по умолчанию.")
+            return default
+
+    def _write(self, key, value):
+        path = self._path(key)
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(value, ensure_ascii=False, indent=2), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def get(self, key, default=None):
+        return self._read(key, default)
+
+    def set(self, key, value):
+        with self._locked(key):
+            self._write(key, value)
+
+    def delete(self, key):
+        with self._locked(key):
+            self._path(key).unlink(missing_ok=True)
+
+    def update(self, key, fn, default=None):
+        with self._locked(key):
+            value = fn(self._read(key, default))
+            if value is None:
+                self._path(key).unlink(missing_ok=True)
+            else:
+                self._write(key, value)
+            return value
+
+
+class SQLiteStore(BaseStore):
+    """Общая SQLite база (WAL). Подходит для нескольких процессов с общим диском."""
+
+    def __init__(self, path: str | Path = "bot_state.sqlite3"):
+        self.path = str(path)
+        self._local = threading.local()
+        self._conns: list[sqlite3.Connection] = []  # соединения всех потоков (asyncio.to_thread), для close()
+        self._conns_lock = threading.Lock()
+        with self._conn() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def get(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set(self, key, value):
+        self._conn().execute(
+            "INSERT INTO kv(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value, ensure_ascii=False)),
+        )
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def update(self, key, fn, default=None):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")  # блокировка на запись до COMMIT
+        try:
+            row = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+            value = fn(json.loads(row[0]) if row else default)
+            if value is None:
+                conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            else:
+                conn.execute(
+                    "INSERT INTO kv(key, value) VALUES(?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (key, json.dumps(value, ensure_ascii=False)),
+                )
+            conn.execute("COMMIT")
+            return value
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+
+
+def create_store(backend: str = STATE_BACKEND, path: str = STATE_PATH) -> BaseStore:
+    if backend == "sqlite":
+        return SQLiteStore(path or "bot_state.sqlite3")
+    if backend == "memory":
+        return MemoryStore()
+    return FileStore(path or ".")
+
+
+STORE: BaseStore = create_store()
+
+
+# === FSM поверх общего хранилища ===
+
+class StoreFSMStorage(BaseStorage):
+    """
+    Состояния aiogram FSM в общем хранилище, чтобы форму можно было продолжить на любой реплике.
+    Состояние читается на каждом апдейте, а SQLite при конкуренции реплик ждёт блокировку
+    до 10 с — поэтому обращения к хранилищу идут в потоке, не блокируя цикл событий.
+    """
+
+    def __init__(self, store: BaseStore):
+        self.store = store
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return f"fsm:{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or 0}:{key.destiny}"
+
+    async def _put(self, key: StorageKey, field: str, value: Any) -> None:
+        def put(rec):
+            rec = rec or {}
+            rec[field] = value
+            return rec
+
+        await asyncio.to_thread(self.store.update, self._key(key), put, {})
+
+    async def _get(self, key: StorageKey) -> dict:
+        return await asyncio.to_thread(self.store.get, self._key(key)) or {}
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        await self._put(key, "state", state.state if hasattr(state, "state") else state)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        return (await self._get(key)).get("state")
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        await self._put(key, "data", dict(data))  # копия до передачи в поток
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        return dict((await self._get(key)).get("data") or {})
+
+    async def close(self) -> None:
+        self.store.close()
+
+
+def create_fsm_storage(store: BaseStore = STORE) -> BaseStorage:
+    # Для файлового хранилища (один процесс) FSM остаётся в памяти как раньше
+    if isinstance(store, FileStore):
+        return MemoryStorage()
+    return StoreFSMStorage(store)
+
+
+# === Выбор ведущего экземпляра ===
+
+class LeaderElector:
+    """
+    Аренда с TTL в общем хранилище. Ведущий продлевает её каждые ttl/3 секунд;
+    если он пропал, аренду через ttl заберёт другой экземпляр.
+    Ведущий запускает таймер акции и публикации, апдейты обрабатывают все.
+    Лидерство считается потерянным, как только истёк срок последнего продления,
+    даже если цикл продления завис: иначе два экземпляра считали бы себя ведущими.
+    """
+
+    def __init__(self, store: BaseStore, name: str = "leader", ttl: float = 30, owner: str | None = None):
+        self.store = store
+        self.name = name
+        self.ttl = ttl
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.expires = 0.0  # time.monotonic(), до которого аренда точно наша
+        self._on_elected: list[Callable] = []
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self.expires
+
+    def on_elected(self, callback: Callable) -> None:
+        """Регистрирует корутину-функцию, вызываемую (отдельной задачей) при получении лидерства."""
+        self._on_elected.append(callback)
+
+    async def _run_callback(self, callback: Callable) -> None:
+        try:
+            await callback()
+        except Exception:
+            logging.exception("Ошибка в обработчике получения лидерства.")
+
+    async def try_acquire(self) -> bool:
+        was_leader = self.is_leader
+        started = time.monotonic()  # срок отсчитываем от момента до запроса — с запасом
+        try:
+            acquired = await asyncio.to_thread(self.store.acquire_lease, self.name, self.owner, self.ttl)
+        except Exception:
+            logging.exception("Не удалось продлить аренду ведущего.")
+            acquired = False
+        self.expires = started + self.ttl if acquired else 0.0
+        if acquired and not was_leader:
+            logging.info(f"Экземпляр {self.owner} стал ведущим.")
+            # Обработчики не задерживают продление аренды
+            for callback in self._on_elected:
+                task = asyncio.create_task(self._run_callback(callback))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        elif was_leader and not acquired:
+            logging.warning(f"Экземпляр {self.owner} потерял лидерство.")
+        return acquired
+
+    async def run(self):
+        try:
+            while True:
+                await self.try_acquire()
+                await asyncio.sleep(self.ttl / 3)
+        finally:
+            if self.is_leader:
+                self.store.release_lease(self.name, self.owner)
+            self.expires = 0.0
+
+
+LEADER = LeaderElector(STORE)
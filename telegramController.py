@@ -0,0 +1,155 @@
+# telegramController.py
+import asyncio
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Iterable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+# Тексты ошибок Telegram, означающие что сообщения больше нет
+MISSING_MESSAGE_ERRORS = (
+    "message to edit not found",
+    "message not found",
+    "message to delete not found",
+    "message to copy not found",
+    "message_id_invalid",
+)
+
+
+def is_message_missing(exc: Exception) -> bool:
+    """True, если ошибка Telegram означает что сообщение удалено/не существует."""
+    if not isinstance(exc, TelegramBadRequest):
+        return False
+    text = str(exc).lower()
+    return any(err in text for err in MISSING_MESSAGE_ERRORS)
+
+
+# Служебный чат для проверки сообщений копированием (бот должен в нём состоять).
+# Без него проверка идёт пустым редактированием клавиатуры, см. message_exists.
+PROBE_CHAT_ID = os.getenv("TG_PROBE_CHAT_ID") or ""
+
+
+async def message_exists(bot: Bot, chat_id: int | str, message_id: int, probe_chat_id: int | str = PROBE_CHAT_ID) -> bool:
+    """
+    Проверяет существование сообщения без изменения его содержимого.
+    С probe_chat_id сообщение копируется в служебный чат, копия сразу удаляется.
+    Без него — пустое редактирование клавиатуры: оно либо проходит, либо падает с
+    "message is not modified". Такое редактирование снимает inline-клавиатуру,
+    поэтому без служебного чата проверять можно только сообщения без клавиатуры
+    (отчёт и акция публикуются без неё).
+    """
+    try:
+        if probe_chat_id:
+            copy = await bot.copy_message(chat_id=probe_chat_id, from_chat_id=chat_id, message_id=message_id)
+            try:
+                await bot.delete_message(chat_id=probe_chat_id, message_id=copy.message_id)
+            except Exception as e:
+                logging.warning(f"Не удалось удалить проверочную копию {copy.message_id}: {e}")
+        else:
+            await bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id, reply_markup=None)
+        return True
+    except Exception as e:
+        if is_message_missing(e):
+            return False
+        # Любая другая ошибка (нет прав, слишком старое и т.п.) — считаем что сообщение есть,
+        # чтобы не перепубликовывать лишнего.
+        if "not modified" not in str(e).lower():
+            logging.warning(f"Не удалось проверить сообщение {message_id}: {e}")
+        return True
+
+
+async def probe_messages(
+    bot: Bot,
+    chat_id: int | str,
+    message_ids: Iterable[int],
+    concurrency: int = 8,
+) -> set[int]:
+    """Пачкой проверяет message_id и возвращает те, что ещё существуют в чате."""
+    ids = sorted(set(message_ids))
+    if not ids:
+        return set()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def check(mid: int) -> tuple[int, bool]:
+        async with sem:
+            return mid, await message_exists(bot, chat_id, mid)
+
+    results = await asyncio.gather(*(check(mid) for mid in ids))
+    return {mid for mid, ok in results if ok}
+
+
+# === Лимиты Telegram для оценки времени отправки ===
+
+GROUP_MESSAGES_PER_MINUTE = 20    # не больше 20 сообщений в минуту в одну группу
+CHAT_MESSAGES_PER_SECOND  = 1     # примерно 1 сообщение в секунду в один чат
+API_LATENCY               = 0.15  # среднее время ответа Bot API, с
+
+
+def estimate_send_seconds(messages: int, delays: float = 0.0, group: bool = True, lanes: int = 1) -> float:
+    """
+    Оценка времени отправки messages сообщений в один чат.
+    Первые GROUP_MESSAGES_PER_MINUTE уходят пачкой, дальше — со скоростью лимита.
+    delays — суммарные паузы, которые делает сам бот между вызовами.
+    lanes — сколько тем отправляются параллельно: задержки ответов перекрываются,
+    но лимиты чата общие.
+    """
+    if messages <= 0:
+        return 0.0
+    if group:
+        throttled = max(0, messages - GROUP_MESSAGES_PER_MINUTE) * 60 / GROUP_MESSAGES_PER_MINUTE
+    else:
+        throttled = (messages - 1) / CHAT_MESSAGES_PER_SECOND
+    limited = max(0, messages - RATE_BURST) / RATE_PER_CHAT  # собственный ограничитель бота
+    return max((messages * API_LATENCY + delays) / max(1, lanes), throttled, limited)
+
+
+# === Ограничитель скорости отправки ===
+
+RATE_PER_CHAT = float(os.getenv("TG_RATE_PER_CHAT") or 1.0)  # сообщений в секунду в один чат
+RATE_BURST    = int(os.getenv("TG_RATE_BURST") or 20)        # сколько можно отправить пачкой
+RETRY_ATTEMPTS = 3
+
+
+class RateLimiter:
+    """
+    Token bucket на каждый чат. Медиа-группа тратит столько токенов,
+    сколько в ней фото. Разные чаты друг друга не ждут.
+    """
+
+    def __init__(self, rate: float = RATE_PER_CHAT, burst: int = RATE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: dict[str, list[float]] = {}  # chat → [токены, время обновления]
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    async def acquire(self, chat_id: int | str, cost: int = 1) -> None:
+        key = str(chat_id)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, [float(self.burst), now])
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            cost = min(cost, self.burst)
+            if tokens < cost:
+                await asyncio.sleep((cost - tokens) / self.rate)
+                tokens = cost
+                now = time.monotonic()
+            self._buckets[key] = [tokens - cost, now]
+
+
+LIMITER = RateLimiter()
+
+
+async def call_limited(chat_id: int | str, call: Callable[[], Awaitable], cost: int = 1):
+    """Вызов Bot API через ограничитель с повтором при 429 (retry_after)."""
+    for attempt in range(RETRY_ATTEMPTS):
+        await LIMITER.acquire(chat_id, cost)
+        try:
+            return await call()
+        except TelegramRetryAfter as e:
+            if attempt == RETRY_ATTEMPTS - 1:
+                raise
+            logging.warning(f"429 от Telegram, ждём {e.retry_after} с")
+            await asyncio.sleep(e.retry_after)
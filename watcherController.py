@@ -0,0 +1,222 @@
+# watcherController.py
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+import aiohttp
+
+# === Наблюдение за листом наличия ===
+#
+# Выгрузка опрашивается условными запросами (If-None-Match / If-Modified-Since):
+# без изменений источник отвечает 304 и тело не качается. Если сервер их не
+# поддерживает, изменения определяются по хэшу тела. Интервал адаптивный:
+# сразу после правки — часто, пока таблица не меняется — всё реже.
+# Новая модель сравнивается с прошлой построчно, на выходе типизированные события.
+
+WATCH_FAST = float(os.getenv("SHEET_WATCH_FAST") or 15)   # с, интервал сразу после изменения
+WATCH_SLOW = float(os.getenv("SHEET_WATCH_SLOW") or 300)  # с, предельный интервал в простое
+WATCH_BACKOFF = 1.5
+
+# Типы событий
+ITEM_ADDED          = "item_added"
+ITEM_REMOVED        = "item_removed"
+COUNT_CHANGED       = "count_changed"
+PRICE_CHANGED       = "price_changed"
+ITEM_CHANGED        = "item_changed"         # описание, ссылки, картинки, прибытие
+CITY_TEXT_CHANGED   = "city_text_changed"    # текст до/после блока города
+REPORT_TEXT_CHANGED = "report_text_changed"  # начало/конец отчёта
+
+PRICE_FIELDS = ("price_avail", "price_order")
+SECTIONS = ("availability", "onTheWay")
+
+
+@dataclass(frozen=True)
+class ChangeEvent:
+    type: str
+    city: str | None = None      # slug города, None — изменение всего отчёта
+    section: str | None = None   # availability | onTheWay
+    name: str | None = None      # название позиции
+    old: Any = None
+    new: Any = None
+
+    def __str__(self) -> str:
+        where = "/".join(p for p in (self.city, self.section, self.name) if p)
+        if self.old is None and self.new is None:
+            return f"{self.type} {where}"
+        if self.new is None:
+            return f"{self.type} {where}: {self.old!r}"
+        return f"{self.type} {where}: {self.old!r} → {self.new!r}"
+
+
+def _items_by_key(items: list[dict]) -> dict[tuple, dict]:
+    """Ключ позиции — название и ссылка; одинаковые позиции различаются порядковым номером."""
+    keyed: dict[tuple, dict] = {}
+    seen: dict[tuple, int] = {}
+    for item in items:
+        base = (item["name"], item["link"])
+        seen[base] = seen.get(base, 0) + 1
+        keyed[base + (seen[base],)] = item
+    return keyed
+
+
+def diff_models(old: dict, new: dict) -> list[ChangeEvent]:
+    """Построчное сравнение двух моделей отчёта (parse_report)."""
+    events: list[ChangeEvent] = []
+    for field in ("begin", "finish"):
+        if old.get(field) != new.get(field):
+            events.append(ChangeEvent(REPORT_TEXT_CHANGED, name=field, old=old.get(field), new=new.get(field)))
+
+    for slug in dict.fromkeys([*old["cities"], *new["cities"]]):
+        before = old["cities"].get(slug)
+        after = new["cities"].get(slug)
+        if before is None or after is None:
+            # Город добавлен в реестр или убран из него — меняется структура всего отчёта
+            events.append(ChangeEvent(REPORT_TEXT_CHANGED, name="cities", old=slug if before else None, new=slug if after else None))
+            continue
+        for field in ("intro", "outro"):
+            if before[field] != after[field]:
+                events.append(ChangeEvent(CITY_TEXT_CHANGED, slug, name=field, old=before[field], new=after[field]))
+        for section in SECTIONS:
+            old_items = _items_by_key(before[section]["list"])
+            new_items = _items_by_key(after[section]["list"])
+            for key, item in new_items.items():
+                prev = old_items.get(key)
+                if prev is None:
+                    events.append(ChangeEvent(ITEM_ADDED, slug, section, item["name"], new=item.get("count")))
+                    continue
+                if prev.get("count") != item.get("count"):
+                    events.append(ChangeEvent(COUNT_CHANGED, slug, section, item["name"], prev.get("count"), item.get("count")))
+                for field in PRICE_FIELDS:
+                    if prev.get(field) != item.get(field):
+                        events.append(ChangeEvent(PRICE_CHANGED, slug, section, item["name"], prev.get(field), item.get(field)))
+                other = [f for f in item if f not in PRICE_FIELDS and f != "count" and prev.get(f) != item.get(f)]
+                if other:
+                    events.append(ChangeEvent(ITEM_CHANGED, slug, section, item["name"], old=other))
+            for key, item in old_items.items():
+                if key not in new_items:
+                    events.append(ChangeEvent(ITEM_REMOVED, slug, section, item["name"], old=item.get("count")))
+            # Порядок позиций тоже виден в тексте
+            if [k for k in old_items if k in new_items] != [k for k in new_items if k in old_items]:
+                events.append(ChangeEvent(ITEM_CHANGED, slug, section, old="order"))
+    return events
+
+
+def affected_cities(events: list[ChangeEvent]) -> set[str] | None:
+    """Города, которые нужно обновить; None — изменился весь отчёт."""
+    if any(e.type == REPORT_TEXT_CHANGED for e in events):
+        return None
+    return {e.city for e in events if e.city}
+
+
+class SheetWatcher:
+    """
+    Опрос url с адаптивным интервалом. parse(raw) строит модель, on_change(raw, model, events)
+    вызывается при изменениях. Первый удачный опрос только запоминает модель.
+    Без url лист читается из source (локальная папка, память) и сравнивается по хэшу.
+    """
+
+    def __init__(
+        self,
+        url: str | None,
+        parse: Callable[[bytes], dict],
+        on_change: Callable[[bytes, dict, list[ChangeEvent]], Awaitable[Any]] | None = None,
+        is_active: Callable[[], bool] = lambda: True,
+        fast: float = WATCH_FAST,
+        slow: float = WATCH_SLOW,
+        source=None,
+        tab: str = "stock",
+    ):
+        self.url = url
+        self.source = source  # sheetController.SheetSource, если у листа нет HTTP адреса
+        self.tab = tab
+        self.parse = parse
+        self.on_change = on_change
+        self.is_active = is_active
+        self.fast = fast
+        self.slow = slow
+        self.interval = fast
+        self.model: dict | None = None
+        self.validators: dict[str, str] = {}
+        self.digest: str | None = None
+        self.stats = {"polls": 0, "not_modified": 0, "unchanged": 0, "changes": 0, "errors": 0, "last_change": None}
+
+    async def fetch(self, session: aiohttp.ClientSession) -> bytes | None:
+        """Тело выгрузки или None, если источник ответил 304."""
+        if self.url is None:
+            return await self.source.fetch(self.tab)
+        headers = {}
+        if etag := self.validators.get("ETag"):
+            headers["If-None-Match"] = etag
+        if modified := self.validators.get("Last-Modified"):
+            headers["If-Modified-Since"] = modified
+        async with session.get(self.url, headers=headers, allow_redirects=True) as resp:
+            if resp.status == 304:
+                return None
+            resp.raise_for_status()
+            self.validators = {h: resp.headers[h] for h in ("ETag", "Last-Modified") if h in resp.headers}
+            return await resp.read()
+
+    async def poll(self, session: aiohttp.ClientSession) -> list[ChangeEvent]:
+        """Один опрос. Возвращает события (пустой список — без изменений)."""
+        self.stats["polls"] += 1
+        raw = await self.fetch(session)
+        if raw is None:
+            self.stats["not_modified"] += 1
+            return []
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest == self.digest:
+            self.stats["unchanged"] += 1
+            return []
+        model = await asyncio.to_thread(self.parse, raw)
+        previous, self.model, self.digest = self.model, model, digest
+        if previous is None:
+            return []
+        events = diff_models(previous, model)
+        if events:
+            self.stats["changes"] += 1
+            self.stats["last_change"] = time.time()
+            logging.info(f"Изменения в таблице ({len(events)}): " + "; ".join(map(str, events[:10])))
+            if self.on_change is not None:
+                await self.on_change(raw, model, events)
+        return events
+
+    def next_interval(self, changed: bool) -> float:
+        self.interval = self.fast if changed else min(self.slow, self.interval * WATCH_BACKOFF)
+        return self.interval
+
+    async def run(self):
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+            while True:
+                changed = False
+                if self.is_active():
+                    try:
+                        changed = bool(await self.poll(session))
+                    except Exception:
+                        self.stats["errors"] += 1
+                        logging.exception("Не удалось опросить таблицу")
+                await asyncio.sleep(self.next_interval(changed))
+
+    def stats_text(self) -> str:
+        st = self.stats
+        last = time.strftime("%H:%M:%S", time.localtime(st["last_change"])) if st["last_change"] else "—"
+        return (f"Наблюдение за таблицей: опросов {st['polls']}, 304: {st['not_modified']}, "
+                f"без изменений {st['unchanged']}, изменений {st['changes']} (последнее {last}), "
+                f"ошибок {st['errors']}, интервал {self.interval:.0f} с")
+
+
+if __name__ == "__main__":
+    item = {"name": "Товар", "link": "https://ex.com/1", "desc": "", "count": "2", "images": [], "reviews": "",
+            "price_avail": "1000", "price_order": "", "link_order": "", "arrival": ""}
+    city = {"availability": {"list": [item]}, "onTheWay": {"list": []}, "intro": "", "outro": ""}
+    old = {"begin": "b", "finish": "f", "cities": {"kazan": city, "omsk": city}}
+    new_city = {**city, "availability": {"list": [{**item, "count": "3", "price_avail": "900"}, {**item, "name": "Новый"}]}}
+    new = {"begin": "b", "finish": "f", "cities": {"kazan": new_city, "omsk": city}}
+    events = diff_models(old, new)
+    print("\n".join(map(str, events)))
+    assert sorted(e.type for e in events) == sorted([ITEM_ADDED, COUNT_CHANGED, PRICE_CHANGED])
+    assert affected_cities(events) == {"kazan"}
+    assert affected_cities(diff_models(old, {**new, "begin": "x"})) is None
@@ -0,0 +1,180 @@
+# webhookController.py
+import asyncio
+import hmac
+import json
+import logging
+import os
+import sys
+from pathlib import Path
+
+from aiohttp import ClientSession, web
+from aiogram import Bot, Dispatcher
+
+from metricsController import handle_metrics
+
+# === Настройки webhook режима ===
+
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL") or ""          # Публичный адрес, например https://bot.example.com
+WEBHOOK_PATH     = os.getenv("WEBHOOK_PATH") or "/tg/webhook"   # Путь, на который Telegram шлёт апдейты
+WEBHOOK_SECRET   = os.getenv("WEBHOOK_SECRET") or ""            # X-Telegram-Bot-Api-Secret-Token, обязателен
+WEBHOOK_HOST     = os.getenv("WEBHOOK_HOST") or "0.0.0.0"
+WEBHOOK_PORT     = int(os.getenv("WEBHOOK_PORT") or 8080)
+WEBHOOK_WORKERS  = int(os.getenv("WEBHOOK_WORKERS") or 8)       # Сколько апдейтов обрабатывается одновременно
+WEBHOOK_QUEUE    = int(os.getenv("WEBHOOK_QUEUE") or 1000)      # Максимум апдейтов в очереди на процесс
+WEBHOOK_SET      = (os.getenv("WEBHOOK_SET") or "1") == "1"     # Регистрировать webhook в Telegram при старте
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def shard_key(update: dict) -> int:
+    """
+    Чат (или пользователь) апдейта: по нему апдейт попадает в очередь своего обработчика,
+    чтобы шаги FSM одного чата шли по порядку, как при polling.
+    """
+    for name, obj in update.items():
+        if name == "update_id" or not isinstance(obj, dict):
+            continue
+        chat = obj.get("chat") or (obj.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        if obj.get("from"):
+            return obj["from"]["id"]
+    return update.get("update_id", 0)
+
+
+class WebhookServer:
+    """
+    Принимает апдейты по HTTP, сразу отвечает 200 и отдаёт их в очереди
+    WEBHOOK_WORKERS обработчиков. Апдейты одного чата всегда идут в одну очередь
+    и обрабатываются по порядку, разные чаты — параллельно. Состояния процесс
+    не держит, поэтому несколько реплик можно поставить за балансировщик.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dp: Dispatcher,
+        secret: str = WEBHOOK_SECRET,
+        path: str = WEBHOOK_PATH,
+        workers: int = WEBHOOK_WORKERS,
+        queue_size: int = WEBHOOK_QUEUE,
+    ):
+        if not secret:
+            # Без секрета любой, кто узнал URL, может прислать апдейт от имени администратора
+            raise ValueError("Webhook режим требует WEBHOOK_SECRET (A-Z a-z 0-9 _ -, до 256 символов).")
+        self.bot = bot
+        self.dp = dp
+        self.secret = secret
+        self.path = path
+        self.workers = max(1, workers)
+        self.queues: list[asyncio.Queue[dict]] = [
+            asyncio.Queue(maxsize=max(1, queue_size // self.workers)) for _ in range(self.workers)
+        ]
+        self._tasks: list[asyncio.Task] = []
+
+    # --- HTTP ---------------------------------------------------------------
+
+    def check_secret(self, request: web.Request) -> bool:
+        token = request.headers.get(SECRET_HEADER, "")
+        return hmac.compare_digest(token.encode(), self.secret.encode())
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not self.check_secret(request):
+            logging.warning("Webhook: запрос с неверным секретом отклонён.")
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except Exception:
+            return web.Response(status=400)
+        try:
+            self.queues[shard_key(update) % self.workers].put_nowait(update)
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            logging.warning("Webhook: очередь переполнена, апдейт отклонён.")
+            return web.Response(status=503)
+        return web.Response(status=200)
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "queue": self.pending(), "workers": self.workers})
+
+    def pending(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    # --- обработка ----------------------------------------------------------
+
+    async def worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception:
+                logging.exception(f"Webhook: ошибка обработки апдейта {update.get('update_id')}")
+            finally:
+                queue.task_done()
+
+    async def on_startup(self, app: web.Application):
+        self._tasks = [asyncio.create_task(self.worker(q)) for q in self.queues]
+        await self.dp.emit_startup(bot=self.bot, dispatcher=self.dp, **self.dp.workflow_data)
+        if WEBHOOK_SET and WEBHOOK_BASE_URL:
+            # Повторный вызов с теми же параметрами безопасен, поэтому его делает каждая реплика
+            await self.bot.set_webhook(
+                url=WEBHOOK_BASE_URL.rstrip("/") + self.path,
+                secret_token=self.secret,
+                allowed_updates=self.dp.resolve_used_update_types(),
+                max_connections=max(self.workers * 2, 40),
+            )
+            logging.info(f"Webhook зарегистрирован: {WEBHOOK_BASE_URL}{self.path}")
+
+    async def on_shutdown(self, app: web.Application):
+        # Даём дообработать уже принятые апдейты
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self.queues)), timeout=10)
+        except asyncio.TimeoutError:
+            logging.warning(f"Webhook: не обработано {self.pending()} апдейтов при остановке.")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.dp.emit_shutdown(bot=self.bot, dispatcher=self.dp, **self.dp.workflow_data)
+        await self.bot.session.close()
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/healthz", self.handle_health)
+        app.router.add_get("/metrics", handle_metrics)
+        app.on_startup.append(self.on_startup)
+        app.on_shutdown.append(self.on_shutdown)
+        return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT):
+    """Запускает aiohttp сервер и ждёт до остановки процесса."""
+    server = WebhookServer(bot, dp)
+    runner = web.AppRunner(server.build_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logging.info(f"Webhook сервер слушает {host}:{port}{server.path}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+# === Локальная проверка: отправка записанных апдейтов POST-запросами ===
+
+async def post_updates(file: Path, url: str, secret: str = WEBHOOK_SECRET):
+    """Файл — JSON-массив апдейтов или по одному апдейту на строку."""
+    raw = file.read_text(encoding="utf-8").strip()
+    updates = json.loads(raw) if raw.startswith("[") else [json.loads(ln) for ln in raw.splitlines() if ln.strip()]
+    headers = {SECRET_HEADER: secret} if secret else {}
+    async with ClientSession() as session:
+        for upd in updates:
+            async with session.post(url, json=upd, headers=headers) as resp:
+                print(upd.get("update_id"), resp.status)
+
+
+if __name__ == "__main__":
+    # python webhookController.py updates.json [http://127.0.0.1:8080/tg/webhook]
+    target = sys.argv[2] if len(sys.argv) > 2 else f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    asyncio.run(post_updates(Path(sys.argv[1]), target))